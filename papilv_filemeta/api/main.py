@@ -1,23 +1,46 @@
 # filemeta_project/api.py (This is your main application file now)
 
 import os
-from fastapi import FastAPI, HTTPException, Query, Depends, APIRouter, status
+import json
+from fastapi import FastAPI, HTTPException, Query, Header, Depends, APIRouter, Request, Response, status
+from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
 from fastapi.security import OAuth2PasswordRequestForm
 from typing import List, Optional, Dict, Any
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import NoResultFound, OperationalError, IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 from datetime import timedelta
 
 # Corrected absolute imports for modules within papilv_filemeta
 from papilv_filemeta.database import init_db, get_db, create_user, get_user_by_username
 from papilv_filemeta.metadata_manager import ( # Standardized function names
-    add_file_metadata,
-    list_files,          # Renamed from get_all_files_for_listing
+    upsert_file_metadata,
+    add_file_metadata_batch,
+    ON_CONFLICT_MODES,
+    list_files_page,     # Renamed from get_all_files_for_listing
     get_file_metadata,   # Renamed from get_file_by_id
-    search_files,        # Renamed from search_files_by_criteria
+    search_files_page,   # Renamed from search_files_by_criteria
+    query_files_page,
+    browse_files,
+    FILE_LIST_ORDERS,
+    SPARSE_FILE_FIELDS,
     update_file_tags,
-    delete_file_metadata
+    iter_retag_batches,
+    file_selector_conditions,
+    delete_file_metadata,
+    iter_delete_batches,
+    delete_user,
+    DELETE_BATCH_SIZE,
+    DEFAULT_SEARCH_LIMIT
 )
+from papilv_filemeta.pipeline import run_ingest_pipeline
+from papilv_filemeta.hashing import ContentHasher, HASH_ALGORITHMS, DEFAULT_HASH_ALGORITHM
+from papilv_filemeta.duplicates import find_duplicates
+from papilv_filemeta.facets import compute_facets, FACET_VALUE_LIMIT, MAX_FACET_VALUE_LIMIT
+from papilv_filemeta.jobs import submit_job, get_job, list_jobs, job_progress, cancel_job
 from papilv_filemeta.models import File as DBFile, User as DBUser # Alias DB models to avoid Pydantic name clash
 from papilv_filemeta.api.auth import get_password_hash, verify_password, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
 from papilv_filemeta.api.dependencies import get_current_user, get_current_admin_user
@@ -27,8 +50,17 @@ from papilv_filemeta.api.schemas import ( # Assuming schemas are in papilv_filem
     UserCreateRequest,
     UserResponse,
     Token,
-    FileUpdate           # Renamed from UpdateTagsRequest, matches previous api.py structure
+    FileUpdate,          # Renamed from UpdateTagsRequest, matches previous api.py structure
+    BulkRetagRequest,
+    ScanRequest,
+    ScanResponse,
+    JobCreate,
+    JobResponse,
+    FilePage,
+    BrowseResponse,
+    FacetsResponse
 )
+from papilv_filemeta.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 
 
 app = FastAPI(
@@ -54,6 +86,7 @@ def on_startup():
 admin_router = APIRouter(prefix="/admin", tags=["Admin"], dependencies=[Depends(get_current_admin_user)])
 public_router = APIRouter(tags=["Auth & Public"])
 file_router = APIRouter(prefix="/files", tags=["Files"], dependencies=[Depends(get_current_user)])
+job_router = APIRouter(prefix="/jobs", tags=["Jobs"], dependencies=[Depends(get_current_user)])
 
 
 # --- Public Endpoints (Login & Root) ---
@@ -113,35 +146,55 @@ async def get_all_users(db: Session = Depends(get_db)): # No current_user needed
 @admin_router.delete("/users/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_user_api(user_id: int, db: Session = Depends(get_db)): # No current_user needed here due to router dependency
     """
-    Deletes a user account (Admin only).
+    Deletes a user account and all the files they own (Admin only).
+    The files are deleted in batches, without loading them (see metadata_manager.delete_user()).
     """
-    user_to_delete = db.query(DBUser).filter(DBUser.id == user_id).first() # Use DBUser alias
-    if not user_to_delete:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    
     try:
-        db.delete(user_to_delete)
-        db.commit()
-    except IntegrityError as e: # Catch potential foreign key constraints
-        db.rollback()
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Cannot delete user: {e}. Check if files are owned by this user.")
+        await run_in_threadpool(delete_user, db, user_id)
+    except NoResultFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to delete user: {e}")
     return
 
 
 # --- File Management Endpoints (Requires Authentication, User or Admin) ---
 
+ON_CONFLICT_DESCRIPTION = (
+    "For an already cataloged path: 'error' (409), 'skip' (keep it as is) or 'update' (refresh its "
+    "inferred metadata and add/modify the given tags; only your own files unless you are an admin)."
+)
+
+
+def _check_on_conflict(on_conflict: str):
+    if on_conflict not in ON_CONFLICT_MODES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Invalid on_conflict '{on_conflict}'. Choose one of: {', '.join(ON_CONFLICT_MODES)}.")
+
+
 # Renamed AddFileRequest to FileCreate for consistency with previous discussion
 @file_router.post("/", response_model=FileResponse, status_code=status.HTTP_201_CREATED)
-async def create_file_metadata_api(file_data: FileCreate, current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
+async def create_file_metadata_api(
+    file_data: FileCreate,
+    response: Response,
+    on_conflict: str = Query("error", description=ON_CONFLICT_DESCRIPTION),
+    current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)
+):
     """
     Adds a new metadata record for a file, associating it with the logged-in user.
+    Answers 201 if the record was created, 200 if it already existed (on_conflict=skip/update).
     """
+    _check_on_conflict(on_conflict)
     try:
         # Pass current_user.id as owner_id to metadata_manager
-        file_record = add_file_metadata(db, file_data.filepath, file_data.custom_tags, owner_id=current_user.id)
+        file_id, created = upsert_file_metadata(
+            db, file_data.filepath, file_data.custom_tags, owner_id=current_user.id,
+            on_conflict=on_conflict, owned_only=current_user.role != 'admin'
+        )
+        if not created:
+            response.status_code = status.HTTP_200_OK
+        file_record = get_file_metadata(db, file_id)
+        response.headers["ETag"] = _etag(file_record.version)
         return file_record # Pydantic model will handle conversion from DBFile
     except FileNotFoundError as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
@@ -153,32 +206,387 @@ async def create_file_metadata_api(file_data: FileCreate, current_user: DBUser =
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred: {e}")
 
 
-@file_router.get("/", response_model=List[FileResponse])
-async def list_all_files_api(current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
+@file_router.post("/scan", response_model=ScanResponse)
+async def scan_directory_api(scan_request: ScanRequest, current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
     """
-    Retrieves all file metadata records. Admins see all; regular users only see their own.
+    Registers every file under a server directory in bulk, using the parallel
+    inference pipeline. New files are owned by the logged-in user; already cataloged paths are skipped.
+    The scan runs in the threadpool, so the event loop keeps serving other
+    requests, but this request waits for it: queue large directories as a
+    scan job (POST /jobs/) instead.
     """
+    def _scan():
+        hasher = ContentHasher(scan_request.hash_algorithm) if scan_request.hash_contents else None
+        try:
+            return run_ingest_pipeline(
+                db,
+                scan_request.directory,
+                scan_request.custom_tags,
+                owner_id=current_user.id,
+                created_by=current_user.username,
+                workers=scan_request.workers,
+                batch_size=scan_request.batch_size,
+                hasher=hasher,
+                extract_content=scan_request.extract_content
+            )
+        finally:
+            if hasher:
+                hasher.close()
+
     try:
-        if current_user.role == 'admin':
-            files = list_files(db) # Uses the new function name from metadata_manager
+        return await run_in_threadpool(_scan)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except OperationalError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database operational error: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred: {e}")
+
+
+BULK_BATCH_SIZE = 1000 # NDJSON records written per transaction by POST /files/bulk
+MAX_BULK_LINE_BYTES = 1024 * 1024 # A single NDJSON record may not exceed this size
+
+
+class _RequestBodyStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse for endpoints that keep reading the request body while
+    streaming the response. The default implementation may listen for client
+    disconnects on the same receive channel, which would swallow body chunks;
+    a disconnect still surfaces as a failed send.
+    """
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+
+def _bulk_error_status(error: Exception) -> int:
+    """Maps a per-item bulk error to the status code the single-item endpoint would return."""
+    if isinstance(error, FileNotFoundError):
+        return status.HTTP_404_NOT_FOUND
+    if isinstance(error, ValueError):
+        return status.HTTP_409_CONFLICT
+    return status.HTTP_500_INTERNAL_SERVER_ERROR
+
+
+@file_router.post("/bulk")
+async def bulk_create_file_metadata_api(
+    request: Request,
+    on_conflict: str = Query("error", description=ON_CONFLICT_DESCRIPTION),
+    current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)
+):
+    """
+    Adds many metadata records from an NDJSON request body, one FileCreate object per line.
+
+    The body is read incrementally and written in batches of BULK_BATCH_SIZE
+    records per transaction. The response streams one NDJSON result per input
+    line, in order: {"line", "filepath", "id", "created"} on success or
+    {"line", "status", "error"} on failure, followed by a final {"summary": ...} line.
+    """
+    _check_on_conflict(on_conflict)
+    owner_id = current_user.id
+    created_by = current_user.username
+    owned_only = current_user.role != 'admin'
+
+    async def _lines():
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *complete, buffer = buffer.split(b"\n")
+            for line in complete:
+                yield line
+            if len(buffer) > MAX_BULK_LINE_BYTES:
+                raise ValueError(f"NDJSON record exceeds {MAX_BULK_LINE_BYTES} bytes.")
+        if buffer:
+            yield buffer
+
+    def _error(line_number: int, status_code: int, message: str) -> str:
+        return json.dumps({"line": line_number, "status": status_code, "error": message}, ensure_ascii=False) + "\n"
+
+    async def _write_batch(batch):
+        # Invalid records stay in the batch (as ValidationErrors) so results keep the input order
+        records = [(line_number, record) for line_number, record in batch if not isinstance(record, ValidationError)]
+        items = [{"filepath": record.filepath, "custom_tags": record.custom_tags} for _, record in records]
+        results = dict(zip(
+            [line_number for line_number, _ in records],
+            await run_in_threadpool(add_file_metadata_batch, db, items, owner_id, created_by, on_conflict, owned_only)
+            if items else []
+        ))
+        for line_number, record in batch:
+            result = results.get(line_number)
+            if result is None:
+                summary["failed"] += 1
+                yield _error(line_number, status.HTTP_422_UNPROCESSABLE_ENTITY, str(record))
+            elif "error" in result:
+                summary["failed"] += 1
+                yield _error(line_number, _bulk_error_status(result["error"]), str(result["error"]))
+            else:
+                if result["created"]:
+                    summary["created"] += 1
+                else:
+                    summary["updated" if on_conflict == "update" else "skipped"] += 1
+                yield json.dumps({"line": line_number, "filepath": result["filepath"], "id": result["id"],
+                                  "created": result["created"]}, ensure_ascii=False) + "\n"
+
+    summary = {"received": 0, "created": 0, "updated": 0, "skipped": 0, "failed": 0}
+
+    async def _stream():
+        batch = []
+        line_number = 0
+        try:
+            async for line in _lines():
+                line_number += 1
+                if not line.strip():
+                    continue
+                summary["received"] += 1
+                try:
+                    batch.append((line_number, FileCreate.model_validate_json(line)))
+                except ValidationError as e:
+                    batch.append((line_number, e))
+                if len(batch) >= BULK_BATCH_SIZE:
+                    async for result_line in _write_batch(batch):
+                        yield result_line
+                    batch = []
+            if batch:
+                async for result_line in _write_batch(batch):
+                    yield result_line
+            yield json.dumps({"summary": summary}) + "\n"
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            yield json.dumps({"error": f"An unexpected error occurred: {e}", "summary": summary}) + "\n"
+        finally:
+            db.close() # The request's session may outlive the handler while streaming
+
+    return _RequestBodyStreamingResponse(_stream(), media_type="application/x-ndjson")
+
+
+# --- Conditional requests ---
+# A file's ETag is its row version (File.version), so it changes with every write to the file or its tags.
+IF_NONE_MATCH_DESCRIPTION = "ETag(s) of a copy the client has; answered with 304 Not Modified while still current."
+IF_MATCH_DESCRIPTION = "ETag(s) the file must still have for the change to apply; otherwise 412 Precondition Failed."
+
+
+def _etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def _if_none_match(if_none_match: str, version: int) -> bool:
+    """Whether an If-None-Match header matches the version (weak comparison)."""
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return "*" in tags or _etag(version) in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+
+def _if_match_versions(if_match: Optional[str]) -> Optional[List[int]]:
+    """The versions an If-Match header accepts (strong comparison); None without a header or for '*'."""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    tags = [tag.strip() for tag in if_match.split(',')]
+    return [int(tag[1:-1]) for tag in tags if len(tag) > 2 and tag[0] == tag[-1] == '"' and tag[1:-1].isdigit()]
+
+
+# --- Sparse fieldsets ---
+# ?fields=filename,owner and/or ?tag_keys=project,stage select only part of each record.
+# They are passed down to metadata_manager, which then loads only those columns and tags.
+FIELDS_DESCRIPTION = f"Comma-separated fields to return, from: {', '.join(SPARSE_FILE_FIELDS)}. Default: all."
+TAG_KEYS_DESCRIPTION = "Comma-separated custom tag keys; only these tags are loaded and returned."
+
+
+def _split_param(value: Optional[str]) -> Optional[List[str]]:
+    return None if value is None else [part.strip() for part in value.split(',') if part.strip()]
+
+
+def _sparse_file(file_record: DBFile, fields: Optional[List[str]], tag_keys: Optional[List[str]]) -> Dict[str, Any]:
+    """Builds the response for one file from only the loaded fields, keyed like FileResponse."""
+    fields = list(SPARSE_FILE_FIELDS) if fields is None else fields
+    if tag_keys is not None and "tags" not in fields:
+        fields = fields + ["tags"]
+    response = {}
+    for field in fields:
+        if field == "tags":
+            value = [tag.to_dict() for tag in file_record.tags]
         else:
-            # Assumes File.owner is an Integer (foreign key to User.id)
-            files = db.query(DBFile).filter(DBFile.owner == current_user.id).all() 
-        
-        return files # Pydantic model will handle conversion from List[DBFile]
+            value = getattr(file_record, field)
+        response[FileResponse.model_fields[field].alias] = value
+    return response
+
+
+def _file_page_response(page, fields: Optional[List[str]], tag_keys: Optional[List[str]]):
+    if fields is None and tag_keys is None:
+        return page # Pydantic model will handle conversion of the List[DBFile] items
+    return JSONResponse(jsonable_encoder({
+        "items": [_sparse_file(file_record, fields, tag_keys) for file_record in page.items],
+        "next_cursor": page.next_cursor,
+        "estimated_total": page.estimated_total,
+    }))
+
+
+@file_router.get("/", response_model=FilePage)
+async def list_all_files_api(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Files per page."),
+    cursor: Optional[str] = Query(None, description="The next_cursor of the previous page."),
+    order: str = Query("id", description=f"One of: {', '.join(FILE_LIST_ORDERS)} (most recently updated first)."),
+    estimate: bool = Query(False, description="Include a planner estimate of the total number of files."),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    tag_keys: Optional[str] = Query(None, description=TAG_KEYS_DESCRIPTION),
+    current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)
+):
+    """
+    Retrieves file metadata records one page at a time. Admins see all; regular users only see their own.
+    """
+    try:
+        # Assumes File.owner is an Integer (foreign key to User.id)
+        owner_id = None if current_user.role == 'admin' else current_user.id
+        fields_list, tag_keys_list = _split_param(fields), _split_param(tag_keys)
+        page = list_files_page(db, owner_id=owner_id, limit=limit, cursor=cursor, order=order, with_estimate=estimate,
+                               fields=fields_list, tag_keys=tag_keys_list)
+        return _file_page_response(page, fields_list, tag_keys_list)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except OperationalError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database operational error: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred: {e}")
+
+
+@file_router.get("/duplicates")
+async def find_duplicate_files_api(
+    min_size: int = Query(1, ge=0, description="Ignore files smaller than this many bytes."),
+    hash_algorithm: str = Query(DEFAULT_HASH_ALGORITHM, description=f"One of: {', '.join(HASH_ALGORITHMS)}."),
+    current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)
+):
+    """
+    Streams groups of files with identical contents as NDJSON, one group per line,
+    followed by a final {"summary": ...} line. Admins search all files; regular users search their own files.
+    """
+    if hash_algorithm not in HASH_ALGORITHMS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unsupported hash algorithm '{hash_algorithm}'.")
+
+    owner_id_for_search = None if current_user.role == 'admin' else current_user.id
+    finder = find_duplicates(db, owner_id=owner_id_for_search, min_size=min_size, algorithm=hash_algorithm)
+
+    def _stream():
+        try:
+            for group in finder:
+                yield json.dumps(group, ensure_ascii=False) + "\n"
+            yield json.dumps({"summary": finder.stats}) + "\n"
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            yield json.dumps({"error": f"An unexpected error occurred: {e}"}) + "\n"
+        finally:
+            db.close() # The request's session may outlive the handler while streaming
+
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
+
+
+@file_router.get("/browse", response_model=BrowseResponse)
+async def browse_files_api(
+    prefix: str = Query("", description="Path prefix to list, e.g. '/data/projects/x/'."),
+    delimiter: str = Query("/", description="Groups deeper paths into common prefixes; empty lists everything under prefix."),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Files per page, in path order."),
+    cursor: Optional[str] = Query(None, description="The next_cursor of the previous page."),
+    current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)
+):
+    """
+    Lists the immediate children of a path prefix and its common sub-prefixes with file counts and total bytes,
+    like a directory listing. Admins browse all files; regular users browse their own files.
+    """
+    try:
+        owner_id_for_browse = None if current_user.role == 'admin' else current_user.id
+        result = browse_files(db, prefix, delimiter=delimiter or None, owner_id=owner_id_for_browse,
+                              limit=limit, cursor=cursor)
+        return BrowseResponse(
+            prefix=result.prefix,
+            delimiter=result.delimiter,
+            common_prefixes=result.common_prefixes,
+            files=result.files.items,
+            file_count=result.file_count,
+            total_bytes=result.total_bytes,
+            next_cursor=result.files.next_cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except OperationalError as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database operational error: {e}")
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred: {e}")
 
 
+@file_router.get("/facets", response_model=FacetsResponse)
+async def file_facets_api(
+    keys: Optional[str] = Query(None, description="Comma-separated facets: 'mime_type' and/or custom tag keys ('tag.<key>' for a tag named like a facet). Default: mime_type."),
+    q: Optional[str] = Query(None, description="Only count files matching this query expression (see /files/query)."),
+    limit: int = Query(FACET_VALUE_LIMIT, ge=1, le=MAX_FACET_VALUE_LIMIT, description="Most frequent values returned per facet."),
+    materialized: bool = Query(False, description="Answer catalog-wide requests from the precomputed counts ('filemeta setup-facets')."),
+    current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)
+):
+    """
+    Counts files per value of each facet, plus a size histogram, for the files matching an optional query.
+    Admins count all files; regular users count their own files.
+    """
+    try:
+        owner_id_for_facets = None if current_user.role == 'admin' else current_user.id
+        return compute_facets(db, keys=_split_param(keys), expression=q, owner_id=owner_id_for_facets,
+                              limit=limit, materialized=materialized)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except OperationalError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database operational error: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred: {e}")
+
+
+@file_router.get("/query", response_model=FilePage)
+async def query_file_metadata_api(
+    q: str = Query(..., description="Query expression, e.g. 'project=alpha AND retention_days>=30 AND size>1GB'."),
+    limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_PAGE_SIZE, description="Files per page, in ID order."),
+    cursor: Optional[str] = Query(None, description="The next_cursor of the previous page."),
+    estimate: bool = Query(False, description="Include a planner estimate of the total number of matches."),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    tag_keys: Optional[str] = Query(None, description=TAG_KEYS_DESCRIPTION),
+    current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)
+):
+    """
+    Finds files matching a query over tags, inferred metadata and file fields, one page at a time.
+    Admins query all files; regular users query their own files.
+    """
+    try:
+        owner_id_for_query = None if current_user.role == 'admin' else current_user.id
+        fields_list, tag_keys_list = _split_param(fields), _split_param(tag_keys)
+        page = query_files_page(db, q, owner_id=owner_id_for_query, limit=limit, cursor=cursor, with_estimate=estimate,
+                                fields=fields_list, tag_keys=tag_keys_list)
+        return _file_page_response(page, fields_list, tag_keys_list)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except OperationalError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database operational error: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred: {e}")
+
 @file_router.get("/{file_id}", response_model=FileResponse)
-async def get_single_file_metadata_api(file_id: int, current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_single_file_metadata_api(
+    file_id: int,
+    response: Response,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    tag_keys: Optional[str] = Query(None, description=TAG_KEYS_DESCRIPTION),
+    if_none_match: Optional[str] = Header(None, description=IF_NONE_MATCH_DESCRIPTION),
+    current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)
+):
     """
     Retrieves a single file metadata record by ID. Users can only access their own files or if admin.
+    The response carries the record's ETag; with a matching If-None-Match it is 304 Not Modified,
+    decided from the file's owner and version alone, without loading or serializing the record.
     """
     try:
-        file_record = get_file_metadata(db, file_id) # Uses the new function name from metadata_manager
+        if if_none_match is not None:
+            current = get_file_metadata(db, file_id, fields=[]) # id, owner and version only
+            if current_user.role != 'admin' and current.owner != current_user.id:
+                raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to access this file.")
+            if _if_none_match(if_none_match, current.version):
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": _etag(current.version)})
+            db.expunge(current) # Loaded in full below
+
+        fields_list, tag_keys_list = _split_param(fields), _split_param(tag_keys)
+        file_record = get_file_metadata(db, file_id, fields=fields_list, tag_keys=tag_keys_list)
         if not file_record:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"File with ID {file_id} not found.")
 
@@ -186,7 +594,15 @@ async def get_single_file_metadata_api(file_id: int, current_user: DBUser = Depe
         if current_user.role != 'admin' and file_record.owner != current_user.id:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to access this file.")
 
+        headers = {"ETag": _etag(file_record.version)}
+        if fields_list is not None or tag_keys_list is not None:
+            return JSONResponse(jsonable_encoder(_sparse_file(file_record, fields_list, tag_keys_list)), headers=headers)
+        response.headers.update(headers)
         return file_record # Pydantic model will handle conversion from DBFile
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except NoResultFound as e: # Catch if get_file_metadata raises NoResultFound
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
     except OperationalError as e:
@@ -195,13 +611,20 @@ async def get_single_file_metadata_api(file_id: int, current_user: DBUser = Depe
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred: {e}")
 
 
-@file_router.get("/search/", response_model=List[FileResponse])
+@file_router.get("/search/", response_model=FilePage)
 async def search_file_metadata_api(
     keywords: str = Query(..., description="Comma-separated keywords to search for."), # Changed to str for consistency
+    limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_PAGE_SIZE, description="Files per page, best matches first."),
+    match: str = Query("fulltext", description="'fulltext', 'substring' (filename/filepath fragments) or 'fuzzy' (typo-tolerant)."),
+    cursor: Optional[str] = Query(None, description="The next_cursor of the previous page."),
+    estimate: bool = Query(False, description="Include a planner estimate of the total number of matches."),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    tag_keys: Optional[str] = Query(None, description=TAG_KEYS_DESCRIPTION),
     current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)
 ):
     """
-    Searches for files by keywords. Admins search all files; regular users search their own files.
+    Searches for files by keywords, ranked by relevance (file name matches first), one page at a time.
+    Admins search all files; regular users search their own files.
     """
     keywords_list = [k.strip() for k in keywords.split(',') if k.strip()]
     if not keywords_list:
@@ -210,21 +633,69 @@ async def search_file_metadata_api(
     try:
         # Pass owner_id for search if not admin
         owner_id_for_search = None if current_user.role == 'admin' else current_user.id
-        files = search_files(db, keywords_list, owner_id=owner_id_for_search) # Uses the new function name from metadata_manager
+        fields_list, tag_keys_list = _split_param(fields), _split_param(tag_keys)
+        page = search_files_page(db, keywords_list, owner_id=owner_id_for_search, limit=limit, match=match,
+                                 cursor=cursor, with_estimate=estimate,
+                                 fields=fields_list, tag_keys=tag_keys_list) # Uses the new function name from metadata_manager
         
-        return files # Pydantic model will handle conversion from List[DBFile]
+        return _file_page_response(page, fields_list, tag_keys_list)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except OperationalError as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database operational error: {e}")
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred: {e}")
 
+@file_router.patch("/tags:bulk")
+async def bulk_retag_files_api(retag: BulkRetagRequest, current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    """
+    Adds/modifies and removes custom tags on every file matched by the selector (file IDs, path prefix and/or
+    query expression), in batches of batch_size files per transaction. Streams NDJSON: one {"progress": ...}
+    line per committed batch, then a final {"summary": ...} line. Admins retag any files; regular users their own.
+    """
+    owner_id_for_retag = None if current_user.role == 'admin' else current_user.id
+    if not retag.tags_to_add_modify and not retag.tags_to_remove:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Nothing to change. Provide tags to add/modify and/or tags to remove.")
+    try:
+        file_selector_conditions(retag.file_ids, retag.path_prefix, retag.q) # Reject a bad selector before streaming
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    batches = iter_retag_batches(
+        db, file_ids=retag.file_ids, path_prefix=retag.path_prefix, expression=retag.q,
+        tags_to_add_modify=retag.tags_to_add_modify, tags_to_remove=retag.tags_to_remove,
+        owner_id=owner_id_for_retag, batch_size=retag.batch_size
+    )
+
+    def _stream():
+        summary = {"files": 0, "tags_written": 0, "tags_removed": 0, "batches": 0}
+        try:
+            for summary in batches:
+                yield json.dumps({"progress": summary}) + "\n"
+            yield json.dumps({"summary": summary}) + "\n"
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            yield json.dumps({"error": f"An unexpected error occurred: {e}", "summary": summary}) + "\n"
+        finally:
+            db.close() # The request's session may outlive the handler while streaming
+
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
+
+
 # Renamed UpdateTagsRequest to FileUpdate for consistency with previous discussion
 @file_router.patch("/{file_id}", response_model=FileResponse) # Changed to PATCH for partial updates
-async def update_file_custom_tags_api(file_id: int, update_data: FileUpdate, current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
+async def update_file_custom_tags_api(
+    file_id: int,
+    update_data: FileUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None, description=IF_MATCH_DESCRIPTION),
+    current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)
+):
     """
     Updates or adds custom tags and/or filepath for a specific file. Only file owner or admin can update.
+    With If-Match, the update only applies if the file still has that ETag (checked atomically), else 412.
     """
-    file_to_update = get_file_metadata(db, file_id) # Get file first to check ownership
+    file_to_update = get_file_metadata(db, file_id, fields=["owner"]) # Get file first to check ownership (owner only)
     if not file_to_update:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"File with ID {file_id} not found.")
 
@@ -240,11 +711,15 @@ async def update_file_custom_tags_api(file_id: int, update_data: FileUpdate, cur
             tags_to_add_modify=update_data.tags_to_add_modify,
             tags_to_remove=update_data.tags_to_remove,
             new_filepath=update_data.new_filepath,
-            overwrite_existing=update_data.overwrite_existing
+            overwrite_existing=update_data.overwrite_existing,
+            expected_versions=_if_match_versions(if_match)
         )
+        response.headers["ETag"] = _etag(updated_file.version)
         return updated_file # Pydantic model will handle conversion from DBFile
     except NoResultFound as e: # Catch if update_file_tags raises NoResultFound
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except StaleDataError as e: # Modified since the client's If-Match ETag
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail=str(e))
     except ValueError as e: # From update_file_tags for invalid filepath, conflicts etc.
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except OperationalError as e:
@@ -253,12 +728,52 @@ async def update_file_custom_tags_api(file_id: int, update_data: FileUpdate, cur
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred: {e}")
 
 
+@file_router.delete("/")
+async def bulk_delete_files_api(
+    file_ids: Optional[List[int]] = Query(None, description="Select these file IDs (repeat the parameter)."),
+    path_prefix: Optional[str] = Query(None, description="Select every file below this directory."),
+    q: Optional[str] = Query(None, description="Select the files matching this query expression."),
+    batch_size: int = Query(DELETE_BATCH_SIZE, ge=1, le=100000, description="Files deleted per transaction."),
+    current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)
+):
+    """
+    Deletes the metadata and tags of every file matched by the selector (file IDs, path prefix and/or query
+    expression), in batches of batch_size files per transaction. Streams NDJSON: one {"progress": ...} line
+    per committed batch, then a final {"summary": ...} line. Admins delete any files; regular users their own.
+    """
+    owner_id_for_delete = None if current_user.role == 'admin' else current_user.id
+    try:
+        batches = iter_delete_batches(db, file_ids=file_ids, path_prefix=path_prefix, expression=q,
+                                      owner_id=owner_id_for_delete, batch_size=batch_size)
+    except ValueError as e: # Rejects a bad selector before streaming
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    def _stream():
+        summary = {"files": 0, "batches": 0}
+        try:
+            for summary in batches:
+                yield json.dumps({"progress": summary}) + "\n"
+            yield json.dumps({"summary": summary}) + "\n"
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            yield json.dumps({"error": f"An unexpected error occurred: {e}", "summary": summary}) + "\n"
+        finally:
+            db.close() # The request's session may outlive the handler while streaming
+
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
+
+
 @file_router.delete("/{file_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_file_metadata_api(file_id: int, current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
+async def delete_file_metadata_api(
+    file_id: int,
+    if_match: Optional[str] = Header(None, description=IF_MATCH_DESCRIPTION),
+    current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)
+):
     """
     Deletes a file metadata record. Only file owner or admin can delete.
+    With If-Match, the file is only deleted if it still has that ETag, else 412.
     """
-    file_to_delete = get_file_metadata(db, file_id) # Get file first to check ownership
+    file_to_delete = get_file_metadata(db, file_id, fields=["owner"]) # Get file first to check ownership (owner only)
     if not file_to_delete:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"File with ID {file_id} not found.")
 
@@ -268,10 +783,98 @@ async def delete_file_metadata_api(file_id: int, current_user: DBUser = Depends(
 
     try:
         # delete_file_metadata returns None upon successful deletion
-        delete_file_metadata(db, file_id)
+        delete_file_metadata(db, file_id, expected_versions=_if_match_versions(if_match))
         return {} # Return empty dict for 204 No Content
     except NoResultFound as e: # Catch if delete_file_metadata raises NoResultFound
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except StaleDataError as e: # Modified since the client's If-Match ETag
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail=str(e))
+    except OperationalError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database operational error: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred: {e}")
+
+
+# --- Background Job Endpoints (Requires Authentication, User or Admin) ---
+
+def _job_response(db: Session, job) -> JobResponse:
+    response = JobResponse.model_validate(job)
+    response.progress = job_progress(db, job)
+    return response
+
+
+def _get_authorized_job(db: Session, job_id: int, current_user: DBUser):
+    try:
+        job = get_job(db, job_id)
+    except NoResultFound as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    if current_user.role != 'admin' and job.owner != current_user.id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to access this job.")
+    return job
+
+
+@job_router.post("/", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def submit_job_api(job_data: JobCreate, current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    """
+    Queues a background scan or rescan of a server directory. The work is split
+    into subtree shards that any running 'filemeta worker' process can pick up.
+    """
+    try:
+        params = job_data.model_dump(exclude={"kind"})
+        job = submit_job(db, job_data.kind, params, owner_id=current_user.id, created_by=current_user.username)
+        return _job_response(db, job)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except OperationalError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database operational error: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred: {e}")
+
+
+@job_router.get("/", response_model=List[JobResponse])
+async def list_jobs_api(
+    job_status: Optional[str] = Query(None, alias="status", description="Only jobs in this status."),
+    current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)
+):
+    """
+    Lists background jobs, newest first. Admins see all; regular users only see their own.
+    """
+    try:
+        owner_id = None if current_user.role == 'admin' else current_user.id
+        return [_job_response(db, job) for job in list_jobs(db, owner_id=owner_id, status=job_status)]
+    except OperationalError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database operational error: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred: {e}")
+
+
+@job_router.get("/{job_id}", response_model=JobResponse)
+async def get_job_api(job_id: int, current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    """
+    Returns a job with its progress: items done, items per second and an ETA.
+    """
+    job = _get_authorized_job(db, job_id, current_user)
+    try:
+        return _job_response(db, job)
+    except OperationalError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database operational error: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred: {e}")
+
+
+@job_router.post("/{job_id}/cancel", response_model=JobResponse)
+async def cancel_job_api(job_id: int, current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    """
+    Cancels a job. Queued shards are dropped; running shards stop after their current batch.
+    """
+    _get_authorized_job(db, job_id, current_user)
+    try:
+        job = cancel_job(db, job_id)
+        return _job_response(db, job)
+    except ValueError as e: # Already finished
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
     except OperationalError as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database operational error: {e}")
     except Exception as e:
@@ -282,3 +885,4 @@ async def delete_file_metadata_api(file_id: int, current_user: DBUser = Depends(
 app.include_router(public_router)
 app.include_router(admin_router)
 app.include_router(file_router)
+app.include_router(job_router)
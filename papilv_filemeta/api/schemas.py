@@ -32,6 +32,83 @@ class FileUpdate(BaseModel):
     overwrite_existing: bool = False # If true, replaces ALL existing custom tags
 
 
+class BulkRetagRequest(BaseModel):
+    """Schema for changing the custom tags of every file matched by a selector."""
+    # Selector: files matching all of the given criteria
+    file_ids: Optional[List[int]] = None
+    path_prefix: Optional[str] = Field(None, example="/finance/2019") # Every file below this directory
+    q: Optional[str] = Field(None, example="project=alpha AND size>1GB") # Query expression, as for /files/query
+    tags_to_add_modify: Optional[Dict[str, Any]] = None # Values can be anything, will be parsed
+    tags_to_remove: Optional[List[str]] = None
+    batch_size: int = Field(5000, ge=1, le=100000) # Files per transaction
+
+class ScanRequest(BaseModel):
+    """Schema for bulk-registering every file under a server directory."""
+    directory: str = Field(..., example="/server/data/projects")
+    custom_tags: Optional[Dict[str, Any]] = {} # Applied to every newly registered file
+    workers: int = Field(8, ge=1, le=64) # Parallel stat/owner/MIME workers
+    batch_size: Optional[int] = Field(None, ge=1) # Initial rows per transaction, adapts automatically
+    hash_contents: bool = False # Fingerprint file contents in a process pool
+    hash_algorithm: str = "blake2b"
+    extract_content: bool = True # Run content extractors (magic bytes, image size, page counts)
+
+class ScanResponse(BaseModel):
+    """Schema for the counters reported by a bulk scan."""
+    scanned: int
+    inferred: int
+    inserted: int
+    skipped: int
+    errors: int
+    batches: int
+    elapsed_seconds: float
+    files_per_second: float
+    max_path_queue_depth: int
+    max_row_queue_depth: int
+    files_hashed: Optional[int] = None
+    bytes_hashed: Optional[int] = None
+    hash_bytes_per_second: Optional[float] = None
+
+class JobCreate(BaseModel):
+    """Schema for submitting a background scan or rescan job."""
+    kind: str = Field(..., example="scan") # 'scan' or 'rescan'
+    directory: str = Field(..., example="/server/data/projects")
+    custom_tags: Optional[Dict[str, Any]] = {}
+    batch_size: Optional[int] = Field(None, ge=1)
+    shard_depth: int = Field(1, ge=0, le=4) # Directory levels at which the work is split between workers
+    flag_missing: bool = False # 'rescan' only
+
+class JobProgress(BaseModel):
+    """Schema for the progress figures of a job, aggregated over its shards."""
+    items_done: int
+    elapsed_seconds: float
+    items_per_second: float
+    shards_total: int
+    shards_finished: int
+    shards_by_status: Dict[str, int]
+    eta_seconds: Optional[float] = None
+
+class JobResponse(BaseModel):
+    """Schema for returning a background job and its progress."""
+    id: int
+    kind: str
+    status: str
+    params: Dict[str, Any]
+    owner: Optional[int] = None
+    created_by: str
+    items_done: int
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    cancel_requested: bool
+    worker: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    progress: Optional[JobProgress] = None
+
+    class Config:
+        from_attributes = True # Enable ORM mode for Job model
+
+
 class FileResponse(BaseModel):
     """Schema for returning file metadata records."""
     id: int = Field(..., alias="ID") # Map DB 'id' to API 'ID'
@@ -41,6 +118,7 @@ class FileResponse(BaseModel):
     created_by: str = Field(..., alias="Created By")
     created_at: datetime = Field(..., alias="Created At")
     updated_at: datetime = Field(..., alias="Updated At")
+    version: int = Field(..., alias="Version") # Bumped by every change; also sent as the ETag
     
     # Inferred tags are stored as JSONB (Python dict)
     inferred_tags: Dict[str, Any] = Field(..., alias="Inferred Tags")
@@ -66,6 +144,67 @@ class FileResponse(BaseModel):
         json_dumps = json.dumps # Ensures Dict[str, Any] is properly serialized to JSON
 
 
+class FilePage(BaseModel):
+    """Schema for one page of file metadata records (keyset pagination)."""
+    items: List[FileResponse]
+    next_cursor: Optional[str] = None # Pass as ?cursor= to get the next page; None on the last page
+    estimated_total: Optional[int] = None # Planner estimate of all matches, if requested with ?estimate=true
+
+    class Config:
+        from_attributes = True # Built from metadata_manager's Page tuples
+
+
+class BrowseFile(BaseModel):
+    """Schema for an immediate child file in a directory listing."""
+    id: int
+    filename: str
+    filepath: str
+    size_bytes: Optional[int] = None
+    mtime: Optional[datetime] = None
+    mime_type: Optional[str] = None
+
+    class Config:
+        from_attributes = True # Enable ORM mode for File model
+
+class BrowsePrefix(BaseModel):
+    """Schema for a common sub-prefix (sub-directory) in a directory listing."""
+    prefix: str
+    file_count: int # Files anywhere under the prefix
+    total_bytes: int
+
+    class Config:
+        from_attributes = True # Built from metadata_manager's PrefixSummary tuples
+
+class BrowseResponse(BaseModel):
+    """Schema for an S3-style listing of the files and sub-prefixes under a path prefix."""
+    prefix: str
+    delimiter: Optional[str] = None
+    common_prefixes: List[BrowsePrefix]
+    files: List[BrowseFile] # One page of the immediate children, in path order
+    file_count: int # All immediate children
+    total_bytes: int
+    next_cursor: Optional[str] = None # Pass as ?cursor= for the next page of files; None on the last page
+
+
+class FacetValue(BaseModel):
+    """Schema for the number of files with one value of a facet."""
+    value: str
+    count: int
+
+class SizeBucket(BaseModel):
+    """Schema for one bucket of the file size histogram."""
+    min_bytes: int
+    max_bytes: Optional[int] = None # Exclusive; None for the last, unbounded bucket
+    count: int
+
+class FacetsResponse(BaseModel):
+    """Schema for value counts over the files matching a filter."""
+    total_files: int
+    facets: Dict[str, List[FacetValue]] # Most frequent values first, per requested key
+    size_histogram: List[SizeBucket]
+    source: str # 'live' or 'materialized'
+
+
 # --- User & Auth Schemas ---
 class UserCreateRequest(BaseModel):
     """Schema for creating a new user."""
@@ -0,0 +1,131 @@
+# filemeta/bloom.py
+import hashlib
+import math
+from array import array
+from bisect import bisect_left
+from typing import Iterable, List, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .models import File
+
+DEFAULT_ERROR_RATE = 0.01 # Target false-positive rate of the Bloom filter
+SMALL_CATALOG_SIZE = 1_000_000 # Up to this many paths an exact sorted hash set is used instead
+LOOKUP_CHUNK_SIZE = 1000 # Possible hits checked per IN (...) query
+
+
+def path_hash(filepath: str) -> int:
+    """Returns a 64-bit hash of a file path (stable across processes, unlike hash())."""
+    digest = hashlib.blake2b(filepath.encode("utf-8", "surrogateescape"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class BloomFilter:
+    """
+    A Bloom filter over 64-bit path hashes. Sized for capacity entries at the
+    given false-positive rate (about 1.2 bytes per entry at 1%). Bit positions
+    come from double hashing of the two 32-bit halves of the hash.
+    """
+    def __init__(self, capacity: int, error_rate: float = DEFAULT_ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: int):
+        h1, h2 = value & 0xFFFFFFFF, (value >> 32) | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, value: int):
+        bits = self.bits
+        for position in self._positions(value):
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value: int) -> bool:
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class SortedHashSet:
+    """
+    An exact set of 64-bit path hashes for smaller catalogs: a sorted array
+    (8 bytes per entry, binary search) plus a regular set for later additions.
+    Only a 64-bit hash collision can cause a false positive.
+    """
+    def __init__(self, hashes: Iterable[int] = ()):
+        self.hashes = array("Q", sorted(hashes))
+        self.added: Set[int] = set()
+
+    def add(self, value: int):
+        self.added.add(value)
+
+    def __contains__(self, value: int) -> bool:
+        index = bisect_left(self.hashes, value)
+        return (index < len(self.hashes) and self.hashes[index] == value) or value in self.added
+
+
+class KnownPathFilter:
+    """
+    In-memory prefilter for "is this path already cataloged?".
+
+    A negative answer is definite, so paths that are clearly new never cost a
+    database round trip; possible hits are confirmed with batched IN (...)
+    lookups via existing(). Keep it current by adding paths as rows are written.
+    """
+    def __init__(self, expected_size: int, small_threshold: int = SMALL_CATALOG_SIZE,
+                 error_rate: float = DEFAULT_ERROR_RATE):
+        self.expected_size = expected_size
+        if expected_size <= small_threshold:
+            self.structure = SortedHashSet()
+        else:
+            # Leave headroom for paths added while ingesting
+            self.structure = BloomFilter(int(expected_size * 1.25), error_rate)
+        self.stats = {"paths_loaded": 0, "definitely_new": 0, "possible_hits": 0,
+                      "db_lookups": 0, "false_positives": 0}
+
+    def load(self, filepaths: Iterable[str]):
+        """Fills the filter from a (streamed) iterable of cataloged paths."""
+        if isinstance(self.structure, SortedHashSet):
+            hashes = array("Q", (path_hash(filepath) for filepath in filepaths))
+            self.structure = SortedHashSet(hashes)
+            self.stats["paths_loaded"] += len(hashes)
+        else:
+            for filepath in filepaths:
+                self.structure.add(path_hash(filepath))
+                self.stats["paths_loaded"] += 1
+
+    @property
+    def kind(self) -> str:
+        return "bloom" if isinstance(self.structure, BloomFilter) else "sorted_set"
+
+    def add(self, filepath: str):
+        self.structure.add(path_hash(filepath))
+
+    def add_many(self, filepaths: Iterable[str]):
+        for filepath in filepaths:
+            self.add(filepath)
+
+    def might_contain(self, filepath: str) -> bool:
+        """False means the path is definitely not cataloged; True needs confirming with existing()."""
+        hit = path_hash(filepath) in self.structure
+        self.stats["possible_hits" if hit else "definitely_new"] += 1
+        return hit
+
+    def split(self, filepaths: Iterable[str]) -> Tuple[List[str], List[str]]:
+        """Splits paths into (possible hits, definitely new)."""
+        possible, new = [], []
+        for filepath in filepaths:
+            (possible if self.might_contain(filepath) else new).append(filepath)
+        return possible, new
+
+    def existing(self, db: Session, filepaths: List[str], chunk_size: int = LOOKUP_CHUNK_SIZE) -> Set[str]:
+        """Returns which of the given (possible hit) paths really are cataloged, in batched IN lookups."""
+        found: Set[str] = set()
+        for start in range(0, len(filepaths), chunk_size):
+            chunk = filepaths[start:start + chunk_size]
+            found.update(db.execute(select(File.filepath).where(File.filepath.in_(chunk))).scalars())
+            self.stats["db_lookups"] += 1
+        self.stats["false_positives"] += len(filepaths) - len(found)
+        return found
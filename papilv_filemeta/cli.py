@@ -1,19 +1,45 @@
 import click
 import sys
 import json
+import signal
 from datetime import datetime
 
-from .database import get_db,init_db
+from .database import db_session, init_db, get_engine
 
 from .metadata_manager import (
     
     add_file_metadata,
+    upsert_file_metadata,
     list_files,
+    list_files_page,
+    FILE_LIST_ORDERS,
     get_file_metadata,
-    search_files,
+    search_files_page,
+    query_files_page,
+    browse_files,
     update_file_tags,
-    delete_file_metadata
+    retag_files,
+    RETAG_BATCH_SIZE,
+    delete_file_metadata,
+    delete_files,
+    DELETE_BATCH_SIZE,
+    scan_directory,
+    rescan_directory,
+    backfill_typed_tag_values,
+    TYPED_TAG_BACKFILL_BATCH_SIZE,
+    backfill_file_columns,
+    FILE_COLUMN_BACKFILL_BATCH_SIZE,
+    DEFAULT_SEARCH_LIMIT,
+    SEARCH_MATCH_MODES
 )
+from .schema import enable_trigram_search, enable_facet_counts, refresh_facet_counts
+from .facets import compute_facets, FACET_VALUE_LIMIT
+from .pagination import MAX_PAGE_SIZE
+from .pipeline import run_ingest_pipeline
+from .hashing import ContentHasher, HASH_ALGORITHMS, DEFAULT_HASH_ALGORITHM
+from .duplicates import find_duplicates
+from .watcher import CatalogWatcher, DEFAULT_DEBOUNCE_SECONDS
+from .jobs import JobWorker, DEFAULT_POLL_INTERVAL
 from sqlalchemy.exc import OperationalError, NoResultFound, IntegrityError
 
 @click.group()
@@ -34,10 +60,60 @@ def init():
         click.echo(f"An unexpected error occurred during database initialization: {e}", err=True)
         sys.exit(1)
 
+@cli.command(name='setup-trigram')
+def setup_trigram():
+    """
+    Installs the pg_trgm extension and builds trigram indexes on file names and paths,
+    enabling fast 'search --match substring' and 'search --match fuzzy'. Safe to re-run.
+    """
+    try:
+        enable_trigram_search(get_engine(), progress_callback=click.echo)
+        click.echo("Trigram search enabled.")
+    except OperationalError as e:
+        click.echo(f"Database connection error: {e}\nPlease ensure the database server is running and accessible (check credentials, host, port, and firewall).", err=True)
+        sys.exit(1)
+    except Exception as e:
+        click.echo(f"An unexpected error occurred while enabling trigram search: {e}", err=True)
+        sys.exit(1)
+
+@cli.command(name='setup-facets')
+def setup_facets():
+    """
+    Creates the precomputed, trigger-maintained facet counts used by 'facets --materialized'
+    and counts the whole catalog into them. Re-run to rebuild the counts from scratch.
+    """
+    try:
+        enable_facet_counts(get_engine(), progress_callback=click.echo)
+        click.echo("Materialized facets enabled.")
+    except OperationalError as e:
+        click.echo(f"Database connection error: {e}\nPlease ensure the database server is running and accessible (check credentials, host, port, and firewall).", err=True)
+        sys.exit(1)
+    except Exception as e:
+        click.echo(f"An unexpected error occurred while enabling materialized facets: {e}", err=True)
+        sys.exit(1)
+
+@cli.command(name='refresh-facets')
+def refresh_facets():
+    """
+    Folds the changes recorded since the last run into the precomputed facet counts.
+    Cheap and safe to run while files are being written; schedule it periodically.
+    """
+    try:
+        folded = refresh_facet_counts(get_engine())
+        click.echo(f"Folded {folded} facet count rows.")
+    except OperationalError as e:
+        click.echo(f"Database connection error: {e}\nPlease ensure the database server is running and accessible (check credentials, host, port, and firewall).", err=True)
+        sys.exit(1)
+    except Exception as e:
+        click.echo(f"An unexpected error occurred while refreshing facet counts: {e}", err=True)
+        sys.exit(1)
+
 @cli.command()
 @click.argument('filepath', type=click.Path(exists=True, dir_okay=False, readable=True))
 @click.option('--tag', '-t', multiple=True, help='Custom tag in KEY=VALUE format. Can be repeated.')
-def add(filepath, tag):
+@click.option('--upsert', is_flag=True,
+              help='If the file is already cataloged, refresh its inferred metadata and add/modify the tags instead of failing.')
+def add(filepath, tag, upsert):
     """
     Adds a new metadata record for an existing file on the server.
     Custom tags are provided as KEY=VALUE pairs and can be repeated.
@@ -50,10 +126,14 @@ def add(filepath, tag):
         key, value = t.split('=', 1)
         custom_tags[key] = value
 
-    with get_db() as db:
+    with db_session() as db:
         try:
-            file_record = add_file_metadata(db, filepath, custom_tags)
-            click.echo(f"Metadata added for file '{file_record.filename}' (ID: {file_record.id})")
+            if upsert:
+                file_id, created = upsert_file_metadata(db, filepath, custom_tags, on_conflict="update")
+                click.echo(f"Metadata {'added' if created else 'updated'} for file '{filepath}' (ID: {file_id})")
+            else:
+                file_record = add_file_metadata(db, filepath, custom_tags)
+                click.echo(f"Metadata added for file '{file_record.filename}' (ID: {file_record.id})")
         except FileNotFoundError as e:
             click.echo(f"Error: {e}", err=True)
             sys.exit(1)
@@ -67,13 +147,247 @@ def add(filepath, tag):
             click.echo(f"An unexpected error occurred while adding metadata: {e}", err=True)
             sys.exit(1)
 
+def _parse_tag_options(tags):
+    """Turns repeated KEY=VALUE tag options into a dict, exiting on malformed input."""
+    custom_tags = {}
+    for t in tags:
+        if '=' not in t:
+            click.echo(f"Error: Invalid tag format '{t}'. Must be KEY=VALUE.", err=True)
+            sys.exit(1)
+        key, value = t.split('=', 1)
+        custom_tags[key] = value
+    return custom_tags
+
+@cli.command()
+@click.argument('directory', type=click.Path(exists=True, file_okay=False, readable=True))
+@click.option('--tag', '-t', multiple=True, help='Custom tag in KEY=VALUE format applied to every file. Can be repeated.')
+@click.option('--batch-size', '-b', type=int, default=None,
+              help='Initial number of files written per transaction. Adapts automatically to write speed.')
+@click.option('--workers', '-w', type=click.IntRange(min=1), default=1, show_default=True,
+              help='Number of parallel stat/owner/MIME workers. Values above 1 use the pipelined scanner.')
+@click.option('--hash', 'hash_contents', is_flag=True, help='Also fingerprint file contents (hashed in a process pool).')
+@click.option('--hash-algorithm', type=click.Choice(HASH_ALGORITHMS), default=DEFAULT_HASH_ALGORITHM, show_default=True,
+              help='Content hash algorithm used with --hash.')
+@click.option('--no-extract', 'no_extract', is_flag=True,
+              help='Skip content extractors (magic bytes, image size, page counts); use stat and file name only.')
+def scan(directory, tag, batch_size, workers, hash_contents, hash_algorithm, no_extract):
+    """
+    Recursively registers every file under DIRECTORY in bulk.
+    Files that are already cataloged are skipped.
+    """
+    custom_tags = _parse_tag_options(tag)
+
+    def _report(stats):
+        message = (f"  ...{stats['scanned']} scanned, {stats['inserted']} added, "
+                   f"{stats['skipped']} already cataloged ({stats['batches']} batches)")
+        if 'files_per_second' in stats:
+            message += (f", {stats['files_per_second']} files/s, "
+                        f"queues {stats['path_queue_depth']}/{stats['row_queue_depth']}")
+        if 'hash_bytes_per_second' in stats:
+            message += f", hashing {stats['hash_bytes_per_second'] / (1024 * 1024):.1f} MiB/s"
+        click.echo(message)
+
+    with db_session() as db:
+        try:
+            hasher = ContentHasher(hash_algorithm) if hash_contents else None
+            try:
+                if workers > 1:
+                    stats = run_ingest_pipeline(db, directory, custom_tags, workers=workers,
+                                                batch_size=batch_size, progress_callback=_report, hasher=hasher,
+                                                extract_content=not no_extract)
+                else:
+                    stats = scan_directory(db, directory, custom_tags, batch_size=batch_size,
+                                           progress_callback=_report, hasher=hasher,
+                                           extract_content=not no_extract)
+            finally:
+                if hasher:
+                    hasher.close()
+            click.echo(f"Scan of '{directory}' complete: {stats['scanned']} files scanned, "
+                       f"{stats['inserted']} added, {stats['skipped']} already cataloged, "
+                       f"{stats['errors']} unreadable entries.")
+            if hash_contents:
+                click.echo(f"Hashed {stats['files_hashed']} files, {stats['bytes_hashed']} bytes "
+                           f"({stats['hash_bytes_per_second'] / (1024 * 1024):.1f} MiB/s).")
+        except FileNotFoundError as e:
+            click.echo(f"Error: {e}", err=True)
+            sys.exit(1)
+        except OperationalError as e:
+            click.echo(f"Database connection error: {e}\nPlease ensure the database server is running and accessible (check credentials, host, port, and firewall).", err=True)
+            sys.exit(1)
+        except Exception as e:
+            click.echo(f"An unexpected error occurred during scan: {e}", err=True)
+            sys.exit(1)
+
+@cli.command()
+@click.argument('directory', type=click.Path(exists=True, file_okay=False, readable=True))
+@click.option('--tag', '-t', multiple=True, help='Custom tag in KEY=VALUE format applied to newly found files. Can be repeated.')
+@click.option('--flag-missing', is_flag=True, help='Mark cataloged files under DIRECTORY that no longer exist as missing.')
+@click.option('--batch-size', '-b', type=int, default=None,
+              help='Initial number of paths compared per transaction. Adapts automatically to write speed.')
+@click.option('--hash', 'hash_contents', is_flag=True,
+              help='Fingerprint contents of new/changed files. Files with unchanged size and mtime are not re-read.')
+@click.option('--hash-algorithm', type=click.Choice(HASH_ALGORITHMS), default=DEFAULT_HASH_ALGORITHM, show_default=True,
+              help='Content hash algorithm used with --hash.')
+def rescan(directory, tag, flag_missing, batch_size, hash_contents, hash_algorithm):
+    """
+    Incrementally re-synchronizes the catalog with the files under DIRECTORY.
+    Only files whose size, mtime, ctime or inode changed are rewritten; new files are added.
+    """
+    custom_tags = _parse_tag_options(tag)
+
+    def _report(stats):
+        click.echo(f"  ...{stats['scanned']} scanned, {stats['inserted']} added, "
+                   f"{stats['updated']} updated, {stats['unchanged']} unchanged")
+
+    with db_session() as db:
+        try:
+            hasher = ContentHasher(hash_algorithm) if hash_contents else None
+            try:
+                stats = rescan_directory(db, directory, custom_tags, flag_missing=flag_missing,
+                                         batch_size=batch_size, progress_callback=_report, hasher=hasher)
+            finally:
+                if hasher:
+                    hasher.close()
+            click.echo(f"Rescan of '{directory}' complete: {stats['scanned']} files scanned, "
+                       f"{stats['inserted']} added, {stats['updated']} updated, "
+                       f"{stats['unchanged']} unchanged, {stats['missing']} flagged missing, "
+                       f"{stats['errors']} unreadable entries.")
+            if hash_contents:
+                click.echo(f"Hashed {stats.get('files_hashed', 0)} files, {stats.get('bytes_hashed', 0)} bytes "
+                           f"({stats.get('hash_bytes_per_second', 0.0) / (1024 * 1024):.1f} MiB/s).")
+        except FileNotFoundError as e:
+            click.echo(f"Error: {e}", err=True)
+            sys.exit(1)
+        except OperationalError as e:
+            click.echo(f"Database connection error: {e}\nPlease ensure the database server is running and accessible (check credentials, host, port, and firewall).", err=True)
+            sys.exit(1)
+        except Exception as e:
+            click.echo(f"An unexpected error occurred during rescan: {e}", err=True)
+            sys.exit(1)
+
+@cli.command()
+@click.argument('directories', nargs=-1, required=True, type=click.Path(exists=True, file_okay=False, readable=True))
+@click.option('--tag', '-t', multiple=True, help='Custom tag in KEY=VALUE format applied to newly found files. Can be repeated.')
+@click.option('--debounce', type=float, default=DEFAULT_DEBOUNCE_SECONDS, show_default=True,
+              help='Seconds without new events before pending changes are applied.')
+def watch(directories, tag, debounce):
+    """
+    Keeps the catalog in sync with DIRECTORIES as files change (Linux only).
+    Runs until interrupted with Ctrl+C or SIGTERM.
+    """
+    custom_tags = _parse_tag_options(tag)
+
+    def _report(stats):
+        click.echo(f"  ...applied batch: {stats['inserted']} added, {stats['updated']} updated, "
+                   f"{stats['moved']} moved, {stats['deleted']} deleted, {stats['rescans']} rescans (totals)")
+
+    def _report_error(path, error):
+        click.echo(f"Warning: could not apply change for '{path}': {error}", err=True)
+
+    with db_session() as db:
+        try:
+            watcher = CatalogWatcher(db, list(directories), custom_tags, debounce=debounce,
+                                     progress_callback=_report, error_callback=_report_error)
+            signal.signal(signal.SIGTERM, lambda signum, frame: watcher.stop())
+            click.echo(f"Watching {', '.join(directories)} for changes. Press Ctrl+C to stop.")
+            try:
+                watcher.run()
+            except KeyboardInterrupt:
+                watcher.stop()
+                watcher.flush() # Apply whatever was still pending
+            click.echo("Watcher stopped.")
+        except FileNotFoundError as e:
+            click.echo(f"Error: {e}", err=True)
+            sys.exit(1)
+        except OperationalError as e:
+            click.echo(f"Database connection error: {e}\nPlease ensure the database server is running and accessible (check credentials, host, port, and firewall).", err=True)
+            sys.exit(1)
+        except OSError as e:
+            click.echo(f"Error: {e}", err=True)
+            sys.exit(1)
+        except Exception as e:
+            click.echo(f"An unexpected error occurred while watching: {e}", err=True)
+            sys.exit(1)
+
+@cli.command()
+@click.option('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL, show_default=True,
+              help='Seconds to wait before polling again when the job queue is empty.')
+@click.option('--once', is_flag=True, help='Exit as soon as the job queue is empty instead of waiting for more work.')
+def worker(poll_interval, once):
+    """
+    Runs queued background jobs (scans and rescans submitted through the API).
+    Start one worker per host or core; they share the queue and split sharded jobs between them.
+    Runs until interrupted with Ctrl+C or SIGTERM (which lets the current shard finish first).
+    """
+    try:
+        job_worker = JobWorker(poll_interval=poll_interval, log_callback=click.echo)
+        signal.signal(signal.SIGTERM, lambda signum, frame: job_worker.stop())
+        click.echo(f"Worker {job_worker.worker_id} waiting for jobs. Press Ctrl+C to stop.")
+        try:
+            job_worker.run(once=once)
+        except KeyboardInterrupt:
+            job_worker.stop()
+        click.echo("Worker stopped.")
+    except OperationalError as e:
+        click.echo(f"Database connection error: {e}\nPlease ensure the database server is running and accessible (check credentials, host, port, and firewall).", err=True)
+        sys.exit(1)
+    except Exception as e:
+        click.echo(f"An unexpected error occurred in the worker: {e}", err=True)
+        sys.exit(1)
+
+@cli.command(name='backfill-tag-values')
+@click.option('--batch-size', type=click.IntRange(min=1), default=TYPED_TAG_BACKFILL_BATCH_SIZE, show_default=True,
+              help='Tags converted per transaction.')
+def backfill_tag_values(batch_size):
+    """
+    Fills the native typed columns of tags created before they existed, so numeric,
+    boolean and date filters in 'query' match them. Safe to interrupt and re-run.
+    """
+    with db_session() as db:
+        try:
+            stats = backfill_typed_tag_values(
+                db, batch_size=batch_size,
+                progress_callback=lambda s: click.echo(f"   ...{s['examined']} tags examined, {s['converted']} converted")
+            )
+            click.echo(f"Backfill complete: {stats['converted']} of {stats['examined']} examined tags "
+                       f"received typed values in {stats['batches']} batches.")
+        except OperationalError as e:
+            click.echo(f"Database connection error: {e}\nPlease ensure the database server is running and accessible (check credentials, host, port, and firewall).", err=True)
+            sys.exit(1)
+        except Exception as e:
+            click.echo(f"An unexpected error occurred during the backfill: {e}", err=True)
+            sys.exit(1)
+
+@cli.command(name='backfill-file-columns')
+@click.option('--batch-size', type=click.IntRange(min=1), default=FILE_COLUMN_BACKFILL_BATCH_SIZE, show_default=True,
+              help='Files updated per transaction.')
+def backfill_file_columns_cli(batch_size):
+    """
+    Copies size, modification time, MIME type and inode of files cataloged before these
+    became indexed columns out of their inferred metadata. Safe to interrupt and re-run.
+    """
+    with db_session() as db:
+        try:
+            stats = backfill_file_columns(
+                db, batch_size=batch_size,
+                progress_callback=lambda s: click.echo(f"   ...{s['examined']} files examined, {s['filled']} filled")
+            )
+            click.echo(f"Backfill complete: {stats['filled']} of {stats['examined']} examined files "
+                       f"received column values in {stats['batches']} batches.")
+        except OperationalError as e:
+            click.echo(f"Database connection error: {e}\nPlease ensure the database server is running and accessible (check credentials, host, port, and firewall).", err=True)
+            sys.exit(1)
+        except Exception as e:
+            click.echo(f"An unexpected error occurred during the backfill: {e}", err=True)
+            sys.exit(1)
+
 @cli.command()
 @click.argument('file_id', type=int)
 def get(file_id):
     """
     Retrieves and displays the full metadata for a single file by its ID.
     """
-    with get_db() as db:
+    with db_session() as db:
         try:
             file_record = get_file_metadata(db, file_id)
 
@@ -111,10 +425,15 @@ def get(file_id):
 @cli.command()
 @click.option('--keyword', '-k', multiple=True, help='A keyword to search for. Can be repeated.')
 @click.option('--full', '-f', is_flag=True, help='Display full detailed metadata for each matching file.')
-def search(keyword, full):
+@click.option('--limit', '-l', type=click.IntRange(min=1), default=DEFAULT_SEARCH_LIMIT, show_default=True,
+              help='Results per page, best matches first.')
+@click.option('--match', '-m', type=click.Choice(SEARCH_MATCH_MODES), default='fulltext', show_default=True,
+              help="'substring' matches fragments of file names/paths, 'fuzzy' tolerates typos (needs setup-trigram).")
+@click.option('--cursor', help='Continue after a previous page (the cursor it printed).')
+def search(keyword, full, limit, match, cursor):
     """
-    Finds files whose metadata contains any of the specified keywords.
-    By default, displays a concise list. Use --full for complete details.
+    Finds files whose metadata contains any of the specified keywords (words match as prefixes).
+    Results are ranked by relevance. By default, displays a concise list. Use --full for complete details.
     """
     if not keyword:
         click.echo("Please provide at least one keyword to search for. Use --keyword <KEYWORD>.")
@@ -122,22 +441,24 @@ def search(keyword, full):
 
     search_keywords = list(keyword)
 
-    with get_db() as db:
+    with db_session() as db:
         try:
-            files = search_files(db, search_keywords)
+            page = search_files_page(db, search_keywords, limit=limit, match=match, cursor=cursor,
+                                     profile="full" if full else "summary")
+            files = page.items
             if not files:
                 click.echo(f"No files found matching keywords: {', '.join(search_keywords)}")
                 return
 
             click.echo(f"Found files matching keywords: {', '.join(search_keywords)}")
             for file_record in files:
-                file_data = file_record.to_dict()
                 click.echo("-" * 40)
-                click.echo(f"   ID: {file_data['ID']}")
-                click.echo(f"   Filename: {file_data['Filename']}")
-                click.echo(f"   Filepath: {file_data['Filepath']}")
+                click.echo(f"   ID: {file_record.id}")
+                click.echo(f"   Filename: {file_record.filename}")
+                click.echo(f"   Filepath: {file_record.filepath}")
 
                 if full:
+                    file_data = file_record.to_dict()
                     click.echo(f"   Owner: {file_data['Owner']}")
                     click.echo(f"   Created By: {file_data['Created By']}")
                     click.echo(f"   Created At: {file_data['Created At']}")
@@ -152,7 +473,12 @@ def search(keyword, full):
                     else:
                         click.echo("     (None)")
             click.echo("-" * 40)
+            if page.next_cursor:
+                click.echo(f"More results: repeat the search with --cursor {page.next_cursor}")
 
+        except ValueError as e:
+            click.echo(f"Error: {e}", err=True)
+            sys.exit(1)
         except OperationalError as e:
             click.echo(f"Database connection error: {e}\nPlease ensure the database server is running and accessible (check credentials, host, port, and firewall).", err=True)
             sys.exit(1)
@@ -161,6 +487,133 @@ def search(keyword, full):
             sys.exit(1)
 
 
+@cli.command()
+@click.argument('expression')
+@click.option('--full', '-f', is_flag=True, help='Display the tags of each matching file.')
+@click.option('--limit', '-l', type=click.IntRange(min=1), default=DEFAULT_SEARCH_LIMIT, show_default=True,
+              help='Results per page, in ID order.')
+@click.option('--cursor', help='Continue after a previous page (the cursor it printed).')
+def query(expression, full, limit, cursor):
+    """
+    Finds files matching a query expression over tags, inferred metadata and file fields.
+
+    \b
+    Examples:
+      filemeta query 'project=alpha AND retention_days>=30 AND size>1GB'
+      filemeta query '(mime=image/* OR name~scan) AND NOT archived=true'
+      filemeta query 'has reviewer AND mtime>=2024-01-01'
+    """
+    with db_session() as db:
+        try:
+            page = query_files_page(db, expression, limit=limit, cursor=cursor, profile="standard" if full else "summary")
+            if not page.items:
+                click.echo("No files match the query.")
+                return
+
+            for file_record in page.items:
+                click.echo(f"   [{file_record.id}] {file_record.filepath}")
+                if full:
+                    for tag in file_record.tags:
+                        click.echo(f"        {tag.key} = {tag.value} ({tag.value_type})")
+            click.echo(f"{len(page.items)} matching files on this page.")
+            if page.next_cursor:
+                click.echo(f"More results: repeat the query with --cursor {page.next_cursor}")
+
+        except ValueError as e:
+            click.echo(f"Error: {e}", err=True)
+            sys.exit(1)
+        except OperationalError as e:
+            click.echo(f"Database connection error: {e}\nPlease ensure the database server is running and accessible (check credentials, host, port, and firewall).", err=True)
+            sys.exit(1)
+        except Exception as e:
+            click.echo(f"An unexpected error occurred during the query: {e}", err=True)
+            sys.exit(1)
+
+
+@cli.command(name='ls')
+@click.argument('prefix', default='')
+@click.option('--delimiter', '-d', default='/', show_default=True,
+              help="Groups deeper paths into sub-prefixes; pass '' to list everything under PREFIX.")
+@click.option('--limit', '-l', type=click.IntRange(1, MAX_PAGE_SIZE), default=100, show_default=True,
+              help='Maximum number of files to display.')
+@click.option('--cursor', help='Continue after a previous page (the cursor it printed).')
+def ls(prefix, delimiter, limit, cursor):
+    """
+    Lists the cataloged files directly under PREFIX and its sub-directories, with file counts and total sizes.
+
+    \b
+    Examples:
+      filemeta ls /data/projects/x/
+      filemeta ls /data/projects/x/ --delimiter ''
+    """
+    with db_session() as db:
+        try:
+            result = browse_files(db, prefix, delimiter=delimiter or None, limit=limit, cursor=cursor)
+            if not result.common_prefixes and not result.file_count:
+                click.echo(f"No files found under '{prefix}'.")
+                return
+
+            for summary in result.common_prefixes:
+                click.echo(f"   PRE {summary.prefix}  ({summary.file_count} files, {summary.total_bytes} bytes)")
+            for file_record in result.files.items:
+                size = file_record.size_bytes if file_record.size_bytes is not None else '-'
+                click.echo(f"   [{file_record.id}] {file_record.filepath}  ({size} bytes)")
+            click.echo(f"{len(result.common_prefixes)} sub-prefixes; "
+                       f"{result.file_count} files directly under '{prefix}' ({result.total_bytes} bytes).")
+            if result.files.next_cursor:
+                click.echo(f"More files: repeat the command with --cursor {result.files.next_cursor}")
+
+        except ValueError as e:
+            click.echo(f"Error: {e}", err=True)
+            sys.exit(1)
+        except OperationalError as e:
+            click.echo(f"Database connection error: {e}\nPlease ensure the database server is running and accessible (check credentials, host, port, and firewall).", err=True)
+            sys.exit(1)
+        except Exception as e:
+            click.echo(f"An unexpected error occurred while listing '{prefix}': {e}", err=True)
+            sys.exit(1)
+
+
+@cli.command()
+@click.option('--key', '-k', 'keys', multiple=True,
+              help="Facet to count: 'mime_type' or a custom tag key ('tag.<key>' for a tag named like a facet). Can be repeated.")
+@click.option('--query', '-q', 'expression', help='Only count files matching this query expression.')
+@click.option('--limit', '-l', type=click.IntRange(min=1), default=FACET_VALUE_LIMIT, show_default=True,
+              help='Most frequent values shown per facet.')
+@click.option('--materialized', is_flag=True, help="Read catalog-wide counts from the precomputed counts ('setup-facets').")
+def facets(keys, expression, limit, materialized):
+    """
+    Counts cataloged files per MIME type and/or custom tag value, with a file size histogram.
+
+    \b
+    Examples:
+      filemeta facets -k mime_type -k project
+      filemeta facets -k project -q 'size>1GB'
+    """
+    with db_session() as db:
+        try:
+            result = compute_facets(db, keys=list(keys), expression=expression, limit=limit, materialized=materialized)
+            click.echo(f"{result['total_files']} files ({result['source']} counts).")
+            for name, values in result['facets'].items():
+                click.echo(f"{name}:")
+                for entry in values:
+                    click.echo(f"   {entry['count']:>10}  {entry['value']}")
+            click.echo("size:")
+            for bucket in result['size_histogram']:
+                upper = f"< {bucket['max_bytes']}" if bucket['max_bytes'] is not None else "and up"
+                click.echo(f"   {bucket['count']:>10}  {bucket['min_bytes']} {upper} bytes")
+
+        except ValueError as e:
+            click.echo(f"Error: {e}", err=True)
+            sys.exit(1)
+        except OperationalError as e:
+            click.echo(f"Database connection error: {e}\nPlease ensure the database server is running and accessible (check credentials, host, port, and firewall).", err=True)
+            sys.exit(1)
+        except Exception as e:
+            click.echo(f"An unexpected error occurred while counting facets: {e}", err=True)
+            sys.exit(1)
+
+
 @cli.command()
 @click.argument('file_id', type=int)
 @click.option('--tag', '-t', 'tags_to_add_modify', multiple=True,
@@ -203,7 +656,7 @@ def update(file_id, tags_to_add_modify, tags_to_remove, new_filepath, overwrite)
     parsed_remove_tags = list(tags_to_remove) if tags_to_remove else None
 
 
-    with get_db() as db:
+    with db_session() as db:
         try:
             updated_file = update_file_tags(db, file_id,
                                             tags_to_add_modify=parsed_add_modify_tags,
@@ -225,6 +678,47 @@ def update(file_id, tags_to_add_modify, tags_to_remove, new_filepath, overwrite)
             sys.exit(1)
 
 
+@cli.command()
+@click.option('--id', 'file_ids', type=int, multiple=True, help='Select this file ID. Can be repeated.')
+@click.option('--prefix', 'path_prefix', help='Select every file below this directory.')
+@click.option('--query', '-q', 'expression', help='Select the files matching this query expression.')
+@click.option('--tag', '-t', 'tags_to_add_modify', multiple=True,
+              help='Add or modify a custom tag (e.g., -t retention=7y). Can be used multiple times.')
+@click.option('--remove-tag', '-r', 'tags_to_remove', multiple=True,
+              help='Remove a custom tag by key. Can be used multiple times.')
+@click.option('--batch-size', type=click.IntRange(min=1), default=RETAG_BATCH_SIZE, show_default=True,
+              help='Files retagged per transaction.')
+def retag(file_ids, path_prefix, expression, tags_to_add_modify, tags_to_remove, batch_size):
+    """
+    Adds/modifies and removes custom tags on every selected file, in set-based batches.
+    Selectors can be combined; files must match all of them. Safe to interrupt and re-run.
+
+    \b
+    Examples:
+      filemeta retag --prefix /finance/2019 -t retention=7y
+      filemeta retag -q 'project=alpha AND mime=image/*' -t reviewed=true -r draft
+    """
+    with db_session() as db:
+        try:
+            stats = retag_files(
+                db, file_ids=list(file_ids) or None, path_prefix=path_prefix, expression=expression,
+                tags_to_add_modify=_parse_tag_options(tags_to_add_modify), tags_to_remove=list(tags_to_remove),
+                batch_size=batch_size,
+                progress_callback=lambda s: click.echo(f"   ...{s['files']} files retagged")
+            )
+            click.echo(f"Retag complete: {stats['files']} files, {stats['tags_written']} tags written, "
+                       f"{stats['tags_removed']} removed in {stats['batches']} batches.")
+        except ValueError as e:
+            click.echo(f"Error: {e}", err=True)
+            sys.exit(1)
+        except OperationalError as e:
+            click.echo(f"Database connection error: {e}\nPlease ensure the database server is running and accessible (check credentials, host, port, and firewall).", err=True)
+            sys.exit(1)
+        except Exception as e:
+            click.echo(f"An unexpected error occurred during the retag: {e}", err=True)
+            sys.exit(1)
+
+
 @cli.command()
 @click.argument('file_id', type=int)
 def delete(file_id):
@@ -234,7 +728,7 @@ def delete(file_id):
     """
     click.confirm(f"Are you sure you want to permanently delete metadata for file ID {file_id}? This cannot be undone.", abort=True)
 
-    with get_db() as db:
+    with db_session() as db:
         try:
             delete_file_metadata(db, file_id)
             click.echo(f"Metadata for file ID {file_id} deleted successfully.")
@@ -249,45 +743,106 @@ def delete(file_id):
             sys.exit(1)
 
 
+@cli.command()
+@click.option('--id', 'file_ids', type=int, multiple=True, help='Select this file ID. Can be repeated.')
+@click.option('--prefix', 'path_prefix', help='Select every file below this directory.')
+@click.option('--query', '-q', 'expression', help='Select the files matching this query expression.')
+@click.option('--batch-size', type=click.IntRange(min=1), default=DELETE_BATCH_SIZE, show_default=True,
+              help='Files deleted per transaction.')
+@click.option('--yes', '-y', is_flag=True, help='Do not ask for confirmation.')
+def purge(file_ids, path_prefix, expression, batch_size, yes):
+    """
+    Permanently removes the metadata records and tags of every selected file, in batches.
+    Selectors can be combined; files must match all of them. Safe to interrupt and re-run.
+    This does NOT affect the actual files on the filesystem.
+
+    \b
+    Examples:
+      filemeta purge --prefix /scratch/2019
+      filemeta purge -q 'mime=video/* AND size>10GB'
+    """
+    if not yes:
+        click.confirm("Are you sure you want to permanently delete the metadata of every selected file? This cannot be undone.", abort=True)
+
+    with db_session() as db:
+        try:
+            stats = delete_files(
+                db, file_ids=list(file_ids) or None, path_prefix=path_prefix, expression=expression,
+                batch_size=batch_size,
+                progress_callback=lambda s: click.echo(f"   ...{s['files']} files deleted")
+            )
+            click.echo(f"Purge complete: {stats['files']} files deleted in {stats['batches']} batches.")
+        except ValueError as e:
+            click.echo(f"Error: {e}", err=True)
+            sys.exit(1)
+        except OperationalError as e:
+            click.echo(f"Database connection error: {e}\nPlease ensure the database server is running and accessible (check credentials, host, port, and firewall).", err=True)
+            sys.exit(1)
+        except Exception as e:
+            click.echo(f"An unexpected error occurred during the purge: {e}", err=True)
+            sys.exit(1)
+
+
 @cli.command(name='list') # This is the ONLY list command now
 @click.option('--summary', '-s', is_flag=True, help='Display only file ID, filename, and filepath.')
-def list_files_cli(summary):
+@click.option('--page-size', type=click.IntRange(1, MAX_PAGE_SIZE),
+              help='Show one page of this many files and print the cursor of the next. Default: all files.')
+@click.option('--cursor', help='Start after a previous page (the cursor it printed).')
+@click.option('--order', type=click.Choice(FILE_LIST_ORDERS), default='id', show_default=True,
+              help="'updated_at' lists the most recently updated files first.")
+def list_files_cli(summary, page_size, cursor, order):
     """
     Displays all file metadata records currently stored in the database.
     Use --summary for a concise list of just filenames and paths.
+    Files are fetched page by page, so large catalogs are never loaded at once.
     """
-    with get_db() as db:
+    with db_session() as db:
         try:
-            files = list_files(db)
-            if not files:
-                click.echo("No file metadata records found.")
-                return
-
-            click.echo("Found files:")
-            for file_record in files:
-                file_data = file_record.to_dict()
-                click.echo("-" * 40)
-                click.echo(f"   ID: {file_data['ID']}")
-                click.echo(f"   Filename: {file_data['Filename']}")
-                click.echo(f"   Filepath: {file_data['Filepath']}")
-
-                # Only print full details if --summary is NOT present
-                if not summary:
-                    click.echo(f"   Owner: {file_data['Owner']}")
-                    click.echo(f"   Created By: {file_data['Created By']}")
-                    click.echo(f"   Created At: {file_data['Created At']}")
-                    click.echo(f"   Updated At: {file_data['Updated At']}")
-
-                    click.echo("   Inferred Tags:")
-                    click.echo(json.dumps(file_data['Inferred Tags'], indent=2, ensure_ascii=False))
-
-                    click.echo("   Custom Tags:")
-                    if file_data['Custom Tags']:
-                        click.echo(json.dumps(file_data['Custom Tags'], indent=2, ensure_ascii=False))
-                    else:
-                        click.echo("     (None)")
+            page_cursor, shown = cursor, 0
+            while True:
+                page = list_files_page(db, limit=page_size or MAX_PAGE_SIZE, cursor=page_cursor, order=order,
+                                       profile="summary" if summary else "full")
+                if not page.items and not shown:
+                    click.echo("No file metadata records found.")
+                    return
+                if not shown:
+                    click.echo("Found files:")
+
+                for file_record in page.items:
+                    click.echo("-" * 40)
+                    click.echo(f"   ID: {file_record.id}")
+                    click.echo(f"   Filename: {file_record.filename}")
+                    click.echo(f"   Filepath: {file_record.filepath}")
+
+                    # Only print full details if --summary is NOT present (the summary profile loads nothing else)
+                    if not summary:
+                        file_data = file_record.to_dict()
+                        click.echo(f"   Owner: {file_data['Owner']}")
+                        click.echo(f"   Created By: {file_data['Created By']}")
+                        click.echo(f"   Created At: {file_data['Created At']}")
+                        click.echo(f"   Updated At: {file_data['Updated At']}")
+
+                        click.echo("   Inferred Tags:")
+                        click.echo(json.dumps(file_data['Inferred Tags'], indent=2, ensure_ascii=False))
+
+                        click.echo("   Custom Tags:")
+                        if file_data['Custom Tags']:
+                            click.echo(json.dumps(file_data['Custom Tags'], indent=2, ensure_ascii=False))
+                        else:
+                            click.echo("     (None)")
+                shown += len(page.items)
+                db.expunge_all() # Keep memory flat across pages
+
+                page_cursor = page.next_cursor
+                if page_size or not page_cursor:
+                    break
             click.echo("-" * 40)
+            if page_size and page_cursor:
+                click.echo(f"Next page: --cursor {page_cursor}")
 
+        except ValueError as e:
+            click.echo(f"Error: {e}", err=True)
+            sys.exit(1)
         except OperationalError as e:
             click.echo(f"Database connection error: {e}\nPlease ensure the database server is running and accessible (check credentials, host, port, and firewall).", err=True)
             sys.exit(1)
@@ -295,13 +850,56 @@ def list_files_cli(summary):
             click.echo(f"An unexpected error occurred: {e}", err=True)
             sys.exit(1)
 
+@cli.command()
+@click.option('--min-size', type=click.IntRange(min=0), default=1, show_default=True,
+              help='Ignore files smaller than this many bytes.')
+@click.option('--hash-algorithm', type=click.Choice(HASH_ALGORITHMS), default=DEFAULT_HASH_ALGORITHM, show_default=True,
+              help='Algorithm for full content hashes (stored hashes of the same algorithm are reused).')
+@click.option('--json', 'as_json', is_flag=True, help='Print one JSON object per duplicate group (NDJSON).')
+def duplicates(min_size, hash_algorithm, as_json):
+    """
+    Finds groups of cataloged files with identical contents.
+    Candidates are narrowed by size and a partial hash before any file is read in full.
+    """
+    with db_session() as db:
+        try:
+            finder = find_duplicates(db, min_size=min_size, algorithm=hash_algorithm)
+            for group in finder:
+                if as_json:
+                    click.echo(json.dumps(group, ensure_ascii=False))
+                    continue
+                click.echo("-" * 40)
+                click.echo(f"   {len(group['files'])} copies of {group['size']} bytes "
+                           f"({group['wasted_bytes']} bytes wasted)")
+                for duplicate in group['files']:
+                    click.echo(f"   [{duplicate['id']}] {duplicate['filepath']}")
+
+            stats = finder.stats
+            if as_json:
+                click.echo(json.dumps({"summary": stats}))
+            else:
+                if stats['groups']:
+                    click.echo("-" * 40)
+                click.echo(f"Found {stats['groups']} duplicate groups ({stats['duplicate_files']} files), "
+                           f"{stats['wasted_bytes']} bytes wasted. Read {stats['bytes_read']} of "
+                           f"{stats['catalog_bytes']} cataloged bytes.")
+        except ValueError as e:
+            click.echo(f"Error: {e}", err=True)
+            sys.exit(1)
+        except OperationalError as e:
+            click.echo(f"Database connection error: {e}\nPlease ensure the database server is running and accessible (check credentials, host, port, and firewall).", err=True)
+            sys.exit(1)
+        except Exception as e:
+            click.echo(f"An unexpected error occurred while finding duplicates: {e}", err=True)
+            sys.exit(1)
+
 @cli.command()
 @click.argument('output_filepath', type=click.Path(dir_okay=False, writable=True))
 def export(output_filepath):
     """
     Exports all file metadata records to a specified JSON file.
     """
-    with get_db() as db:
+    with db_session() as db:
         try:
             files = list_files(db)
             if not files:
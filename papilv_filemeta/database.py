@@ -104,8 +104,8 @@ import os
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, Session, declarative_base
 from sqlalchemy.exc import OperationalError, IntegrityError
-# from contextlib import contextmanager
-from typing import Optional
+from contextlib import contextmanager
+from typing import Iterator, Optional
 
 # This is where 'Base' is defined ONCE for all your SQLAlchemy models.
 # It should ONLY be defined here.
@@ -169,6 +169,20 @@ def get_db():
     finally:
         db.close() # Ensure the session is closed after the request is processed
 
+@contextmanager
+def db_session() -> Iterator[Session]:
+    """
+    Provides a SQLAlchemy session as a context manager, for code outside
+    FastAPI (CLI commands, scripts): `with db_session() as db: ...`.
+    The session is closed when the block exits.
+    """
+    get_engine()
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
 def init_db():
     """
     Initializes the database schema by creating all tables defined in your models.
@@ -181,9 +195,12 @@ def init_db():
         current_engine = get_engine() # Get the initialized engine
         # Import models here to ensure they are registered with Base.metadata
         # This explicit import ensures Base.metadata knows about all your models
-        from papilv_filemeta.models import User, File, Tag # Assuming this is the correct path to your models
+        from papilv_filemeta.models import User, File, Tag, Job # Assuming this is the correct path to your models
 
         Base.metadata.create_all(bind=current_engine) # Create tables based on Base.metadata
+        # Columns, triggers and indexes that create_all() can't add to existing tables
+        from papilv_filemeta.schema import upgrade_schema
+        upgrade_schema(current_engine)
         print("Database tables created successfully or already exist.")
     except OperationalError as e:
         print(f"Failed to create tables. Check database permissions or schema definitions: {e}")
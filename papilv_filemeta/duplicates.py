@@ -0,0 +1,193 @@
+# filemeta/duplicates.py
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Iterator
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from .models import File
+from .hashing import ContentHasher, DEFAULT_HASH_ALGORITHM
+
+PARTIAL_HASH_BYTES = 4096 # Bytes read from each end of a file for the partial hash
+SIZE_GROUPS_PER_QUERY = 500 # Candidate sizes whose files are fetched per round trip
+DEFAULT_IO_WORKERS = 16
+
+
+def partial_hash(filepath: str, size: int) -> str:
+    """
+    Hashes the first and last PARTIAL_HASH_BYTES of a file. For files of up to
+    2 * PARTIAL_HASH_BYTES this covers the whole content.
+    """
+    hasher = hashlib.blake2b()
+    with open(filepath, "rb") as f:
+        hasher.update(f.read(PARTIAL_HASH_BYTES))
+        if size > PARTIAL_HASH_BYTES:
+            f.seek(max(PARTIAL_HASH_BYTES, size - PARTIAL_HASH_BYTES))
+            hasher.update(f.read(PARTIAL_HASH_BYTES))
+    return hasher.hexdigest()
+
+
+class DuplicateFinder:
+    """
+    Finds groups of identical files in the catalog with a size-then-hash cascade:
+
+    1. group cataloged files by their stored file_size and drop unique sizes (SQL only),
+    2. compare a partial hash of the first and last few KB (thread pool, tiny reads),
+    3. full-hash only the files that still collide (process pool), reusing a
+       stored content_hash instead when the file's mtime is unchanged.
+
+    Iterate over it to stream duplicate groups, largest file size first.
+    Afterwards, stats holds the totals, including how many bytes were read.
+    """
+    def __init__(
+        self,
+        db: Session,
+        owner_id: Optional[int] = None,
+        min_size: int = 1,
+        algorithm: str = DEFAULT_HASH_ALGORITHM,
+        io_workers: int = DEFAULT_IO_WORKERS,
+        hash_workers: Optional[int] = None
+    ):
+        self.db = db
+        self.owner_id = owner_id
+        self.min_size = max(min_size, 0)
+        self.algorithm = algorithm
+        self.io_workers = io_workers
+        self.hash_workers = hash_workers
+        self.stats = {"candidate_files": 0, "candidate_bytes": 0, "groups": 0, "duplicate_files": 0,
+                      "wasted_bytes": 0, "bytes_read": 0, "catalog_bytes": 0}
+
+    def _size_column(self):
+        return File.size_bytes # Indexed, unlike a cast of inferred_tags['file_size']
+
+    def _base_filter(self, query):
+        query = query.where(File.inferred_tags['missing'].astext.is_(None))
+        if self.owner_id is not None:
+            query = query.where(File.owner == self.owner_id)
+        return query
+
+    def _candidate_sizes(self) -> List[int]:
+        size = self._size_column()
+        query = self._base_filter(
+            select(size).where(size >= self.min_size).group_by(size).having(func.count() > 1).order_by(size.desc())
+        )
+        return [row[0] for row in self.db.execute(query)]
+
+    def _candidates(self, sizes: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        size = self._size_column()
+        query = self._base_filter(select(
+            File.id,
+            File.filepath,
+            size,
+            File.inferred_tags['last_modified_at'].astext,
+            File.inferred_tags['content_hash'].astext,
+            File.inferred_tags['hash_algorithm'].astext,
+        ).where(size.in_(sizes)))
+        groups: Dict[int, List[Dict[str, Any]]] = {}
+        for file_id, filepath, file_size, mtime, content_hash, hash_algorithm in self.db.execute(query):
+            groups.setdefault(file_size, []).append({
+                "id": file_id,
+                "filepath": filepath,
+                "mtime": mtime,
+                "content_hash": content_hash if hash_algorithm == self.algorithm else None,
+            })
+        return groups
+
+    def _still_valid(self, candidate: Dict[str, Any], size: int) -> bool:
+        """Checks the file still exists with its cataloged size; drops a stale stored hash."""
+        try:
+            stat_info = os.stat(candidate["filepath"])
+        except OSError:
+            return False
+        if stat_info.st_size != size:
+            return False
+        if datetime.fromtimestamp(stat_info.st_mtime).isoformat() != candidate["mtime"]:
+            candidate["content_hash"] = None
+        return True
+
+    def _split(self, files: List[Dict[str, Any]], key: str) -> List[List[Dict[str, Any]]]:
+        buckets: Dict[str, List[Dict[str, Any]]] = {}
+        for candidate in files:
+            if candidate.get(key) is not None:
+                buckets.setdefault(candidate[key], []).append(candidate)
+        return [bucket for bucket in buckets.values() if len(bucket) > 1]
+
+    def _groups_for_size(self, size: int, files: List[Dict[str, Any]], io_pool, hasher) -> Iterator[Dict[str, Any]]:
+        valid = io_pool.map(lambda c: self._still_valid(c, size), files)
+        files = [candidate for candidate, ok in zip(files, valid) if ok]
+        if len(files) < 2:
+            return
+
+        # Stage 2: partial hash of both ends, a few KB per file
+        for candidate, digest in zip(files, io_pool.map(lambda c: self._safe_partial(c, size), files)):
+            candidate["partial"] = digest
+        self.stats["bytes_read"] += len(files) * min(size, 2 * PARTIAL_HASH_BYTES)
+        buckets = self._split(files, "partial")
+
+        if size <= 2 * PARTIAL_HASH_BYTES:
+            # The partial hash already covered the whole content (and equals a full blake2b hash)
+            groups = []
+            for bucket in buckets:
+                stored = next((c["content_hash"] for c in bucket if c["content_hash"]), None)
+                groups.append((bucket, stored or (bucket[0]["partial"] if self.algorithm == "blake2b" else None)))
+        else:
+            # Stage 3: full hash only where a collision is still possible and no trusted hash is stored
+            survivors = [candidate for bucket in buckets for candidate in bucket]
+            to_hash = [candidate for candidate in survivors if candidate["content_hash"] is None]
+            if to_hash:
+                fingerprints = hasher.hash_paths([candidate["filepath"] for candidate in to_hash])
+                for candidate in to_hash:
+                    candidate["content_hash"] = fingerprints[candidate["filepath"]].get("content_hash")
+                    if candidate["content_hash"] is not None:
+                        self.stats["bytes_read"] += size
+            groups = [(bucket, bucket[0]["content_hash"]) for bucket in self._split(survivors, "content_hash")]
+
+        for bucket, content_hash in groups:
+            wasted = size * (len(bucket) - 1)
+            self.stats["groups"] += 1
+            self.stats["duplicate_files"] += len(bucket)
+            self.stats["wasted_bytes"] += wasted
+            yield {
+                "size": size,
+                "content_hash": content_hash,
+                "wasted_bytes": wasted,
+                "files": [{"id": candidate["id"], "filepath": candidate["filepath"]} for candidate in bucket],
+            }
+
+    def _safe_partial(self, candidate: Dict[str, Any], size: int) -> Optional[str]:
+        try:
+            return partial_hash(candidate["filepath"], size)
+        except OSError:
+            return None
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        catalog_bytes = self.db.execute(self._base_filter(select(func.coalesce(func.sum(self._size_column()), 0)))).scalar()
+        self.stats["catalog_bytes"] = int(catalog_bytes)
+
+        sizes = self._candidate_sizes()
+        with ThreadPoolExecutor(max_workers=self.io_workers) as io_pool, \
+                ContentHasher(self.algorithm, workers=self.hash_workers) as hasher:
+            for start in range(0, len(sizes), SIZE_GROUPS_PER_QUERY):
+                chunk = sizes[start:start + SIZE_GROUPS_PER_QUERY]
+                groups = self._candidates(chunk)
+                for size in chunk: # Keep largest-first order
+                    files = groups.get(size, [])
+                    self.stats["candidate_files"] += len(files)
+                    self.stats["candidate_bytes"] += size * len(files)
+                    yield from self._groups_for_size(size, files, io_pool, hasher)
+
+
+def find_duplicates(
+    db: Session,
+    owner_id: Optional[int] = None,
+    min_size: int = 1,
+    algorithm: str = DEFAULT_HASH_ALGORITHM
+) -> DuplicateFinder:
+    """
+    Returns a DuplicateFinder over the catalog (optionally limited to one owner's
+    files). Iterate over it to stream duplicate groups; read .stats afterwards.
+    """
+    return DuplicateFinder(db, owner_id=owner_id, min_size=min_size, algorithm=algorithm)
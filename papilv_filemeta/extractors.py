@@ -0,0 +1,294 @@
+# filemeta/extractors.py
+import re
+import struct
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Any, List, Optional, Callable
+
+DEFAULT_EXTRACTOR_TIMEOUT = 2.0 # Seconds a single extractor may run on a single file
+# Threads per extractor, shared by every caller (e.g. all ingest pipeline workers).
+# Python threads can't be killed: a timed-out extractor keeps its thread until it
+# returns, so leave some headroom. Each extractor has its own pool, so one that
+# hangs can only starve itself, not the others.
+DEFAULT_EXTRACTOR_WORKERS = 32
+SNIFF_BYTES = 8192 # Bytes read up front for magic-byte sniffing
+
+
+class ReadBudgetExceeded(Exception):
+    """Raised by a BoundedReader when an extractor reads more than its declared read_budget."""
+
+
+class BoundedReader:
+    """
+    A read-only binary file that raises ReadBudgetExceeded once more than
+    budget bytes have been read from it, wherever they were read.
+    Supports what zipfile and the built-in extractors need: read, seek and tell.
+    """
+    def __init__(self, filepath: str, budget: int):
+        self._file = open(filepath, "rb")
+        self.budget = budget
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        remaining = self.budget - self.bytes_read
+        if size is None or size < 0 or size > remaining:
+            # Read one byte past the budget, to tell "the file ends within it" from "over"
+            data = self._file.read(remaining + 1)
+            if len(data) > remaining:
+                raise ReadBudgetExceeded(f"read more than its budget of {self.budget} bytes")
+        else:
+            data = self._file.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def seekable(self) -> bool:
+        return True
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Extractor:
+    """
+    A registered content extractor.
+
+    func(filepath, head) receives the file path and its first bytes_needed
+    bytes, and returns a dict of inferred metadata (or {} if not applicable).
+    An extractor that reads more of the file itself declares read_budget and
+    opens the file with open_bounded(), so a malformed file can't make it read
+    more than that. mime_types, if given, limits the extractor to files whose
+    sniffed or guessed MIME type is in that set.
+    """
+    def __init__(self, name: str, func: Callable[[str, bytes], Dict[str, Any]], bytes_needed: int,
+                 mime_types: Optional[List[str]] = None, timeout: float = DEFAULT_EXTRACTOR_TIMEOUT,
+                 read_budget: int = 0):
+        self.name = name
+        self.func = func
+        self.bytes_needed = bytes_needed
+        self.read_budget = read_budget
+        self.mime_types = set(mime_types) if mime_types else None
+        self.timeout = timeout
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def applies_to(self, mime_type: Optional[str]) -> bool:
+        return self.mime_types is None or mime_type in self.mime_types
+
+    def executor(self) -> ThreadPoolExecutor:
+        # Created on first use, under a lock: the pipeline workers all get here at once
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=DEFAULT_EXTRACTOR_WORKERS,
+                                                    thread_name_prefix=f"filemeta-extract-{self.name}")
+            return self._executor
+
+
+_REGISTRY: Dict[str, Extractor] = {}
+
+
+def register_extractor(name: str, bytes_needed: int, mime_types: Optional[List[str]] = None,
+                       timeout: float = DEFAULT_EXTRACTOR_TIMEOUT, read_budget: int = 0):
+    """
+    Decorator that registers a content extractor under name.
+    Registering the same name again replaces the previous extractor.
+    """
+    def decorator(func: Callable[[str, bytes], Dict[str, Any]]):
+        _REGISTRY[name] = Extractor(name, func, bytes_needed, mime_types, timeout, read_budget)
+        return func
+    return decorator
+
+
+def get_extractors() -> List[Extractor]:
+    return list(_REGISTRY.values())
+
+
+def open_bounded(filepath: str, extractor_name: str) -> BoundedReader:
+    """Opens a file for the named extractor, limited to reading its declared read_budget."""
+    return BoundedReader(filepath, _REGISTRY[extractor_name].read_budget)
+
+
+def _collect(futures, results: Dict[str, Any], errors: Dict[str, str]):
+    for extractor, future, deadline in futures:
+        try:
+            results.update(future.result(timeout=max(0.0, deadline - time.monotonic())) or {})
+        except FutureTimeoutError:
+            future.cancel()
+            errors[extractor.name] = f"timed out after {extractor.timeout}s"
+        except Exception as e:
+            errors[extractor.name] = str(e)
+
+
+def _submit(extractors: List[Extractor], filepath: str, head: bytes):
+    now = time.monotonic()
+    return [
+        (extractor, extractor.executor().submit(extractor.func, filepath, head[:extractor.bytes_needed]), now + extractor.timeout)
+        for extractor in extractors
+    ]
+
+
+def run_extractors(filepath: str, mime_type: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Runs every applicable extractor on a file and merges their results.
+
+    The first SNIFF_BYTES are read once and sniffed for the content type, which
+    then selects the other extractors; more of the file is read only if one of
+    them declares it needs more. Each extractor runs in its own worker pool
+    with its own timeout. One that times out, fails or exceeds its read budget
+    is recorded under 'extractor_errors' and the others still contribute their
+    results. A timed-out extractor is abandoned, not stopped: it keeps one of
+    its pool's threads until it returns.
+    """
+    results: Dict[str, Any] = {}
+    errors: Dict[str, str] = {}
+
+    sniffer = _REGISTRY.get("magic")
+    with open(filepath, "rb") as f:
+        head = f.read(max(SNIFF_BYTES, sniffer.bytes_needed if sniffer else 0))
+
+        if sniffer:
+            _collect(_submit([sniffer], filepath, head), results, errors)
+        effective_mime = results.get("content_mime_type") or mime_type
+
+        extractors = [e for e in _REGISTRY.values() if e is not sniffer and e.applies_to(effective_mime)]
+        needed = max([e.bytes_needed for e in extractors] or [0])
+        if needed > len(head):
+            head += f.read(needed - len(head))
+
+    _collect(_submit(extractors, filepath, head), results, errors)
+    if errors:
+        results["extractor_errors"] = errors
+    return results
+
+
+# --- Built-in Extractors ---
+
+_MAGIC_SIGNATURES = [
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"PK\x03\x04", "application/zip"),
+    (b"PK\x05\x06", "application/zip"), # Empty archive
+    (b"\x1f\x8b", "application/gzip"),
+    (b"BZh", "application/x-bzip2"),
+    (b"\xfd7zXZ\x00", "application/x-xz"),
+    (b"7z\xbc\xaf\x27\x1c", "application/x-7z-compressed"),
+    (b"\x7fELF", "application/x-executable"),
+    (b"SQLite format 3\x00", "application/vnd.sqlite3"),
+    (b"OggS", "audio/ogg"),
+    (b"fLaC", "audio/flac"),
+    (b"ID3", "audio/mpeg"),
+]
+
+
+@register_extractor("magic", bytes_needed=SNIFF_BYTES)
+def sniff_magic(filepath: str, head: bytes) -> Dict[str, Any]:
+    """Detects the content type from magic bytes, independent of the file extension."""
+    for signature, mime_type in _MAGIC_SIGNATURES:
+        if head.startswith(signature):
+            return {"content_mime_type": mime_type}
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return {"content_mime_type": "image/webp"}
+    if head[4:8] == b"ftyp":
+        return {"content_mime_type": "video/mp4"}
+    if len(head) > 262 and head[257:262] == b"ustar":
+        return {"content_mime_type": "application/x-tar"}
+    if head and b"\x00" not in head:
+        try:
+            head.decode("utf-8")
+            return {"content_mime_type": "text/plain"}
+        except UnicodeDecodeError:
+            # May just be a multi-byte character cut off at the end of the sample
+            try:
+                head[:-3].decode("utf-8")
+                return {"content_mime_type": "text/plain"}
+            except UnicodeDecodeError:
+                pass
+    return {}
+
+
+@register_extractor("image_dimensions", bytes_needed=65536, mime_types=["image/png", "image/gif", "image/jpeg"])
+def image_dimensions(filepath: str, head: bytes) -> Dict[str, Any]:
+    """Reads width and height from PNG, GIF and JPEG headers."""
+    if head.startswith(b"\x89PNG\r\n\x1a\n") and head[12:16] == b"IHDR":
+        width, height = struct.unpack(">II", head[16:24])
+        return {"image_width": width, "image_height": height}
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        width, height = struct.unpack("<HH", head[6:10])
+        return {"image_width": width, "image_height": height}
+    if head.startswith(b"\xff\xd8"):
+        offset = 2
+        while offset + 9 < len(head):
+            if head[offset] != 0xFF:
+                offset += 1
+                continue
+            marker = head[offset + 1]
+            if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+                offset += 2
+                continue
+            segment_length = struct.unpack(">H", head[offset + 2:offset + 4])[0]
+            # SOF0..SOF15 carry the frame size (except DHT, JPG and DAC markers)
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack(">HH", head[offset + 5:offset + 9])
+                return {"image_width": width, "image_height": height}
+            offset += 2 + segment_length
+    return {}
+
+
+_PDF_PAGE_RE = re.compile(rb"/Type\s*/Page(?![s\w])")
+_PDF_COUNT_RE = re.compile(rb"/Type\s*/Pages\b[^>]*?/Count\s+(\d+)|/Count\s+(\d+)[^>]*?/Type\s*/Pages\b", re.S)
+PDF_SCAN_BYTES = 4 * 1024 * 1024 # Upper bound on how much of a PDF is searched for its page tree
+ARCHIVE_SCAN_BYTES = 4 * 1024 * 1024 # Upper bound on how much of a ZIP archive is read for its central directory
+
+
+@register_extractor("pdf_pages", bytes_needed=0, mime_types=["application/pdf"], read_budget=2 * PDF_SCAN_BYTES)
+def pdf_page_count(filepath: str, head: bytes) -> Dict[str, Any]:
+    """
+    Finds the page count of a PDF from its page tree, reading at most
+    PDF_SCAN_BYTES from the end of the file (where most writers put it) and
+    then the start. Compressed object streams are not decoded.
+    """
+    with open_bounded(filepath, "pdf_pages") as f:
+        f.seek(0, 2)
+        size = f.tell()
+        f.seek(max(0, size - PDF_SCAN_BYTES))
+        data = f.read(PDF_SCAN_BYTES)
+        if size > PDF_SCAN_BYTES:
+            f.seek(0)
+            data += f.read(PDF_SCAN_BYTES)
+    counts = [int(a or b) for a, b in _PDF_COUNT_RE.findall(data)]
+    if counts:
+        return {"pdf_page_count": max(counts)} # The root of the page tree has the largest count
+    pages = len(_PDF_PAGE_RE.findall(data))
+    return {"pdf_page_count": pages} if pages else {}
+
+
+@register_extractor("archive_entries", bytes_needed=0, mime_types=["application/zip"],
+                    read_budget=ARCHIVE_SCAN_BYTES)
+def archive_entry_count(filepath: str, head: bytes) -> Dict[str, Any]:
+    """
+    Counts the entries of a ZIP archive from its central directory (no
+    decompression). Archives whose end records and central directory don't
+    fit in ARCHIVE_SCAN_BYTES are reported as an extractor error.
+    """
+    with open_bounded(filepath, "archive_entries") as f, zipfile.ZipFile(f) as archive:
+        infos = archive.infolist()
+        return {
+            "archive_entry_count": len(infos),
+            "archive_uncompressed_size": sum(info.file_size for info in infos),
+        }
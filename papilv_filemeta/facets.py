@@ -0,0 +1,175 @@
+# filemeta/facets.py
+#
+# Value counts over the catalog for dashboards: files per custom tag value,
+# per MIME type and per size bucket, computed with GROUP BY in the database so
+# only the counts are transferred. Unfiltered, catalog-wide counts can also be
+# read from the facet_count table maintained by triggers (see schema.py).
+from typing import Dict, Any, List, Optional, Tuple
+
+from sqlalchemy import select, func, cast, text, bindparam, BigInteger
+from sqlalchemy.dialects.postgresql import ARRAY, array
+from sqlalchemy.orm import Session
+
+from .models import File, Tag
+from .query_lang import parse_query, compile_query
+from .schema import SIZE_BUCKET_BOUNDS, TAG_VALUE_INDEX_PREFIX, FACET_COUNT_TRIGGERS
+
+FACET_VALUE_LIMIT = 20 # Most frequent values returned per facet
+MAX_FACET_VALUE_LIMIT = 1000
+FILE_FACETS = {"mime_type": File.mime_type} # Other facet keys are custom tag keys
+DEFAULT_FACET_KEYS = ["mime_type"]
+
+
+def split_facet_keys(keys: List[str]) -> Tuple[List[str], List[str]]:
+    """
+    Splits facet keys into file facets and custom tag keys. 'tag.<key>'
+    names a tag whose key is also a file facet name, e.g. 'tag.mime_type'.
+    """
+    file_facets, tag_keys = [], []
+    for key in keys:
+        if key.startswith("tag."):
+            tag_keys.append(key[4:])
+        elif key in FILE_FACETS:
+            file_facets.append(key)
+        else:
+            tag_keys.append(key)
+    return file_facets, tag_keys
+
+
+def _size_histogram(bucket_counts: Dict[int, int]) -> List[Dict[str, Any]]:
+    """One entry per size bucket, min_bytes inclusive and max_bytes exclusive (None: unbounded)."""
+    lower_bounds = [0] + SIZE_BUCKET_BOUNDS
+    upper_bounds = SIZE_BUCKET_BOUNDS + [None]
+    return [{"min_bytes": lower, "max_bytes": upper, "count": bucket_counts.get(bucket, 0)}
+            for bucket, (lower, upper) in enumerate(zip(lower_bounds, upper_bounds))]
+
+
+def _facet_name(facet: str) -> str:
+    """Reports a stored facet ('mime_type', 'tag:<key>') under the key it is requested by."""
+    if not facet.startswith("tag:"):
+        return facet
+    key = facet[4:]
+    return f"tag.{key}" if key in FILE_FACETS else key
+
+
+def _compute_live(
+    db: Session,
+    file_facets: List[str],
+    tag_keys: List[str],
+    conditions: list,
+    limit: int
+) -> Dict[str, Any]:
+    # Totals and the size histogram in one pass; files without a size fall into the NULL bucket
+    bucket = func.width_bucket(File.size_bytes, cast(array(SIZE_BUCKET_BOUNDS), ARRAY(BigInteger)))
+    bucket_counts = {}
+    total_files = 0
+    for bucket_number, count in db.execute(
+        select(bucket, func.count()).select_from(File).where(*conditions).group_by(bucket)
+    ):
+        total_files += count
+        if bucket_number is not None:
+            bucket_counts[bucket_number] = count
+
+    facets = {}
+    for name in file_facets:
+        column = FILE_FACETS[name]
+        rows = db.execute(
+            select(column, func.count().label("count")).where(*conditions, column.isnot(None))
+            .group_by(column).order_by(func.count().desc(), column).limit(limit)
+        ).all()
+        facets[name] = [{"value": value, "count": count} for value, count in rows]
+
+    if tag_keys:
+        # Grouped on the expression of ix_tag_key_value, ranked within each key
+        value = func.left(Tag.value, TAG_VALUE_INDEX_PREFIX)
+        counts = select(
+            Tag.key, value.label("value"), func.count().label("count"),
+            func.row_number().over(partition_by=Tag.key, order_by=(func.count().desc(), value)).label("rank")
+        ).where(Tag.key.in_(tag_keys))
+        if conditions:
+            counts = counts.where(Tag.file_id.in_(select(File.id).where(*conditions)))
+        counts = counts.group_by(Tag.key, value).subquery()
+        for key in tag_keys:
+            facets[_facet_name(f"tag:{key}")] = []
+        rows = db.execute(
+            select(counts.c.key, counts.c.value, counts.c.count)
+            .where(counts.c.rank <= limit).order_by(counts.c.key, counts.c.rank)
+        )
+        for key, tag_value, count in rows:
+            facets[_facet_name(f"tag:{key}")].append({"value": tag_value, "count": count})
+
+    return {"total_files": total_files, "facets": facets, "size_histogram": _size_histogram(bucket_counts)}
+
+
+def _compute_materialized(db: Session, file_facets: List[str], tag_keys: List[str], limit: int) -> Dict[str, Any]:
+    names = ["files", "size"] + file_facets + [f"tag:{key}" for key in tag_keys]
+    rows = db.execute(text("""
+        SELECT facet, value, count FROM (
+            SELECT facet, value, count, row_number() OVER (PARTITION BY facet ORDER BY count DESC, value) AS rank
+            FROM (
+                SELECT facet, value, sum(count) AS count FROM facet_count
+                WHERE facet IN :names GROUP BY facet, value HAVING sum(count) > 0
+            ) totals
+        ) ranked
+        WHERE facet IN ('files', 'size') OR rank <= :limit
+        ORDER BY facet, rank
+    """).bindparams(bindparam("names", expanding=True)), {"names": names, "limit": limit}).all()
+
+    facets = {_facet_name(name): [] for name in names[2:]}
+    bucket_counts = {}
+    total_files = 0
+    for facet, value, count in rows:
+        if facet == "files":
+            total_files = int(count)
+        elif facet == "size":
+            bucket_counts[int(value)] = int(count)
+        else:
+            facets[_facet_name(facet)].append({"value": value, "count": int(count)})
+    return {"total_files": total_files, "facets": facets, "size_histogram": _size_histogram(bucket_counts)}
+
+
+def facet_counts_ready(db: Session) -> bool:
+    """Returns True if the facet_count table is set up (see schema.enable_facet_counts())."""
+    triggers = db.execute(text(
+        "SELECT count(*) FROM pg_trigger WHERE tgname IN :names AND NOT tgisinternal"
+    ).bindparams(bindparam("names", expanding=True)), {"names": FACET_COUNT_TRIGGERS}).scalar()
+    return triggers == len(FACET_COUNT_TRIGGERS)
+
+
+def compute_facets(
+    db: Session,
+    keys: Optional[List[str]] = None,
+    expression: Optional[str] = None,
+    owner_id: Optional[int] = None,
+    limit: int = FACET_VALUE_LIMIT,
+    materialized: bool = False
+) -> Dict[str, Any]:
+    """
+    Counts the files matching a query language expression (all files if
+    None), optionally only those of owner_id: in total, per size bucket and,
+    for each facet key, per value (the `limit` most frequent values; tag
+    values are cut to their first TAG_VALUE_INDEX_PREFIX characters).
+
+    With materialized=True an unfiltered, catalog-wide request is answered
+    from the facet_count table instead (see schema.enable_facet_counts());
+    filtered or owner-scoped requests are always counted live. The result's
+    'source' says which was used. Raises ValueError for an invalid
+    expression, or if the facet_count table is needed but not set up.
+    """
+    file_facets, tag_keys = split_facet_keys(keys if keys else DEFAULT_FACET_KEYS)
+
+    if materialized and expression is None and owner_id is None:
+        if not facet_counts_ready(db):
+            raise ValueError("Materialized facets are not set up. Run 'filemeta setup-facets' first.")
+        result = _compute_materialized(db, file_facets, tag_keys, limit)
+        result["source"] = "materialized"
+        return result
+
+    conditions = []
+    if expression is not None:
+        conditions.append(compile_query(parse_query(expression)))
+    if owner_id is not None:
+        conditions.append(File.owner == owner_id)
+    result = _compute_live(db, file_facets, tag_keys, conditions, limit)
+    result["source"] = "live"
+    return result
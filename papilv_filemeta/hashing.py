@@ -0,0 +1,125 @@
+# filemeta/hashing.py
+import hashlib
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, List, Optional, Tuple
+
+try:
+    import xxhash # Optional: much faster than blake2b on large files
+except ImportError:
+    xxhash = None
+
+DEFAULT_HASH_ALGORITHM = "blake2b"
+HASH_ALGORITHMS = ("blake2b", "xxh3_128", "xxh64") if xxhash is not None else ("blake2b",)
+HASH_CHUNK_SIZE = 8 * 1024 * 1024 # Bytes fed to the hasher per update() call
+
+
+def _new_hasher(algorithm: str):
+    if algorithm == "blake2b":
+        return hashlib.blake2b()
+    if xxhash is not None and algorithm == "xxh3_128":
+        return xxhash.xxh3_128()
+    if xxhash is not None and algorithm == "xxh64":
+        return xxhash.xxh64()
+    raise ValueError(f"Unsupported hash algorithm '{algorithm}'. Available: {', '.join(HASH_ALGORITHMS)}.")
+
+
+def hash_file(filepath: str, algorithm: str = DEFAULT_HASH_ALGORITHM) -> Tuple[str, int]:
+    """
+    Hashes the contents of a file in large chunks and returns (hexdigest, bytes_read).
+
+    Chunks are read into one reused buffer, so no bytes object is allocated per
+    chunk. The file is deliberately not memory-mapped: if it were truncated
+    while being hashed, touching the missing pages would kill the worker
+    process with SIGBUS (and break the whole pool), where read() just stops early.
+    """
+    hasher = _new_hasher(algorithm)
+    buffer = bytearray(HASH_CHUNK_SIZE)
+    size = 0
+    with open(filepath, "rb", buffering=0) as f, memoryview(buffer) as view:
+        while True:
+            length = f.readinto(buffer)
+            if not length:
+                break
+            hasher.update(view[:length])
+            size += length
+    return hasher.hexdigest(), size
+
+
+class ContentHasher:
+    """
+    Hashes file contents in a pool of worker processes, so large files are
+    hashed in parallel and don't hold up the rest of ingestion.
+
+    Results are returned as inferred_tags entries ('content_hash' and
+    'hash_algorithm'). Keeps running totals for the ingest stats.
+    Use as a context manager, or call close() when done.
+    """
+    def __init__(self, algorithm: str = DEFAULT_HASH_ALGORITHM, workers: Optional[int] = None):
+        _new_hasher(algorithm) # Validate early, in the calling process
+        self.algorithm = algorithm
+        self._workers = workers
+        self._pool = ProcessPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self.files_hashed = 0
+        self.bytes_hashed = 0
+        self.errors = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+    def submit(self, filepath: str) -> Future:
+        with self._lock:
+            pool = self._pool
+        try:
+            return pool.submit(hash_file, filepath, self.algorithm)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory): replace the pool, once, for everyone
+            with self._lock:
+                if self._pool is pool:
+                    self._pool = ProcessPoolExecutor(max_workers=self._workers)
+                    pool.shutdown(wait=False)
+                pool = self._pool
+            return pool.submit(hash_file, filepath, self.algorithm)
+
+    def _collect(self, future: Future) -> Dict[str, Any]:
+        try:
+            digest, size = future.result()
+        except (OSError, BrokenProcessPool):
+            # Vanished or unreadable, or its worker died: leave the file without a fingerprint
+            with self._lock:
+                self.errors += 1
+            return {}
+        with self._lock:
+            self.files_hashed += 1
+            self.bytes_hashed += size
+        return {"content_hash": digest, "hash_algorithm": self.algorithm}
+
+    def hash_path(self, filepath: str) -> Dict[str, Any]:
+        """Hashes one file (blocking) and returns its fingerprint entries, or {} on error."""
+        return self._collect(self.submit(filepath))
+
+    def hash_paths(self, filepaths: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Hashes several files in parallel and returns {filepath: fingerprint entries}."""
+        futures = [(filepath, self.submit(filepath)) for filepath in filepaths]
+        return {filepath: self._collect(future) for filepath, future in futures}
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hashing totals and the overall hashing throughput in bytes per second."""
+        elapsed = time.monotonic() - self._started
+        with self._lock:
+            return {
+                "files_hashed": self.files_hashed,
+                "bytes_hashed": self.bytes_hashed,
+                "hash_errors": self.errors,
+                "hash_bytes_per_second": round(self.bytes_hashed / elapsed, 1) if elapsed > 0 else 0.0,
+            }
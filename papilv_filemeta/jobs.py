@@ -0,0 +1,410 @@
+# filemeta/jobs.py
+import os
+import socket
+import threading
+from datetime import timedelta
+from typing import Dict, Any, List, Optional, Callable
+
+from sqlalchemy import select, func, update
+from sqlalchemy.exc import NoResultFound
+from sqlalchemy.orm import Session
+
+from . import database
+from .models import Job
+from .metadata_manager import scan_directory, rescan_directory
+
+JOB_KINDS = ("scan", "rescan")
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+DEFAULT_SHARD_DEPTH = 1 # Directory levels below the root at which a scan is split into shards
+MAX_SHARD_DEPTH = 4
+DEFAULT_POLL_INTERVAL = 2.0 # Seconds an idle worker waits before polling the queue again
+STALE_JOB_SECONDS = 300 # A running job without a heartbeat for this long is assumed to have lost its worker
+HEARTBEAT_INTERVAL = 30.0 # Seconds between the heartbeats of a running job, whatever phase it is in
+MAX_JOB_ATTEMPTS = 3
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once its cancellation has been requested."""
+
+
+# --- Submitting and Inspecting Jobs ---
+
+def submit_job(
+    db: Session,
+    kind: str,
+    params: Dict[str, Any],
+    owner_id: Optional[int] = None,
+    created_by: Optional[str] = None
+) -> Job:
+    """
+    Queues a background job. Supported kinds:
+
+    - 'scan': register every file under params['directory'] (see scan_directory),
+    - 'rescan': incrementally re-synchronize params['directory'] (see rescan_directory).
+
+    Both accept 'custom_tags', 'batch_size' and 'shard_depth' (how many directory
+    levels below the root the work is split into independently claimable shards);
+    'rescan' also accepts 'flag_missing'.
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unsupported job kind '{kind}'. Available: {', '.join(JOB_KINDS)}.")
+    directory = params.get("directory")
+    if not directory or not os.path.isdir(directory):
+        raise FileNotFoundError(f"Directory not found at: {directory}")
+    shard_depth = params.get("shard_depth", DEFAULT_SHARD_DEPTH)
+    if not isinstance(shard_depth, int) or not 0 <= shard_depth <= MAX_SHARD_DEPTH:
+        raise ValueError(f"shard_depth must be an integer between 0 and {MAX_SHARD_DEPTH}.")
+
+    job = Job(
+        kind=kind,
+        params=dict(params, directory=os.path.abspath(directory), shard_depth=shard_depth),
+        owner=owner_id,
+        created_by=created_by if created_by else "system",
+    )
+    try:
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        return job
+    except Exception as e:
+        db.rollback()
+        raise Exception(f"An unexpected error occurred while submitting the job: {e}")
+
+
+def get_job(db: Session, job_id: int) -> Job:
+    """Retrieves a job by its ID."""
+    job = db.get(Job, job_id)
+    if not job:
+        raise NoResultFound(f"No job found with ID: {job_id}")
+    return job
+
+
+def list_jobs(db: Session, owner_id: Optional[int] = None, status: Optional[str] = None, limit: int = 100) -> List[Job]:
+    """Lists top-level jobs (not their shards), newest first."""
+    query = select(Job).where(Job.parent_id.is_(None)).order_by(Job.id.desc()).limit(limit)
+    if owner_id is not None:
+        query = query.where(Job.owner == owner_id)
+    if status:
+        query = query.where(Job.status == status)
+    return list(db.execute(query).scalars())
+
+
+def job_progress(db: Session, job: Job) -> Dict[str, Any]:
+    """
+    Returns a job's progress: items done, throughput and, once some of its
+    shards have finished, an estimated time to completion. For a sharded job
+    the figures are aggregated over its shards in one query.
+    """
+    now = db.execute(select(func.now())).scalar()
+    items_done = job.items_done
+    shards = {}
+    if job.params.get("sharded"):
+        rows = db.execute(
+            select(Job.status, func.count(), func.coalesce(func.sum(Job.items_done), 0))
+            .where(Job.parent_id == job.id)
+            .group_by(Job.status)
+        ).all()
+        shards = {status: count for status, count, _ in rows}
+        items_done = sum(int(done) for _, _, done in rows)
+
+    end = job.finished_at or now
+    elapsed = (end - job.started_at).total_seconds() if job.started_at else 0.0
+    rate = items_done / elapsed if elapsed > 0 else 0.0
+
+    eta_seconds = None
+    shards_total = sum(shards.values())
+    shards_finished = sum(count for status, count in shards.items() if status in FINISHED_STATUSES)
+    if job.status in FINISHED_STATUSES:
+        eta_seconds = 0.0
+    elif shards_finished and shards_total:
+        # Shards differ in size, so this is a rough estimate based on the finished fraction
+        eta_seconds = round(elapsed * (shards_total - shards_finished) / shards_finished, 1)
+
+    return {
+        "items_done": items_done,
+        "elapsed_seconds": round(elapsed, 3),
+        "items_per_second": round(rate, 1),
+        "shards_total": shards_total,
+        "shards_finished": shards_finished,
+        "shards_by_status": shards,
+        "eta_seconds": eta_seconds,
+    }
+
+
+def cancel_job(db: Session, job_id: int) -> Job:
+    """
+    Requests cancellation of a job and its shards. Queued work is cancelled
+    right away; running shards stop at their next progress report.
+    """
+    job = get_job(db, job_id)
+    if job.status in FINISHED_STATUSES:
+        raise ValueError(f"Job {job_id} has already finished ({job.status}).")
+    try:
+        db.execute(
+            update(Job).where((Job.id == job_id) | (Job.parent_id == job_id))
+            .where(Job.status.notin_(FINISHED_STATUSES))
+            .values(cancel_requested=True)
+        )
+        db.execute(
+            update(Job).where((Job.id == job_id) | (Job.parent_id == job_id))
+            .where(Job.status == "queued")
+            .values(status="cancelled", finished_at=func.now())
+        )
+        db.commit()
+        _finalize_parent(db, job.parent_id or job_id)
+        db.refresh(job)
+        return job
+    except Exception as e:
+        db.rollback()
+        raise Exception(f"An unexpected error occurred while cancelling job {job_id}: {e}")
+
+
+def _finalize_parent(db: Session, parent_id: int):
+    """
+    Completes a sharded job once none of its shards is left unfinished, summing
+    their counters into its result. The parent row is locked so that the
+    workers finishing the last shards concurrently finalize it only once.
+    """
+    parent = db.execute(select(Job).where(Job.id == parent_id).with_for_update()).scalar_one_or_none()
+    if parent is None or parent.status != "waiting":
+        db.commit()
+        return
+    rows = db.execute(select(Job.status, Job.result).where(Job.parent_id == parent_id)).all()
+    if any(status not in FINISHED_STATUSES for status, _ in rows):
+        db.commit()
+        return
+
+    totals: Dict[str, Any] = {}
+    for _, result in rows:
+        for counter, value in (result or {}).items():
+            if isinstance(value, int) and not isinstance(value, bool):
+                totals[counter] = totals.get(counter, 0) + value
+    statuses = {status for status, _ in rows}
+    if parent.cancel_requested:
+        parent.status = "cancelled"
+    elif "failed" in statuses:
+        parent.status = "failed"
+        parent.error = f"{sum(1 for status, _ in rows if status == 'failed')} of {len(rows)} shards failed."
+    else:
+        parent.status = "succeeded"
+    parent.result = totals
+    parent.items_done = totals.get("scanned", 0)
+    parent.finished_at = func.now()
+    db.commit()
+
+
+# --- Worker ---
+
+def _shard_roots(root: str, depth: int) -> List[tuple]:
+    """
+    Splits a directory tree into (directory, recursive) shards: every directory
+    above the given depth contributes its own files (recursive=False), and every
+    directory at that depth is one recursive shard.
+    """
+    shards = []
+    level = [root]
+    for _ in range(depth):
+        next_level = []
+        for directory in level:
+            shards.append((directory, False))
+            try:
+                with os.scandir(directory) as entries:
+                    next_level.extend(sorted(e.path for e in entries if e.is_dir(follow_symlinks=False)))
+            except OSError:
+                continue # Unreadable: nothing to shard, the scan itself will report it
+        level = next_level
+    shards.extend((directory, True) for directory in level)
+    return shards
+
+
+class JobWorker:
+    """
+    Claims and runs queued jobs until stopped. Any number of workers, on any
+    number of hosts, can share one queue: jobs are claimed with
+    SELECT ... FOR UPDATE SKIP LOCKED, so each job runs exactly once.
+
+    A sharded job is first split into one child job per subtree, which all
+    workers then claim independently. Jobs whose worker stopped sending
+    heartbeats are re-queued (up to MAX_JOB_ATTEMPTS times).
+    """
+    def __init__(
+        self,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        worker_id: Optional[str] = None,
+        log_callback: Optional[Callable[[str], None]] = None
+    ):
+        database.get_engine()
+        self.poll_interval = poll_interval
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.log_callback = log_callback
+        self._stop = threading.Event()
+
+    def _log(self, message: str):
+        if self.log_callback:
+            self.log_callback(message)
+
+    def stop(self):
+        self._stop.set()
+
+    def claim(self, db: Session) -> Optional[Job]:
+        """
+        Claims the oldest runnable job (or a stale one) and marks it running.
+        Stale jobs that have used up their attempts are failed on the way.
+        Returns None if there is nothing to claim.
+        """
+        stale_before = func.now() - timedelta(seconds=STALE_JOB_SECONDS)
+        while True:
+            job = db.execute(
+                select(Job)
+                .where(
+                    (Job.status == "queued")
+                    | ((Job.status == "running") & (Job.heartbeat_at < stale_before))
+                )
+                .order_by(Job.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            ).scalar_one_or_none()
+            if job is None:
+                db.commit()
+                return None
+            if job.attempts < MAX_JOB_ATTEMPTS:
+                break
+
+            job.status = "failed"
+            job.error = f"Gave up after {job.attempts} attempts (worker lost)."
+            job.finished_at = func.now()
+            db.commit()
+            if job.parent_id:
+                _finalize_parent(db, job.parent_id)
+
+        job.status = "running"
+        job.worker = self.worker_id
+        job.attempts += 1
+        job.started_at = func.now()
+        job.heartbeat_at = func.now()
+        db.commit()
+        db.refresh(job)
+        return job
+
+    def _split(self, db: Session, job: Job):
+        """Replaces a top-level job by one queued shard per subtree and leaves it waiting."""
+        params = dict(job.params)
+        shards = _shard_roots(params["directory"], params.get("shard_depth", DEFAULT_SHARD_DEPTH))
+        for directory, recursive in shards:
+            db.add(Job(
+                kind=job.kind,
+                params=dict(params, directory=directory, recursive=recursive),
+                parent_id=job.id,
+                owner=job.owner,
+                created_by=job.created_by,
+            ))
+        job.params = dict(params, sharded=True)
+        job.status = "waiting"
+        job.heartbeat_at = func.now()
+        db.commit()
+        self._log(f"Job {job.id}: split '{params['directory']}' into {len(shards)} shards.")
+
+    def _execute(self, db: Session, job: Job) -> Dict[str, Any]:
+        """Runs one (unsharded) job with its own data session; progress goes through db."""
+        params = job.params
+
+        def _progress(stats: Dict[str, Any]):
+            db.execute(
+                update(Job).where(Job.id == job.id)
+                .values(items_done=stats["scanned"], heartbeat_at=func.now())
+            )
+            db.commit()
+            if db.execute(select(Job.cancel_requested).where(Job.id == job.id)).scalar():
+                raise JobCancelled(f"Job {job.id} was cancelled.")
+
+        work_db = database.SessionLocal()
+        heartbeat_stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job.id, heartbeat_stop),
+                                     name=f"filemeta-heartbeat-{job.id}", daemon=True)
+        heartbeat.start()
+        try:
+            common = dict(
+                custom_tags=params.get("custom_tags") or {},
+                owner_id=job.owner,
+                created_by=job.created_by,
+                batch_size=params.get("batch_size"),
+                progress_callback=_progress,
+                recursive=params.get("recursive", True),
+            )
+            if job.kind == "scan":
+                return scan_directory(work_db, params["directory"], **common)
+            return rescan_directory(work_db, params["directory"], flag_missing=params.get("flag_missing", False), **common)
+        finally:
+            heartbeat_stop.set()
+            heartbeat.join()
+            work_db.close()
+
+    def _heartbeat(self, job_id: int, stop: threading.Event):
+        """
+        Refreshes a running job's heartbeat every HEARTBEAT_INTERVAL seconds
+        until stop is set, in its own session. Progress reports only come
+        between batches, and phases like flagging missing files can take longer
+        than STALE_JOB_SECONDS without one.
+        """
+        db = database.SessionLocal()
+        try:
+            while not stop.wait(HEARTBEAT_INTERVAL):
+                try:
+                    db.execute(update(Job).where(Job.id == job_id).values(heartbeat_at=func.now()))
+                    db.commit()
+                except Exception as e:
+                    db.rollback()
+                    self._log(f"Job {job_id}: heartbeat failed: {e}")
+        finally:
+            db.close()
+
+    def run_job(self, db: Session, job: Job):
+        """Runs a claimed job to completion, recording its outcome."""
+        if job.parent_id is None and job.params.get("shard_depth", 0) > 0 and not job.params.get("sharded"):
+            self._split(db, job)
+            return
+
+        self._log(f"Job {job.id}: {job.kind} of '{job.params['directory']}' started.")
+        status, result, error = "succeeded", None, None
+        try:
+            result = self._execute(db, job)
+        except JobCancelled:
+            status = "cancelled"
+        except FileNotFoundError as e:
+            # The subtree vanished after sharding: nothing left to do there
+            status, result, error = ("failed", None, str(e)) if job.parent_id is None else ("succeeded", {}, None)
+        except Exception as e:
+            db.rollback()
+            status, error = "failed", str(e)
+
+        db.execute(
+            update(Job).where(Job.id == job.id).values(
+                status=status, result=result, error=error, finished_at=func.now(), heartbeat_at=func.now(),
+                **({"items_done": result.get("scanned", 0)} if result else {})
+            )
+        )
+        db.commit()
+        if job.parent_id:
+            _finalize_parent(db, job.parent_id)
+        self._log(f"Job {job.id}: {status}.")
+
+    def run_once(self) -> bool:
+        """Claims and runs at most one job. Returns False if the queue was empty."""
+        db = database.SessionLocal()
+        try:
+            job = self.claim(db)
+            if job is None:
+                return False
+            self.run_job(db, job)
+            return True
+        finally:
+            db.close()
+
+    def run(self, once: bool = False):
+        """Processes jobs until stop() is called (or, with once=True, until the queue is empty)."""
+        while not self._stop.is_set():
+            if self.run_once():
+                continue
+            if once:
+                break
+            self._stop.wait(self.poll_interval)
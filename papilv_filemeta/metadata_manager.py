@@ -224,149 +224,522 @@
 #     except Exception as e:
 #         db.rollback()
 #         raise Exception(f"An unexpected error occurred while deleting metadata for file ID {file_id}: {e}")
-from typing import Dict, Any, List, Optional # Import Optional
+from typing import Dict, Any, List, Optional, Callable, Iterator, NamedTuple, Tuple # Import Optional
 import os
 import json
-from sqlalchemy.orm import Session, joinedload
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.orm import Session, joinedload, selectinload, load_only, defer, raiseload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.exc import StaleDataError
 from sqlalchemy.exc import IntegrityError, NoResultFound
 from datetime import datetime
-from sqlalchemy import func, or_, String, Integer # Import Integer for casting
+from sqlalchemy import func, or_, case, cast, true, false, null, literal, literal_column, exists, values, column, Float, String, Integer, select, update, delete, bindparam # Import Integer for casting
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 from .models import File, Tag, User # Import User model to reference its ID
-from .utils import infer_metadata, parse_tag_value
+from .utils import (
+    infer_metadata, parse_tag_value, typed_tag_columns, promoted_file_columns, iter_directory_files, stat_fingerprint,
+    escape_like
+)
+from .hashing import ContentHasher
+from .bloom import KnownPathFilter, LOOKUP_CHUNK_SIZE
+from .schema import SEARCH_CONFIG, trigram_search_enabled
+from .query_lang import parse_query, compile_query
+from .pagination import Page, paginate, DEFAULT_PAGE_SIZE
 
 # Important: This file (metadata_manager.py) should NOT import
 # 'engine', 'Base', or 'get_db' from '.database'.
 # Its functions receive a 'Session' object directly via FastAPI's Depends.
 
-def add_file_metadata(
+ON_CONFLICT_MODES = ("error", "skip", "update")
+
+
+def upsert_file_metadata(
     db: Session,
     filepath: str,
     custom_tags: Dict[str, Any],
-    owner_id: Optional[int] = None, # New: Accept owner_id
-    created_by: Optional[str] = None # New: Accept created_by
-) -> File:
+    owner_id: Optional[int] = None,
+    created_by: Optional[str] = None,
+    on_conflict: str = "update",
+    owned_only: bool = False
+) -> Tuple[int, bool]:
     """
-    Adds new file metadata and associated custom tags to the database.
-    Associates the file with the provided owner_id.
+    Catalogs a file and returns (file ID, created), where created is False
+    if the path was already cataloged. on_conflict says what happens then:
+    'update' refreshes its inferred metadata and adds/modifies the given tags
+    (other tags are kept), 'skip' leaves it untouched and 'error' raises
+    ValueError. With owned_only, another owner's file is neither updated nor
+    reported, whatever the mode: ValueError, without its ID.
+
+    The file and its tags are written by a single INSERT ... ON CONFLICT
+    (filepath) statement, the tag upsert as a CTE, then committed: there is no
+    pre-check, so concurrent scanners adding the same paths neither fail nor
+    wait on each other beyond the conflicting row.
     """
+    if on_conflict not in ON_CONFLICT_MODES:
+        raise ValueError(f"Invalid on_conflict mode '{on_conflict}'. Choose one of: {', '.join(ON_CONFLICT_MODES)}.")
     if not os.path.exists(filepath):
         raise FileNotFoundError(f"File not found at: {filepath}")
 
-    existing_file = db.query(File).filter(File.filepath == filepath).first()
-    if existing_file:
-        raise ValueError(f"Metadata for file '{filepath}' already exists (ID: {existing_file.id}). Use 'update' to modify.")
-
-    inferred_data = infer_metadata(filepath)
-
-    file_record = File(
-        filename=os.path.basename(filepath),
-        filepath=filepath,
-        # FIX: Assign owner_id directly from the authenticated user
-        owner=owner_id,
-        # FIX: Assign created_by from the authenticated user
-        created_by=created_by if created_by else "system", # Use provided created_by or default
-        created_at=datetime.now(),
-        updated_at=datetime.now(),
-        inferred_tags=inferred_data
-    )
-    db.add(file_record)
-    db.flush() # Flush to get the file_record.id before adding tags
-
-    for key, value in custom_tags.items():
-        typed_value, value_type = parse_tag_value(str(value)) # parse_tag_value should handle input, ensuring it returns string for value
-
-        tag_record = Tag(
-            file_id=file_record.id,
-            key=key,
-            value=str(typed_value), # Ensure value is stored as string in DB
-            value_type=value_type
+    row = build_file_row(filepath, infer_metadata(filepath), owner_id, created_by, datetime.now())
+    insert_file = pg_insert(File.__table__).values(row)
+    if on_conflict == "update":
+        # Ownership and creation stay those of the first insert
+        insert_file = insert_file.on_conflict_do_update(
+            index_elements=[File.__table__.c.filepath],
+            set_={**{name: insert_file.excluded[name] for name in row
+                     if name not in ("filepath", "owner", "created_by", "created_at")},
+                  "version": File.__table__.c.version + 1},
+            where=(File.__table__.c.owner == owner_id) if owned_only else None
         )
-        db.add(tag_record)
+    else:
+        insert_file = insert_file.on_conflict_do_nothing(index_elements=[File.__table__.c.filepath])
+    # xmax is 0 only on a freshly inserted row version
+    written = insert_file.returning(
+        File.__table__.c.id, literal_column("xmax = 0").label("created"), true().label("written"),
+        File.__table__.c.owner
+    ).cte("written")
+
+    # A path left alone by ON CONFLICT is reported from the table instead
+    statement = select(written.c.id, written.c.created, written.c.written, written.c.owner).union_all(
+        select(File.id, false(), false(), File.owner).where(File.filepath == filepath, ~exists(select(written.c.id)))
+    )
+    if custom_tags:
+        statement = statement.add_cte(_tag_upsert_for_files(written, custom_tags).cte("upserted"))
 
     try:
+        result = db.execute(statement).first()
+        if result is None:
+            # The conflicting row was committed by a concurrent insert after this statement's snapshot
+            existing = db.execute(select(File.id, File.owner).where(File.filepath == filepath)).one()
+            result = (existing.id, False, False, existing.owner)
+        file_id, created, was_written, file_owner = result
+        if owned_only and not created and file_owner != owner_id:
+            raise ValueError(f"Metadata for file '{filepath}' already exists and belongs to another user.")
+        if not was_written and on_conflict == "error":
+            raise ValueError(f"Metadata for file '{filepath}' already exists (ID: {file_id}). Use 'update' to modify.")
         db.commit()
-        # IMPORTANT: Eager load the tags directly before returning.
-        # Re-query with joinedload.
-        file_record_with_tags = db.query(File).options(joinedload(File.tags)).filter(File.id == file_record.id).first()
-        return file_record_with_tags
-    except IntegrityError as e:
+        return file_id, created
+    except ValueError:
         db.rollback()
-        if "duplicate key value violates unique constraint" in str(e).lower() and "file_filepath_key" in str(e).lower():
-            # More specific check for filepath uniqueness violation
-            existing_file_on_error = db.query(File).filter(File.filepath == filepath).first()
-            existing_id_msg = f"(ID: {existing_file_on_error.id})" if existing_file_on_error else ""
-            raise ValueError(f"Metadata for file '{filepath}' already exists {existing_id_msg}. Use 'update' to modify.")
-        elif "null value in column \"owner\" violates not-null constraint" in str(e).lower() and owner_id is None:
-            raise ValueError("Owner ID cannot be null. Please ensure a user is logged in.")
-        else:
-            raise Exception(f"Database integrity error: {e}. Check database constraints.")
+        raise
     except Exception as e:
         db.rollback()
         raise Exception(f"An unexpected error occurred while adding file metadata: {e}")
 
-def get_file_metadata(db: Session, file_id: int) -> File:
+
+def add_file_metadata(
+    db: Session,
+    filepath: str,
+    custom_tags: Dict[str, Any],
+    owner_id: Optional[int] = None, # New: Accept owner_id
+    created_by: Optional[str] = None, # New: Accept created_by
+    on_conflict: str = "error"
+) -> File:
+    """
+    Adds new file metadata and associated custom tags to the database.
+    Associates the file with the provided owner_id. An already cataloged path
+    raises ValueError unless on_conflict is 'skip' or 'update' (see
+    upsert_file_metadata()).
+    """
+    file_id, _ = upsert_file_metadata(db, filepath, custom_tags, owner_id, created_by, on_conflict)
+    # IMPORTANT: Eager load the tags directly before returning.
+    return db.query(File).options(joinedload(File.tags)).filter(File.id == file_id).first()
+
+
+def get_file_metadata(
+    db: Session,
+    file_id: int,
+    fields: Optional[List[str]] = None,
+    tag_keys: Optional[List[str]] = None
+) -> File:
     """
     Retrieves file metadata by its ID, eager loading tags.
+    With fields and/or tag_keys only that part is loaded (see loading_options()).
     """
-    file_record = db.query(File).options(joinedload(File.tags)).filter(File.id == file_id).first()
+    if fields is None and tag_keys is None:
+        options = [joinedload(File.tags)]
+    else:
+        options = loading_options(fields=fields, tag_keys=tag_keys)
+    file_record = db.query(File).options(*options).filter(File.id == file_id).first()
     if not file_record:
         raise NoResultFound(f"No metadata found for file ID: {file_id}")
     return file_record
 
-def list_files(db: Session, owner_id: Optional[int] = None) -> List[File]: # New: Optional owner_id
+LOADING_PROFILES = ("summary", "standard", "full")
+SPARSE_FILE_FIELDS = ("id", "filename", "filepath", "owner", "created_by", "created_at", "updated_at",
+                      "version", "inferred_tags", "tags")
+
+
+def _sparse_loading_options(fields: Optional[List[str]], tag_keys: Optional[List[str]]) -> list:
+    fields = list(SPARSE_FILE_FIELDS) if fields is None else fields
+    unknown = [field for field in fields if field not in SPARSE_FILE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(SPARSE_FILE_FIELDS)}.")
+    # id, owner and version are always loaded: callers check ownership and set ETags
+    columns = {"id", "owner", "version"} | {field for field in fields if field != "tags"}
+    options = [load_only(*[getattr(File, column) for column in sorted(columns)])]
+    if "tags" not in fields and tag_keys is None:
+        return options + [raiseload(File.tags)]
+    relationship = File.tags if tag_keys is None else File.tags.and_(Tag.key.in_(tag_keys))
+    return options + [selectinload(relationship).load_only(Tag.key, Tag.value, Tag.value_type)]
+
+
+def loading_options(
+    profile: str = "full",
+    fields: Optional[List[str]] = None,
+    tag_keys: Optional[List[str]] = None
+) -> list:
+    """
+    Returns the query options that load File rows for a given use:
+      - 'summary': only id, filename and filepath; tags are not loaded and
+        touching them raises instead of lazy loading one file at a time.
+      - 'standard': every column except the (large) inferred_tags, with tags.
+      - 'full': every column, with tags.
+    Tags are always batched into IN queries of up to 500 files (selectinload),
+    never joined or lazy loaded per file, so the number of queries for a page
+    depends only on its size: two for the default page size.
+
+    fields (names from SPARSE_FILE_FIELDS, 'tags' for the custom tags) and
+    tag_keys override the profile with a sparse fieldset: only those columns
+    are selected, and with tag_keys only the tags with those keys are loaded
+    (the files' tags collections then hold just those, so don't modify them).
+    """
+    if fields is not None or tag_keys is not None:
+        return _sparse_loading_options(fields, tag_keys)
+    if profile not in LOADING_PROFILES:
+        raise ValueError(f"Unsupported loading profile '{profile}'. Available: {', '.join(LOADING_PROFILES)}.")
+    if profile == "summary":
+        return [load_only(File.id, File.filename, File.filepath), raiseload(File.tags)]
+    if profile == "standard":
+        return [defer(File.inferred_tags), selectinload(File.tags)]
+    return [selectinload(File.tags)]
+
+
+def list_files(db: Session, owner_id: Optional[int] = None, profile: str = "full") -> List[File]: # New: Optional owner_id
     """
-    Lists all file metadata records in the database, eager loading tags.
-    Optionally filters by owner_id.
+    Lists all file metadata records in the database, loaded per profile (see
+    loading_options()). Optionally filters by owner_id. Loads everything at
+    once; listings served to clients should use list_files_page() instead.
     """
-    query = db.query(File).options(joinedload(File.tags))
+    query = db.query(File).options(*loading_options(profile))
     if owner_id is not None:
         query = query.filter(File.owner == owner_id) # Filter by owner if provided
     return query.all()
 
-def search_files(db: Session, keywords: List[str], owner_id: Optional[int] = None) -> List[File]: # New: Optional owner_id
+FILE_LIST_ORDERS = ("id", "updated_at")
+
+
+def _list_sort_keys(order: str):
+    if order not in FILE_LIST_ORDERS:
+        raise ValueError(f"Unsupported order '{order}'. Available: {', '.join(FILE_LIST_ORDERS)}.")
+    if order == "updated_at":
+        return [(File.updated_at, True), (File.id, True)] # Most recently updated first
+    return [(File.id, False)]
+
+
+def list_files_page(
+    db: Session,
+    owner_id: Optional[int] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    order: str = "id",
+    with_estimate: bool = False,
+    profile: str = "full",
+    fields: Optional[List[str]] = None,
+    tag_keys: Optional[List[str]] = None
+) -> Page:
     """
-    Searches for files based on keywords across various fields, eager loading tags.
-    Optionally filters by owner_id.
+    Returns one page of file metadata records, loaded per profile or sparse
+    fieldset (see loading_options()). Optionally filters by owner_id.
+
+    order is 'id' (ascending) or 'updated_at' (most recently updated first).
+    Pass the page's next_cursor back as cursor to get the following page.
+    With with_estimate, estimated_total holds the planner's estimate of the
+    number of matching files (no COUNT(*) is run).
+    """
+    sort_keys = _list_sort_keys(order)
+    query = db.query(File).options(*loading_options(profile, fields, tag_keys))
+    if owner_id is not None:
+        query = query.filter(File.owner == owner_id) # Filter by owner if provided
+    return paginate(db, query, sort_keys, f"list:{order}", limit, cursor, with_estimate)
+
+DEFAULT_SEARCH_LIMIT = 100
+
+
+def build_search_query(keywords: List[str], any_word: bool = False) -> Optional[str]:
+    """
+    Turns search keywords into a tsquery string: keywords are alternatives
+    (OR), the words inside one keyword must all match (AND), and every word
+    matches as a prefix. With any_word, each word on its own is an
+    alternative. Punctuation splits words, as in the stored search
+    documents. Returns None if no keyword contains a searchable word.
+    """
+    alternatives = []
+    for keyword in keywords:
+        words = [word for word in re.split(r'[\W_]+', keyword.lower()) if word]
+        if any_word:
+            alternatives.extend(f"{word}:*" for word in words)
+        elif words:
+            alternatives.append("(" + " & ".join(f"{word}:*" for word in words) + ")")
+    return " | ".join(alternatives) if alternatives else None
+
+
+SEARCH_MATCH_MODES = ("fulltext", "substring", "fuzzy")
+
+
+def search_files_page(
+    db: Session,
+    keywords: List[str],
+    owner_id: Optional[int] = None,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    match: str = "fulltext",
+    cursor: Optional[str] = None,
+    with_estimate: bool = False,
+    profile: str = "full",
+    fields: Optional[List[str]] = None,
+    tag_keys: Optional[List[str]] = None
+) -> Page:
+    """
+    Searches for files based on keywords, best matches first, loaded per
+    profile or sparse fieldset.
+    Optionally filters by owner_id. Files matching any keyword are returned,
+    one page at a time (see list_files_page() for cursor and with_estimate).
+
+    match selects how keywords are matched:
+      - 'fulltext' (default): against the trigger-maintained full-text search
+        document of each file (name, path components, creator and inferred
+        string metadata) and the keys and values of its custom tags, via
+        their GIN indexes, ranked with ts_rank so matches in the file name
+        come first.
+      - 'substring': case-insensitive fragment match (ILIKE '%keyword%') on
+        filename and filepath, for fragments like '2024_q3' that don't
+        tokenize well. File name matches come first.
+      - 'fuzzy': typo-tolerant, the top `limit` files by trigram similarity()
+        of the filename (or word_similarity() within the filepath).
+    Substring and fuzzy matching use the trigram indexes created by
+    enable_trigram_search(); fuzzy matching requires them and raises
+    ValueError without them.
     """
+    if match not in SEARCH_MATCH_MODES:
+        raise ValueError(f"Unsupported match mode '{match}'. Available: {', '.join(SEARCH_MATCH_MODES)}.")
+    if match == "fuzzy" and not trigram_search_enabled(db.get_bind()):
+        raise ValueError("Fuzzy matching requires the pg_trgm extension. Run 'filemeta setup-trigram' first.")
+
     if not keywords:
         # If no keywords, but an owner_id is provided, still list by owner.
         # Otherwise, return empty list or all files (depending on intent)
         if owner_id is not None:
-            return list_files(db, owner_id=owner_id)
-        return []
+            return list_files_page(db, owner_id=owner_id, limit=limit, cursor=cursor, with_estimate=with_estimate,
+                                   profile=profile, fields=fields, tag_keys=tag_keys)
+        return Page([], None, 0 if with_estimate else None)
 
-    search_conditions = []
-    for keyword in keywords:
-        search_pattern = f"%{keyword.lower()}%"
+    # Tags come in a separate IN query, so the LIMIT applies to files only
+    query = db.query(File).options(*loading_options(profile, fields, tag_keys))
+    if owner_id is not None:
+        query = query.filter(File.owner == owner_id)
 
-        search_conditions.append(func.lower(File.filename).like(search_pattern))
-        search_conditions.append(func.lower(File.filepath).like(search_pattern))
-        # REMOVED: func.lower(File.owner).like(search_pattern) - Owner is an Integer ID
-        search_conditions.append(func.lower(File.created_by).like(search_pattern))
+    # Ranks are cast to double precision so they survive the round trip through a cursor exactly
+    if match == "substring":
+        patterns = ['%' + escape_like(keyword) + '%' for keyword in keywords]
+        in_filename = or_(*[File.filename.ilike(pattern) for pattern in patterns])
+        in_filepath = or_(*[File.filepath.ilike(pattern) for pattern in patterns])
+        query = query.filter(or_(in_filename, in_filepath))
+        sort_keys = [(case((in_filename, 0), else_=1), False), (func.length(File.filepath), False), (File.id, False)]
 
-        # Search within inferred_tags (JSONB) - Casting to String for LIKE operator
-        # This will search values within the JSONB. For keys, you might need specific JSONB operators.
-        search_conditions.append(func.lower(File.inferred_tags.astext).like(search_pattern))
+    elif match == "fuzzy":
+        # '%' and '%>' are the index-assisted forms of similarity() and word_similarity()
+        conditions, scores = [], []
+        for keyword in keywords:
+            conditions.append(File.filename.op('%', is_comparison=True)(keyword))
+            conditions.append(File.filepath.op('%>', is_comparison=True)(keyword))
+            scores.append(func.similarity(File.filename, keyword))
+            scores.append(func.word_similarity(keyword, File.filepath))
+        query = query.filter(or_(*conditions))
+        sort_keys = [(cast(func.greatest(*scores), Float), True), (File.id, False)]
 
+    else:
+        query_text = build_search_query(keywords)
+        if query_text is None:
+            return Page([], None, 0 if with_estimate else None)
+        # Candidates come from the two GIN indexes (a UNION, as an OR would scan every file): files
+        # whose own document or one of whose tags has any of the words. The keywords are then checked
+        # against both documents together, as their words may be split between, say, name and tag.
+        any_word = func.to_tsquery(SEARCH_CONFIG, build_search_query(keywords, any_word=True))
+        candidates = select(File.id).where(File.search_vector.op('@@')(any_word)).union(
+            select(Tag.file_id).where(func.tag_search_document(Tag.key, Tag.value).op('@@')(any_word)))
+        query = query.filter(File.id.in_(candidates))
+        document = File.search_vector.op('||')(func.file_tags_document(File.id))
+        ts_query = func.to_tsquery(SEARCH_CONFIG, query_text)
+        query = query.filter(document.op('@@')(ts_query))
+        sort_keys = [(cast(func.ts_rank(document, ts_query), Float), True), (File.id, False)]
+
+    return paginate(db, query, sort_keys, f"search:{match}", limit, cursor, with_estimate)
 
-        # Search within custom tags (key and value)
-        search_conditions.append(
-            File.tags.any(
-                or_(
-                    func.lower(Tag.key).like(search_pattern),
-                    func.lower(Tag.value).like(search_pattern)
-                )
-            )
-        )
 
-    query = db.query(File).options(joinedload(File.tags)).filter(or_(*search_conditions))
+def search_files(
+    db: Session,
+    keywords: List[str],
+    owner_id: Optional[int] = None,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    match: str = "fulltext",
+    profile: str = "full"
+) -> List[File]:
+    """Returns the best `limit` matches of search_files_page() as a plain list."""
+    return search_files_page(db, keywords, owner_id=owner_id, limit=limit, match=match, profile=profile).items
+
 
-    # FIX: Add owner_id filter to the search query if provided
+def query_files_page(
+    db: Session,
+    expression: str,
+    owner_id: Optional[int] = None,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    cursor: Optional[str] = None,
+    with_estimate: bool = False,
+    profile: str = "full",
+    fields: Optional[List[str]] = None,
+    tag_keys: Optional[List[str]] = None
+) -> Page:
+    """
+    Finds files matching a query language expression (see query_lang.py), e.g.
+    "project=alpha AND retention_days>=30 AND size>1GB", loaded per profile
+    or sparse fieldset.
+    Optionally filters by owner_id. Returns one page in ID order (see
+    list_files_page() for cursor and with_estimate). Raises ValueError for an
+    invalid query.
+    """
+    condition = compile_query(parse_query(expression))
+    query = db.query(File).options(*loading_options(profile, fields, tag_keys)).filter(condition)
     if owner_id is not None:
         query = query.filter(File.owner == owner_id)
+    return paginate(db, query, [(File.id, False)], "query", limit, cursor, with_estimate)
+
+
+def query_files(
+    db: Session,
+    expression: str,
+    owner_id: Optional[int] = None,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    profile: str = "full"
+) -> List[File]:
+    """Returns the first `limit` matches of query_files_page() as a plain list."""
+    return query_files_page(db, expression, owner_id=owner_id, limit=limit, profile=profile).items
+
+
+# --- Directory Browsing ---
+
+class PrefixSummary(NamedTuple):
+    prefix: str
+    file_count: int
+    total_bytes: int
+
+
+class BrowseResult(NamedTuple):
+    prefix: str
+    delimiter: Optional[str]
+    common_prefixes: List[PrefixSummary] # Sub-"directories", with totals over everything under them
+    files: Page # Immediate children, one page in path order
+    file_count: int # Immediate children in total
+    total_bytes: int
+
+
+def browse_files(
+    db: Session,
+    prefix: str = "",
+    delimiter: Optional[str] = "/",
+    owner_id: Optional[int] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None
+) -> BrowseResult:
+    """
+    Lists the catalog like a directory (S3-style): the files whose path starts
+    with prefix and contains no further delimiter after it, and the common
+    sub-prefixes (up to and including the next delimiter) with the number and
+    total size of the files under each. Without a delimiter every file under
+    prefix is an immediate child. Optionally filters by owner_id.
+
+    The prefix match is served by ix_file_filepath_pattern (text_pattern_ops),
+    and the prefix totals come from one GROUP BY over that range.
+    """
+    rest = func.substr(File.filepath, len(prefix) + 1)
+    if delimiter:
+        position = func.strpos(rest, delimiter)
+        is_child = position == 0
+        child_prefix = case((position > 0, func.concat(prefix, func.left(rest, position + len(delimiter) - 1))))
+    else:
+        is_child = true()
+        child_prefix = cast(null(), String)
+    under_prefix = [File.filepath.like(escape_like(prefix) + '%')]
+    if owner_id is not None:
+        under_prefix.append(File.owner == owner_id)
+
+    # One pass over the range: a group per sub-prefix, plus the NULL group of immediate children
+    groups = db.execute(
+        select(child_prefix.label("prefix"), func.count(), func.coalesce(func.sum(File.size_bytes), 0))
+        .where(*under_prefix)
+        .group_by(child_prefix)
+        .order_by(child_prefix.asc().nulls_first())
+    ).all()
+    file_count, total_bytes = 0, 0
+    common_prefixes = []
+    for group_prefix, count, size in groups:
+        if group_prefix is None:
+            file_count, total_bytes = count, int(size)
+        else:
+            common_prefixes.append(PrefixSummary(group_prefix, count, int(size)))
+
+    query = db.query(File).options(load_only(File.id, File.filename, File.filepath, File.owner, File.size_bytes,
+                                             File.mtime, File.mime_type), raiseload(File.tags))
+    query = query.filter(*under_prefix, is_child)
+    files = paginate(db, query, [(File.filepath, False)], "browse", limit, cursor)
+    return BrowseResult(prefix, delimiter or None, common_prefixes, files, file_count, total_bytes)
+
+
+def _tag_write_statement(
+    file_id: int,
+    tag_rows: List[Dict[str, Any]],
+    tags_to_remove: Optional[List[str]],
+    overwrite_existing: bool
+):
+    """
+    Builds one statement that applies a tag update to a file and selects the
+    file's resulting tags: a DELETE of the removed (or, when overwriting, all
+    other) tags and an INSERT ... ON CONFLICT DO UPDATE of the new values, as
+    data-modifying CTEs, with the upserted tags returned alongside the kept ones.
+    """
+    tag_table = Tag.__table__
+    new_keys = [row["key"] for row in tag_rows]
+    untouched = [tag_table.c.file_id == file_id]
+    if new_keys:
+        untouched.append(tag_table.c.key.not_in(new_keys))
+
+    removed = None
+    if overwrite_existing:
+        removed = tag_table.delete().where(*untouched)
+    elif tags_to_remove:
+        removed = tag_table.delete().where(*untouched, tag_table.c.key.in_(tags_to_remove))
+        untouched.append(tag_table.c.key.not_in(tags_to_remove))
 
-    return query.distinct().all()
+    parts = []
+    if tag_rows:
+        upsert = pg_insert(tag_table).values(tag_rows)
+        upsert = upsert.on_conflict_do_update(
+            constraint="_file_key_uc",
+            set_={column: upsert.excluded[column] for column in tag_rows[0] if column not in ("file_id", "key")}
+        ).returning(*tag_table.c).cte("upserted")
+        parts.append(select(*upsert.c))
+    if not overwrite_existing:
+        parts.append(select(*tag_table.c).where(*untouched))
+    elif not parts:
+        parts.append(select(*tag_table.c).where(false())) # All tags removed, none to return
+
+    statement = parts[0] if len(parts) == 1 else parts[0].union_all(*parts[1:])
+    if removed is not None:
+        # Not referenced by the SELECT, but a data-modifying CTE always runs
+        statement = statement.add_cte(removed.returning(tag_table.c.id).cte("removed"))
+    return statement
 
 
 def update_file_tags(
@@ -375,95 +748,1091 @@ def update_file_tags(
     tags_to_add_modify: Optional[Dict[str, Any]] = None,
     tags_to_remove: Optional[List[str]] = None,
     new_filepath: Optional[str] = None,
-    overwrite_existing: bool = False
+    overwrite_existing: bool = False,
+    expected_versions: Optional[List[int]] = None
 ) -> File:
     """
-    Updates metadata (tags and/or filepath) for a specific file.
+    Updates metadata (tags and/or filepath) for a specific file and bumps its version.
+    With expected_versions, the update only applies if the file is at one of
+    these versions; otherwise StaleDataError is raised.
+
+    Takes three round trips whatever the number of tags: an UPDATE of the file
+    row, one statement for all tag removals and upserts (see
+    _tag_write_statement()) and the commit. The returned File and its tags
+    are built from the RETURNING rows, not reloaded, and detached from the
+    session so they stay readable after the commit.
     """
-    # Eager load tags here too, as they might be needed for modification or removal logic
-    file_record = db.query(File).options(joinedload(File.tags)).filter(File.id == file_id).first()
-    if not file_record:
-        raise NoResultFound(f"No metadata found for file ID: {file_id}")
+    if new_filepath and not os.path.exists(new_filepath):
+        raise ValueError(f"New file path '{new_filepath}' does not exist on the filesystem. Cannot update path.")
+
+    file_values = {"updated_at": datetime.now(), "version": File.version + 1}
+    if new_filepath:
+        file_values.update(filepath=new_filepath, filename=os.path.basename(new_filepath)) # Update filename if path changes
+    tag_rows = [_build_tag_row(file_id, key, value) for key, value in (tags_to_add_modify or {}).items()]
 
     try:
-        # 1. Handle File Path Update
-        if new_filepath:
-            if not os.path.exists(new_filepath):
-                raise ValueError(f"New file path '{new_filepath}' does not exist on the filesystem. Cannot update path.")
-            
-            # Check for existing file with the new_filepath to prevent unique constraint violation
-            existing_file_at_new_path = db.query(File).filter(File.filepath == new_filepath, File.id != file_id).first()
-            if existing_file_at_new_path:
-                raise ValueError(f"File metadata for '{new_filepath}' already exists (ID: {existing_file_at_new_path.id}). Cannot update path due to conflict.")
-            
-            file_record.filepath = new_filepath
-            file_record.filename = os.path.basename(new_filepath) # Update filename if path changes
-
-        # 2. Handle Tag Removals/Overwrites
-        if overwrite_existing:
-            # If overwrite is true, delete ALL existing custom tags for this file
-            db.query(Tag).filter(Tag.file_id == file_id).delete(synchronize_session=False)
-            db.flush() # Ensure deletions are processed before adding new ones
-        else:
-            # If not overwriting, handle specific tag removals
-            if tags_to_remove:
-                # Ensure tags_to_remove only contains strings (keys)
-                db.query(Tag).filter(
-                    Tag.file_id == file_id,
-                    Tag.key.in_(tags_to_remove)
-                ).delete(synchronize_session=False)
-                db.flush() # Flush to ensure these are removed before potential re-add/update
-
-        # 3. Handle Tags to Add/Modify
-        if tags_to_add_modify:
-            for key, value in tags_to_add_modify.items():
-                existing_tag = db.query(Tag).filter(Tag.file_id == file_id, Tag.key == key).first()
-                typed_value, value_type = parse_tag_value(str(value)) # Always parse value for type
-
-                if existing_tag:
-                    # Modify existing tag's value and type
-                    existing_tag.value = str(typed_value)
-                    existing_tag.value_type = value_type
-                else:
-                    # Add new tag
-                    tag_record = Tag(
-                        file_id=file_record.id,
-                        key=key,
-                        value=str(typed_value),
-                        value_type=value_type
-                    )
-                    db.add(tag_record)
-
-        # 4. Update the file's updated_at timestamp
-        file_record.updated_at = datetime.now()
-
-        db.add(file_record) # Mark the file_record as modified if changes were made
+        # 1. The file row (and its path); no row means no such file, or not at an expected version
+        update_file = update(File).where(File.id == file_id)
+        if expected_versions is not None:
+            update_file = update_file.where(File.version.in_(expected_versions))
+        file_record = db.execute(
+            update_file.values(**file_values).returning(File),
+            execution_options={"populate_existing": True}
+        ).scalars().first()
+        if not file_record:
+            raise _missing_or_stale(db, file_id)
+
+        # 2. Removals/overwrite and adds/modifications in one statement, returning the resulting tags
+        tags = db.execute(
+            select(Tag).from_statement(_tag_write_statement(file_id, tag_rows, tags_to_remove, overwrite_existing)),
+            execution_options={"populate_existing": True}
+        ).scalars().all()
+        set_committed_value(file_record, "tags", sorted(tags, key=lambda tag: tag.key))
+
+        db.expunge(file_record) # Also expunges the tags, so the commit doesn't expire them
         db.commit()
-        # Re-query with joinedload to ensure the returned file_record has its tags loaded
-        db.refresh(file_record) # Refresh state from DB, needed before joinedload
-        file_record_with_tags = db.query(File).options(joinedload(File.tags)).filter(File.id == file_record.id).first()
-        return file_record_with_tags
-    except NoResultFound:
+        return file_record
+    except (NoResultFound, StaleDataError):
         db.rollback()
         raise
+    except IntegrityError as e:
+        db.rollback()
+        if new_filepath and "file_filepath_key" in str(e).lower():
+            existing_file_at_new_path = db.query(File.id).filter(File.filepath == new_filepath).first()
+            existing_id_msg = f" (ID: {existing_file_at_new_path.id})" if existing_file_at_new_path else ""
+            raise ValueError(f"File metadata for '{new_filepath}' already exists{existing_id_msg}. Cannot update path due to conflict.")
+        raise Exception(f"An unexpected error occurred while updating file metadata for ID {file_id}: {e}")
     except Exception as e:
         db.rollback()
         raise Exception(f"An unexpected error occurred while updating file metadata for ID {file_id}: {e}")
 
-def delete_file_metadata(db: Session, file_id: int):
+# --- Bulk Retagging ---
+
+RETAG_BATCH_SIZE = 5000 # Files retagged per transaction
+
+
+def _tag_upsert_for_files(files, tags_to_add_modify: Dict[str, Any]):
     """
-    Deletes file metadata and its associated tags from the database.
+    INSERT ... ON CONFLICT DO UPDATE setting every given tag on each file whose
+    ID is in the 'id' column of files (a CTE), returning the tag IDs.
     """
-    file_record = db.query(File).filter(File.id == file_id).first()
-    if not file_record:
-        raise NoResultFound(f"No metadata found for file ID: {file_id}")
+    tag_table = Tag.__table__
+    tag_rows = [_build_tag_row(0, key, value) for key, value in tags_to_add_modify.items()]
+    value_columns = [name for name in tag_rows[0] if name != "file_id"]
+    new_tags = values(*[column(name, tag_table.c[name].type) for name in value_columns], name="new_tags").data(
+        [tuple(row[name] for name in value_columns) for row in tag_rows]
+    )
+    # Values cast explicitly: a VALUES column of only NULLs would be text
+    upsert = pg_insert(tag_table).from_select(
+        ["file_id"] + value_columns,
+        select(files.c.id, *[cast(new_tags.c[name], tag_table.c[name].type) for name in value_columns])
+        .select_from(files.join(new_tags, true()))
+    )
+    return upsert.on_conflict_do_update(
+        constraint="_file_key_uc",
+        set_={name: upsert.excluded[name] for name in value_columns if name != "key"}
+    ).returning(tag_table.c.id)
+
+
+def file_selector_conditions(
+    file_ids: Optional[List[int]] = None,
+    path_prefix: Optional[str] = None,
+    expression: Optional[str] = None,
+    owner_id: Optional[int] = None
+) -> list:
+    """
+    Returns the conditions on File selecting the files that match all of the
+    given selectors: a list of file IDs, a directory (path_prefix; every file
+    below it) and a query language expression. Optionally limited to owner_id.
+    Raises ValueError if no selector is given or the expression is invalid.
+    """
+    conditions = []
+    if file_ids is not None:
+        conditions.append(File.id.in_(file_ids))
+    if path_prefix:
+        conditions.append(File.filepath.like(escape_like(path_prefix.rstrip(os.sep) + os.sep) + '%'))
+    if expression:
+        conditions.append(compile_query(parse_query(expression)))
+    if not conditions:
+        raise ValueError("Select the files by file IDs, a path prefix and/or a query expression.")
+    if owner_id is not None:
+        conditions.append(File.owner == owner_id)
+    return conditions
+
+
+def iter_retag_batches(
+    db: Session,
+    file_ids: Optional[List[int]] = None,
+    path_prefix: Optional[str] = None,
+    expression: Optional[str] = None,
+    tags_to_add_modify: Optional[Dict[str, Any]] = None,
+    tags_to_remove: Optional[List[str]] = None,
+    owner_id: Optional[int] = None,
+    batch_size: int = RETAG_BATCH_SIZE
+) -> Iterator[Dict[str, int]]:
+    """
+    Adds/modifies and removes custom tags on every file matched by the
+    selectors (see file_selector_conditions()), e.g. retention=7y on all
+    files under /finance/2019, yielding the running counters (files,
+    tags_written, tags_removed, batches) after each committed batch.
+
+    Works through the matches in id order, one transaction per batch of
+    files. Each batch is a single set-based statement: the batch of IDs, a
+    DELETE of the removed tags, an INSERT ... ON CONFLICT DO UPDATE of the new
+    values for all files of the batch and the files' updated_at, as CTEs. An
+    interrupted run can simply be repeated. Raises ValueError for a missing
+    selector, an invalid expression or nothing to change.
+    """
+    if not tags_to_add_modify and not tags_to_remove:
+        raise ValueError("Nothing to change. Provide tags to add/modify and/or tags to remove.")
+    conditions = file_selector_conditions(file_ids, path_prefix, expression, owner_id)
 
+    tag_table = Tag.__table__
+    removed_keys = [key for key in (tags_to_remove or []) if key not in (tags_to_add_modify or {})]
+
+    stats = {"files": 0, "tags_written": 0, "tags_removed": 0, "batches": 0}
+    last_id = 0
+    try:
+        while True:
+            batch = (
+                select(File.id).where(*conditions, File.id > last_id).order_by(File.id).limit(batch_size).cte("batch")
+            )
+            batch_ids = select(batch.c.id)
+            removed_count, written_count = literal(0), literal(0)
+            ctes = []
+            if removed_keys:
+                removed = (
+                    tag_table.delete()
+                    .where(tag_table.c.file_id.in_(batch_ids), tag_table.c.key.in_(removed_keys))
+                    .returning(tag_table.c.id).cte("removed")
+                )
+                removed_count = select(func.count()).select_from(removed).scalar_subquery()
+                ctes.append(removed)
+            if tags_to_add_modify:
+                upsert = _tag_upsert_for_files(batch, tags_to_add_modify).cte("upserted")
+                written_count = select(func.count()).select_from(upsert).scalar_subquery()
+                ctes.append(upsert)
+            ctes.append(
+                File.__table__.update().where(File.__table__.c.id.in_(batch_ids))
+                .values(updated_at=datetime.now(), version=File.__table__.c.version + 1)
+                .returning(File.__table__.c.id).cte("touched")
+            )
+
+            statement = select(
+                select(func.max(batch.c.id)).scalar_subquery().label("last_id"),
+                select(func.count()).select_from(batch).scalar_subquery().label("files"),
+                removed_count.label("removed"),
+                written_count.label("written"),
+            ).add_cte(*ctes)
+            row = db.execute(statement).one()
+            if not row.files:
+                db.rollback()
+                break
+            db.commit()
+            last_id = row.last_id
+
+            stats["files"] += row.files
+            stats["tags_written"] += row.written
+            stats["tags_removed"] += row.removed
+            stats["batches"] += 1
+            yield dict(stats)
+    except Exception as e:
+        db.rollback()
+        raise Exception(f"An unexpected error occurred while retagging files: {e}")
+
+
+def retag_files(
+    db: Session,
+    file_ids: Optional[List[int]] = None,
+    path_prefix: Optional[str] = None,
+    expression: Optional[str] = None,
+    tags_to_add_modify: Optional[Dict[str, Any]] = None,
+    tags_to_remove: Optional[List[str]] = None,
+    owner_id: Optional[int] = None,
+    batch_size: int = RETAG_BATCH_SIZE,
+    progress_callback: Optional[Callable[[Dict[str, int]], None]] = None
+) -> Dict[str, int]:
+    """Runs iter_retag_batches() to completion and returns its final counters."""
+    stats = {"files": 0, "tags_written": 0, "tags_removed": 0, "batches": 0}
+    for stats in iter_retag_batches(db, file_ids, path_prefix, expression, tags_to_add_modify, tags_to_remove,
+                                    owner_id, batch_size):
+        if progress_callback:
+            progress_callback(stats)
+    return stats
+
+
+def _missing_or_stale(db: Session, file_id: int) -> Exception:
+    """The error for a conditional write that matched no row: the file is gone, or at another version."""
+    version = db.execute(select(File.version).where(File.id == file_id)).scalar()
+    if version is None:
+        return NoResultFound(f"No metadata found for file ID: {file_id}")
+    return StaleDataError(f"File ID {file_id} has been modified since (now at version {version}).")
+
+
+def delete_file_metadata(db: Session, file_id: int, expected_versions: Optional[List[int]] = None):
+    """
+    Deletes file metadata and its associated tags from the database, with
+    one DELETE statement: the tags go by ON DELETE CASCADE, nothing is loaded.
+    With expected_versions, only a file at one of these versions is deleted
+    (see update_file_tags()).
+    """
+    statement = delete(File).where(File.id == file_id)
+    if expected_versions is not None:
+        statement = statement.where(File.version.in_(expected_versions))
     try:
-        db.delete(file_record)
+        if db.execute(statement.returning(File.id)).first() is None:
+            raise _missing_or_stale(db, file_id)
         db.commit()
-    except NoResultFound:
+    except (NoResultFound, StaleDataError):
         db.rollback()
         raise
     except Exception as e:
         db.rollback()
-        raise Exception(f"An unexpected error occurred while deleting metadata for file ID {file_id}: {e}")
\ No newline at end of file
+        raise Exception(f"An unexpected error occurred while deleting metadata for file ID {file_id}: {e}")
+
+
+# --- Bulk Deletion ---
+
+DELETE_BATCH_SIZE = 5000 # Files deleted per transaction
+
+
+def _iter_delete_batches(db: Session, conditions: list, batch_size: int) -> Iterator[Dict[str, int]]:
+    """
+    Deletes the files matching conditions in id order, batch_size files per
+    transaction, yielding the running counters (files, batches) after each
+    commit. One DELETE per batch; tags go by ON DELETE CASCADE.
+    """
+    stats = {"files": 0, "batches": 0}
+    last_id = 0
+    try:
+        while True:
+            batch = select(File.id).where(*conditions, File.id > last_id).order_by(File.id).limit(batch_size)
+            deleted = delete(File).where(File.id.in_(batch)).returning(File.id).cte("deleted")
+            files, batch_last_id = db.execute(select(func.count(), func.max(deleted.c.id))).one()
+            if not files:
+                db.rollback()
+                break
+            db.commit()
+            last_id = batch_last_id
+
+            stats["files"] += files
+            stats["batches"] += 1
+            yield dict(stats)
+    except Exception as e:
+        db.rollback()
+        raise Exception(f"An unexpected error occurred while deleting files: {e}")
+
+
+def iter_delete_batches(
+    db: Session,
+    file_ids: Optional[List[int]] = None,
+    path_prefix: Optional[str] = None,
+    expression: Optional[str] = None,
+    owner_id: Optional[int] = None,
+    batch_size: int = DELETE_BATCH_SIZE
+) -> Iterator[Dict[str, int]]:
+    """
+    Deletes the metadata of every file matched by the selectors (see
+    file_selector_conditions()) and their tags in bounded batches, so no
+    transaction or process holds them all; yields the running counters
+    (files, batches) after each committed batch. An interrupted run can simply
+    be repeated. Raises ValueError for a missing selector or an invalid expression.
+    """
+    conditions = file_selector_conditions(file_ids, path_prefix, expression, owner_id)
+    return _iter_delete_batches(db, conditions, batch_size)
+
+
+def delete_files(
+    db: Session,
+    file_ids: Optional[List[int]] = None,
+    path_prefix: Optional[str] = None,
+    expression: Optional[str] = None,
+    owner_id: Optional[int] = None,
+    batch_size: int = DELETE_BATCH_SIZE,
+    progress_callback: Optional[Callable[[Dict[str, int]], None]] = None
+) -> Dict[str, int]:
+    """Runs iter_delete_batches() to completion and returns its final counters."""
+    stats = {"files": 0, "batches": 0}
+    for stats in iter_delete_batches(db, file_ids, path_prefix, expression, owner_id, batch_size):
+        if progress_callback:
+            progress_callback(stats)
+    return stats
+
+
+def delete_user(
+    db: Session,
+    user_id: int,
+    batch_size: int = DELETE_BATCH_SIZE,
+    progress_callback: Optional[Callable[[Dict[str, int]], None]] = None
+) -> Dict[str, int]:
+    """
+    Deletes a user with all the files they own. The files are deleted in
+    batches first (see iter_delete_batches()), then the user row, whose jobs
+    and any files added meanwhile go by ON DELETE CASCADE. Returns the
+    counters of the file deletion. Raises NoResultFound for an unknown user.
+    """
+    if db.execute(select(User.id).where(User.id == user_id)).first() is None:
+        raise NoResultFound(f"No user found with ID: {user_id}")
+    stats = {"files": 0, "batches": 0}
+    for stats in _iter_delete_batches(db, [File.owner == user_id], batch_size):
+        if progress_callback:
+            progress_callback(stats)
+    try:
+        db.execute(delete(User).where(User.id == user_id))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise Exception(f"An unexpected error occurred while deleting user ID {user_id}: {e}")
+    return stats
+
+
+# --- Bulk Ingestion ---
+
+DEFAULT_SCAN_BATCH_SIZE = 1000
+MIN_SCAN_BATCH_SIZE = 100
+MAX_SCAN_BATCH_SIZE = 20000
+TARGET_BATCH_SECONDS = 1.0 # Aim for roughly one commit per second during bulk ingestion
+
+
+class AdaptiveBatchSizer:
+    """
+    Grows or shrinks the bulk insert batch size based on how long the last
+    batch took to write, so each transaction stays near TARGET_BATCH_SECONDS.
+    """
+    def __init__(self, initial: Optional[int] = None,
+                 minimum: int = MIN_SCAN_BATCH_SIZE,
+                 maximum: int = MAX_SCAN_BATCH_SIZE,
+                 target_seconds: float = TARGET_BATCH_SECONDS):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.size = max(minimum, min(maximum, initial or DEFAULT_SCAN_BATCH_SIZE))
+
+    def record(self, rows_written: int, elapsed: float) -> int:
+        """Adjusts the batch size after a batch of rows_written took elapsed seconds."""
+        # Only adapt on full batches; the final partial batch says little about throughput
+        if rows_written >= self.size:
+            if elapsed < self.target_seconds / 2:
+                self.size = min(self.maximum, self.size * 2)
+            elif elapsed > self.target_seconds * 2:
+                self.size = max(self.minimum, self.size // 2)
+        return self.size
+
+
+def build_file_row(
+    filepath: str,
+    inferred_data: Dict[str, Any],
+    owner_id: Optional[int],
+    created_by: Optional[str],
+    now: datetime
+) -> Dict[str, Any]:
+    """Builds the column values for one 'file' row, as used by bulk inserts."""
+    return {
+        "filename": os.path.basename(filepath),
+        "filepath": filepath,
+        "owner": owner_id,
+        "created_by": created_by if created_by else "system",
+        "created_at": now,
+        "updated_at": now,
+        "inferred_tags": inferred_data,
+        **promoted_file_columns(inferred_data),
+    }
+
+
+def _build_tag_row(file_id: int, key: str, value: Any) -> Dict[str, Any]:
+    """Builds the column values for one 'tag' row, parsing the value's type."""
+    typed_value, value_type = parse_tag_value(str(value))
+    return {
+        "file_id": file_id,
+        "key": key,
+        "value": str(typed_value), # Stored as string in DB
+        "value_type": value_type,
+        **typed_tag_columns(typed_value, value_type),
+    }
+
+
+TYPED_TAG_BACKFILL_BATCH_SIZE = 5000
+
+
+def backfill_typed_tag_values(
+    db: Session,
+    batch_size: int = TYPED_TAG_BACKFILL_BATCH_SIZE,
+    progress_callback: Optional[Callable[[Dict[str, int]], None]] = None
+) -> Dict[str, int]:
+    """
+    Fills the typed value columns (value_int, value_float, value_bool,
+    value_ts) of tags written before they existed, from their text values.
+
+    Works through the table in id order, one short transaction per batch, so
+    row locks are held only briefly and an interrupted run simply resumes.
+    Returns counters: examined, converted (rows that got a typed value) and batches.
+    """
+    tag_table = Tag.__table__
+    stats = {"examined": 0, "converted": 0, "batches": 0}
+    update_stmt = (
+        tag_table.update()
+        .where(tag_table.c.id == bindparam("tag_id"))
+        .values(value_int=bindparam("value_int"), value_float=bindparam("value_float"),
+                value_bool=bindparam("value_bool"), value_ts=bindparam("value_ts"))
+    )
+    last_id = 0
+    try:
+        while True:
+            rows = db.execute(
+                select(tag_table.c.id, tag_table.c.value, tag_table.c.value_type)
+                .where(
+                    tag_table.c.id > last_id,
+                    tag_table.c.value_type.in_(("int", "float", "bool", "str")),
+                    tag_table.c.value_int.is_(None), tag_table.c.value_float.is_(None),
+                    tag_table.c.value_bool.is_(None), tag_table.c.value_ts.is_(None),
+                )
+                .order_by(tag_table.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            updates = []
+            for row in rows:
+                typed_value, value_type = parse_tag_value(row.value)
+                # Stored type wins: a 'str' tag whose text looks numeric stays a string
+                columns = typed_tag_columns(typed_value, value_type) if value_type == row.value_type else None
+                if columns and any(column_value is not None for column_value in columns.values()):
+                    updates.append({"tag_id": row.id, **columns})
+            if updates:
+                db.execute(update_stmt, updates)
+            db.commit()
+
+            stats["examined"] += len(rows)
+            stats["converted"] += len(updates)
+            stats["batches"] += 1
+            if progress_callback:
+                progress_callback(dict(stats))
+        return stats
+    except Exception as e:
+        db.rollback()
+        raise Exception(f"An unexpected error occurred while backfilling typed tag values: {e}")
+
+
+def insert_file_batch(
+    db: Session,
+    file_rows: List[Dict[str, Any]],
+    custom_tags: Optional[Dict[str, Any]] = None
+) -> int:
+    """
+    Inserts a batch of file rows (and the same custom tags for each of them)
+    in a single transaction using multi-row INSERTs.
+
+    Paths that are already cataloged are skipped via ON CONFLICT DO NOTHING,
+    so no per-file existence SELECT is needed. Returns the number of files inserted.
+    """
+    if not file_rows:
+        return 0
+
+    try:
+        # SQLAlchemy 2.0 turns an executemany with RETURNING into batched multi-row VALUES
+        stmt = pg_insert(File).on_conflict_do_nothing(index_elements=[File.filepath]).returning(File.id)
+        inserted_ids = db.execute(stmt, file_rows).scalars().all()
+
+        if custom_tags and inserted_ids:
+            tag_rows = [
+                _build_tag_row(file_id, key, value)
+                for file_id in inserted_ids
+                for key, value in custom_tags.items()
+            ]
+            db.execute(pg_insert(Tag), tag_rows)
+
+        db.commit()
+        return len(inserted_ids)
+    except Exception as e:
+        db.rollback()
+        raise Exception(f"An unexpected error occurred while inserting a batch of {len(file_rows)} files: {e}")
+
+
+BULK_INFER_WORKERS = 16 # Threads inferring metadata for one bulk-create batch
+
+
+def add_file_metadata_batch(
+    db: Session,
+    items: List[Dict[str, Any]],
+    owner_id: Optional[int] = None,
+    created_by: Optional[str] = None,
+    on_conflict: str = "error",
+    owned_only: bool = False
+) -> List[Dict[str, Any]]:
+    """
+    Adds metadata for a batch of files, each with its own custom tags, in one transaction.
+
+    items is a list of {"filepath": ..., "custom_tags": {...}} dicts. Metadata
+    is inferred in a small thread pool, then all files and their tags are
+    written with multi-row INSERT ... ON CONFLICT statements; on_conflict and
+    owned_only treat already cataloged paths as in upsert_file_metadata().
+    Returns one result per item, in order: {"filepath", "id", "created"} on
+    success, or {"filepath", "error"} where error is the exception
+    add_file_metadata() would have raised for that file (FileNotFoundError,
+    or ValueError for an already cataloged path).
+    If the batch cannot be written at all, every item not already failed gets that error.
+    """
+    if on_conflict not in ON_CONFLICT_MODES:
+        raise ValueError(f"Invalid on_conflict mode '{on_conflict}'. Choose one of: {', '.join(ON_CONFLICT_MODES)}.")
+    results: List[Dict[str, Any]] = [{"filepath": item["filepath"]} for item in items]
+    pending: Dict[str, int] = {} # filepath -> index of the item that will insert it
+
+    for index, item in enumerate(items):
+        filepath = item["filepath"]
+        if filepath in pending:
+            results[index]["error"] = ValueError(f"Metadata for file '{filepath}' appears more than once in this batch.")
+        else:
+            pending[filepath] = index
+
+    def _infer(filepath: str):
+        try:
+            return infer_metadata(filepath)
+        except FileNotFoundError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=BULK_INFER_WORKERS) as pool:
+        inferred = dict(zip(pending, pool.map(_infer, pending)))
+
+    now = datetime.now()
+    file_rows = []
+    for filepath, inferred_data in inferred.items():
+        if inferred_data is None:
+            results[pending.pop(filepath)]["error"] = FileNotFoundError(f"File not found at: {filepath}")
+        else:
+            file_rows.append(build_file_row(filepath, inferred_data, owner_id, created_by, now))
+
+    if not file_rows:
+        return results
+
+    try:
+        stmt = pg_insert(File)
+        if on_conflict == "update":
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[File.filepath],
+                set_={**{name: stmt.excluded[name] for name in file_rows[0]
+                         if name not in ("filepath", "owner", "created_by", "created_at")},
+                      "version": File.version + 1},
+                where=(File.owner == owner_id) if owned_only else None
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=[File.filepath])
+        # xmax is 0 only on a freshly inserted row version
+        stmt = stmt.returning(File.id, File.filepath, literal_column("xmax = 0"))
+        written = {filepath: (file_id, created) for file_id, filepath, created in db.execute(stmt, file_rows)}
+
+        tag_rows = [
+            _build_tag_row(file_id, key, value)
+            for filepath, (file_id, _) in written.items()
+            for key, value in (items[pending[filepath]].get("custom_tags") or {}).items()
+        ]
+        if tag_rows:
+            tag_stmt = pg_insert(Tag)
+            db.execute(tag_stmt.on_conflict_do_update(
+                constraint="_file_key_uc",
+                set_={name: tag_stmt.excluded[name] for name in tag_rows[0] if name not in ("file_id", "key")}
+            ), tag_rows)
+
+        # Paths left alone by ON CONFLICT were already cataloged; one lookup reports their IDs
+        conflicts = [filepath for filepath in pending if filepath not in written]
+        existing = {}
+        if conflicts:
+            existing = {filepath: (file_id, owner) for filepath, file_id, owner
+                        in db.execute(select(File.filepath, File.id, File.owner).where(File.filepath.in_(conflicts)))}
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        error = Exception(f"An unexpected error occurred while adding a batch of {len(file_rows)} files: {e}")
+        for index in pending.values():
+            results[index]["error"] = error
+        return results
+
+    for filepath, index in pending.items():
+        if filepath in written:
+            results[index]["id"], results[index]["created"] = written[filepath]
+        elif owned_only and filepath in existing and existing[filepath][1] != owner_id:
+            # Neither updated nor reported: the ID of another user's file is not disclosed
+            results[index]["error"] = ValueError(f"Metadata for file '{filepath}' already exists and belongs to another user.")
+        elif on_conflict == "skip" and filepath in existing:
+            results[index]["id"], results[index]["created"] = existing[filepath][0], False
+        else:
+            existing_id_msg = f"(ID: {existing[filepath][0]})" if filepath in existing else ""
+            results[index]["error"] = ValueError(f"Metadata for file '{filepath}' already exists {existing_id_msg}. Use 'update' to modify.")
+    return results
+
+
+KNOWN_PATHS_FETCH_SIZE = 50000 # Paths streamed per fetch while building a KnownPathFilter
+
+
+def build_known_path_filter(db: Session, root: Optional[str] = None, recursive: bool = True) -> KnownPathFilter:
+    """
+    Builds a KnownPathFilter of the cataloged paths (below root, if given) in
+    one streaming pass. Small catalogs get an exact sorted hash set, larger
+    ones a Bloom filter sized from a count of the matching rows. With
+    recursive=False only the files directly inside root are loaded, for
+    scans of root's own files (e.g. the upper shards of a job).
+    """
+    query = select(File.filepath)
+    if root:
+        root_prefix = escape_like(root.rstrip(os.sep) + os.sep)
+        query = query.where(File.filepath.like(root_prefix + '%'))
+        if not recursive:
+            query = query.where(File.filepath.notlike(root_prefix + '%' + escape_like(os.sep) + '%'))
+    expected_size = db.execute(select(func.count()).select_from(query.subquery())).scalar()
+    known_paths = KnownPathFilter(expected_size)
+    known_paths.load(db.execute(query.execution_options(yield_per=KNOWN_PATHS_FETCH_SIZE)).scalars())
+    db.commit() # End the read transaction before the writes start
+    return known_paths
+
+
+def scan_directory(
+    db: Session,
+    root: str,
+    custom_tags: Optional[Dict[str, Any]] = None,
+    owner_id: Optional[int] = None,
+    created_by: Optional[str] = None,
+    batch_size: Optional[int] = None,
+    progress_callback: Optional[Callable[[Dict[str, int]], None]] = None,
+    hasher: Optional[ContentHasher] = None,
+    extract_content: bool = True,
+    recursive: bool = True,
+    prefilter: bool = True
+) -> Dict[str, int]:
+    """
+    Recursively registers every regular file under root.
+
+    Files are discovered with os.scandir, their DirEntry stat results are
+    reused for metadata inference, and rows are written in batches with one
+    transaction per batch. The batch size adapts to the observed write time.
+    Files already in the catalog are left untouched. If a ContentHasher is
+    given, each batch is content-hashed in parallel before it is written.
+    With extract_content=False the content extractors are skipped, and with
+    recursive=False only the files directly inside root are registered.
+
+    With prefilter=True the paths already cataloged under root are loaded into
+    a KnownPathFilter first, so known files are skipped before any metadata is
+    inferred. Only the filter's possible hits are checked in the database, in
+    batched IN (...) lookups.
+
+    Returns a dict of counters: scanned, inserted, skipped, errors, batches
+    (plus the hasher's totals and bytes per second when hashing).
+    """
+    if not os.path.isdir(root):
+        raise FileNotFoundError(f"Directory not found at: {root}")
+
+    root = os.path.abspath(root)
+    stats = {"scanned": 0, "inserted": 0, "skipped": 0, "errors": 0, "batches": 0}
+    sizer = AdaptiveBatchSizer(batch_size)
+    known_paths = build_known_path_filter(db, root, recursive) if prefilter else None
+
+    def _on_walk_error(path: str, error: OSError):
+        stats["errors"] += 1
+
+    def _flush(rows: List[Dict[str, Any]]):
+        if hasher:
+            fingerprints = hasher.hash_paths([row["filepath"] for row in rows])
+            for row in rows:
+                row["inferred_tags"].update(fingerprints[row["filepath"]])
+            stats.update(hasher.stats())
+        started = time.monotonic()
+        inserted = insert_file_batch(db, rows, custom_tags)
+        sizer.record(len(rows), time.monotonic() - started)
+        stats["inserted"] += inserted
+        stats["skipped"] += len(rows) - inserted
+        stats["batches"] += 1
+        if known_paths:
+            known_paths.add_many(row["filepath"] for row in rows)
+            stats.update({f"prefilter_{counter}": value for counter, value in known_paths.stats.items()})
+        if progress_callback:
+            progress_callback(dict(stats))
+
+    pending: List[Dict[str, Any]] = []
+    possible_hits: List[tuple] = [] # (filepath, stat_result) pairs the prefilter could not rule out
+
+    def _add(filepath: str, stat_info: os.stat_result):
+        inferred_data = infer_metadata(filepath, stat_info=stat_info, extract_content=extract_content)
+        pending.append(build_file_row(filepath, inferred_data, owner_id, created_by, datetime.now()))
+
+    def _resolve_possible_hits():
+        found = known_paths.existing(db, [filepath for filepath, _ in possible_hits])
+        stats["skipped"] += len(found)
+        for filepath, stat_info in possible_hits:
+            if filepath not in found:
+                _add(filepath, stat_info)
+        possible_hits.clear()
+        stats.update({f"prefilter_{counter}": value for counter, value in known_paths.stats.items()})
+        if progress_callback:
+            progress_callback(dict(stats)) # Report skipped files even when nothing is written
+
+    for filepath, stat_info in iter_directory_files(root, on_error=_on_walk_error, recursive=recursive):
+        stats["scanned"] += 1
+        if known_paths and known_paths.might_contain(filepath):
+            possible_hits.append((filepath, stat_info))
+            if len(possible_hits) >= LOOKUP_CHUNK_SIZE:
+                _resolve_possible_hits()
+        else:
+            _add(filepath, stat_info)
+        if len(pending) >= sizer.size:
+            _flush(pending)
+            pending = []
+
+    if possible_hits:
+        _resolve_possible_hits()
+    if pending:
+        _flush(pending)
+
+    return stats
+
+
+# --- Incremental Rescan ---
+
+def _apply_file_updates(db: Session, update_rows: List[Dict[str, Any]]):
+    """
+    Executes one batched UPDATE of inferred_tags/updated_at for the given rows
+    (no commit), refreshing the promoted columns from the new inferred_tags.
+    """
+    if not update_rows:
+        return
+    file_table = File.__table__
+    stmt = (
+        file_table.update()
+        .where(file_table.c.id == bindparam('b_id'))
+        .values(inferred_tags=bindparam('b_inferred_tags'), updated_at=bindparam('b_updated_at'),
+                size_bytes=bindparam('b_size_bytes'), mtime=bindparam('b_mtime'),
+                mime_type=bindparam('b_mime_type'), inode=bindparam('b_inode'),
+                version=file_table.c.version + 1)
+    )
+    rows = [
+        {**row, **{f"b_{column}": value for column, value in promoted_file_columns(row['b_inferred_tags']).items()}}
+        for row in update_rows
+    ]
+    db.execute(stmt, rows)
+
+
+FILE_COLUMN_BACKFILL_BATCH_SIZE = 5000
+
+
+def backfill_file_columns(
+    db: Session,
+    batch_size: int = FILE_COLUMN_BACKFILL_BATCH_SIZE,
+    progress_callback: Optional[Callable[[Dict[str, int]], None]] = None
+) -> Dict[str, int]:
+    """
+    Fills the promoted columns (size_bytes, mtime, mime_type, inode) of files
+    cataloged before they existed, from their inferred_tags.
+
+    Works through the table in id order, one short transaction per batch, so
+    row locks are held only briefly and an interrupted run simply resumes.
+    Returns counters: examined, filled (rows that got at least one value) and batches.
+    """
+    file_table = File.__table__
+    stats = {"examined": 0, "filled": 0, "batches": 0}
+    update_stmt = (
+        file_table.update()
+        .where(file_table.c.id == bindparam("b_id"))
+        .values(size_bytes=bindparam("b_size_bytes"), mtime=bindparam("b_mtime"),
+                mime_type=bindparam("b_mime_type"), inode=bindparam("b_inode"))
+    )
+    last_id = 0
+    try:
+        while True:
+            rows = db.execute(
+                select(file_table.c.id, file_table.c.inferred_tags)
+                .where(
+                    file_table.c.id > last_id,
+                    file_table.c.size_bytes.is_(None), file_table.c.mtime.is_(None),
+                    file_table.c.mime_type.is_(None), file_table.c.inode.is_(None),
+                )
+                .order_by(file_table.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            updates = []
+            for row in rows:
+                columns = promoted_file_columns(row.inferred_tags or {})
+                if any(value is not None for value in columns.values()):
+                    updates.append({"b_id": row.id, **{f"b_{column}": value for column, value in columns.items()}})
+            if updates:
+                db.execute(update_stmt, updates)
+            db.commit()
+
+            stats["examined"] += len(rows)
+            stats["filled"] += len(updates)
+            stats["batches"] += 1
+            if progress_callback:
+                progress_callback(dict(stats))
+        return stats
+    except Exception as e:
+        db.rollback()
+        raise Exception(f"An unexpected error occurred while backfilling file columns: {e}")
+
+
+def _flag_missing_files(
+    db: Session,
+    root: str,
+    seen_paths: set,
+    unreadable_dirs: List[str],
+    batch_size: int,
+    recursive: bool = True
+) -> int:
+    """
+    Marks cataloged files under root that were not seen during a rescan with
+    'missing'/'missing_since' in inferred_tags. Files below directories that
+    could not be read are left alone. Returns the number of files flagged.
+
+    With recursive=False (a rescan of root's own files only), files in
+    subdirectories are left alone unless that subdirectory no longer exists.
+    """
+    now_iso = datetime.now().isoformat()
+    unreadable_prefixes = tuple(d.rstrip(os.sep) + os.sep for d in unreadable_dirs)
+    root_prefix = root.rstrip(os.sep) + os.sep
+    subdir_exists: Dict[str, bool] = {}
+    query = (
+        select(File.id, File.filepath)
+        .where(File.filepath.like(escape_like(root.rstrip(os.sep) + os.sep) + '%'))
+        .where(File.inferred_tags['missing'].astext.is_(None)) # Not flagged yet
+        .execution_options(yield_per=batch_size)
+    )
+
+    vanished_ids = []
+    for file_id, filepath in db.execute(query):
+        if filepath in seen_paths or filepath.startswith(unreadable_prefixes):
+            continue
+        if not recursive:
+            subdir, sep, _ = filepath[len(root_prefix):].partition(os.sep)
+            if sep:
+                if subdir not in subdir_exists:
+                    subdir_exists[subdir] = os.path.isdir(root_prefix + subdir)
+                if subdir_exists[subdir]:
+                    continue # Covered by a rescan of that subdirectory
+        vanished_ids.append(file_id)
+
+    # Flag in batches, one transaction each, after the streaming read is done
+    for start in range(0, len(vanished_ids), batch_size):
+        chunk = vanished_ids[start:start + batch_size]
+        db.execute(
+            File.__table__.update()
+            .where(File.__table__.c.id.in_(chunk))
+            .values(inferred_tags=File.__table__.c.inferred_tags.op('||')(
+                func.jsonb_build_object('missing', True, 'missing_since', now_iso)
+            ), version=File.__table__.c.version + 1)
+        )
+        db.commit()
+    return len(vanished_ids)
+
+
+def sync_file_batch(
+    db: Session,
+    batch: List[tuple],
+    custom_tags: Optional[Dict[str, Any]] = None,
+    owner_id: Optional[int] = None,
+    created_by: Optional[str] = None,
+    hasher: Optional[ContentHasher] = None,
+    known_paths: Optional[KnownPathFilter] = None
+) -> Dict[str, int]:
+    """
+    Brings the catalog up to date for a batch of (filepath, stat_result) pairs
+    in one transaction.
+
+    The stored size, mtime, ctime and inode are read from inferred_tags in a
+    single IN (...) query and compared with the given stat data. Only rows whose
+    fingerprint changed are UPDATEd (in one batched statement), new paths are
+    inserted, and unchanged files cause no writes at all. Custom tags are only
+    applied to newly inserted files.
+
+    A stored content hash is kept as long as size and mtime are unchanged. With
+    a ContentHasher, new and modified files (and files that were never hashed)
+    are hashed in parallel; everything else is not read at all.
+
+    With a KnownPathFilter, only its possible hits are looked up; paths it
+    rules out are inserted directly, and are added to it once written.
+
+    Returns a dict of counters: inserted, updated, unchanged.
+    """
+    if not batch:
+        return {"inserted": 0, "updated": 0, "unchanged": 0}
+
+    now = datetime.now()
+    stored_query = select(
+        File.id,
+        File.filepath,
+        File.inferred_tags['file_size'].astext,
+        File.inferred_tags['last_modified_at'].astext,
+        File.inferred_tags['created_at_fs'].astext,
+        File.inferred_tags['inode'].astext,
+        File.inferred_tags['missing'].astext,
+        File.inferred_tags['content_hash'].astext,
+        File.inferred_tags['hash_algorithm'].astext,
+    )
+    if known_paths is not None:
+        lookup_paths, _ = known_paths.split(filepath for filepath, _ in batch)
+    else:
+        lookup_paths = [filepath for filepath, _ in batch]
+    stored = {}
+    for start in range(0, len(lookup_paths), LOOKUP_CHUNK_SIZE):
+        chunk = lookup_paths[start:start + LOOKUP_CHUNK_SIZE]
+        stored.update((row[1], row) for row in db.execute(stored_query.where(File.filepath.in_(chunk))))
+    if known_paths is not None:
+        known_paths.stats["db_lookups"] += (len(lookup_paths) + LOOKUP_CHUNK_SIZE - 1) // LOOKUP_CHUNK_SIZE
+        known_paths.stats["false_positives"] += len(lookup_paths) - len(stored)
+
+    new_rows, update_rows = [], []
+    to_hash: Dict[str, Dict[str, Any]] = {} # filepath -> inferred_tags dict awaiting a hash
+    unchanged = 0
+    for filepath, stat_info in batch:
+        existing = stored.get(filepath)
+        current = stat_fingerprint(stat_info)
+        if existing is None:
+            inferred_data = infer_metadata(filepath, stat_info=stat_info)
+            new_rows.append(build_file_row(filepath, inferred_data, owner_id, created_by, now))
+            to_hash[filepath] = inferred_data
+            continue
+
+        stored_hash, stored_algorithm = existing[7], existing[8]
+        needs_hash = hasher is not None and (stored_hash is None or stored_algorithm != hasher.algorithm)
+        if tuple(existing[2:6]) == current and existing[6] is None and not needs_hash:
+            unchanged += 1
+            continue
+
+        # Changed, previously flagged as missing and now back, or not yet hashed
+        inferred_data = infer_metadata(filepath, stat_info=stat_info)
+        if stored_hash is not None and tuple(existing[2:4]) == current[:2] and not needs_hash:
+            # Same size and mtime: the stored content hash still applies
+            inferred_data["content_hash"] = stored_hash
+            inferred_data["hash_algorithm"] = stored_algorithm
+        else:
+            to_hash[filepath] = inferred_data
+        update_rows.append({
+            "b_id": existing[0],
+            "b_inferred_tags": inferred_data,
+            "b_updated_at": now,
+        })
+
+    if hasher and to_hash:
+        for filepath, fingerprint in hasher.hash_paths(list(to_hash)).items():
+            to_hash[filepath].update(fingerprint)
+
+    try:
+        _apply_file_updates(db, update_rows)
+    except Exception as e:
+        db.rollback()
+        raise Exception(f"An unexpected error occurred while updating a batch of {len(update_rows)} files: {e}")
+    # insert_file_batch commits the updates together with the inserts
+    inserted = insert_file_batch(db, new_rows, custom_tags) if new_rows else 0
+    if not new_rows:
+        db.commit()
+    if known_paths is not None:
+        known_paths.add_many(row["filepath"] for row in new_rows)
+
+    return {"inserted": inserted, "updated": len(update_rows), "unchanged": unchanged}
+
+
+def rescan_directory(
+    db: Session,
+    root: str,
+    custom_tags: Optional[Dict[str, Any]] = None,
+    owner_id: Optional[int] = None,
+    created_by: Optional[str] = None,
+    flag_missing: bool = False,
+    batch_size: Optional[int] = None,
+    progress_callback: Optional[Callable[[Dict[str, int]], None]] = None,
+    hasher: Optional[ContentHasher] = None,
+    recursive: bool = True,
+    prefilter: bool = True
+) -> Dict[str, int]:
+    """
+    Incrementally re-synchronizes the catalog with the files under root.
+
+    Walked paths are handed to sync_file_batch() in adaptive batches, so only
+    new or changed files cause writes. With flag_missing=True, cataloged files
+    under root that no longer exist are marked as missing in their inferred_tags.
+    With recursive=False only the files directly inside root are synchronized.
+    With prefilter=True a KnownPathFilter of the paths under root is built
+    first, so new files skip the lookup of their stored fingerprint.
+
+    Returns a dict of counters: scanned, inserted, updated, unchanged, missing, errors, batches
+    (plus the hasher's totals and bytes per second when hashing).
+    """
+    if not os.path.isdir(root):
+        raise FileNotFoundError(f"Directory not found at: {root}")
+
+    root = os.path.abspath(root)
+    stats = {"scanned": 0, "inserted": 0, "updated": 0, "unchanged": 0, "missing": 0, "errors": 0, "batches": 0}
+    sizer = AdaptiveBatchSizer(batch_size)
+    seen_paths = set() if flag_missing else None
+    unreadable_dirs: List[str] = []
+    known_paths = build_known_path_filter(db, root, recursive) if prefilter else None
+
+    def _on_walk_error(path: str, error: OSError):
+        stats["errors"] += 1
+        if os.path.isdir(path):
+            unreadable_dirs.append(path)
+
+    def _flush(batch: List[tuple]):
+        started = time.monotonic()
+        counts = sync_file_batch(db, batch, custom_tags, owner_id=owner_id, created_by=created_by,
+                                 hasher=hasher, known_paths=known_paths)
+        sizer.record(len(batch), time.monotonic() - started)
+        for counter, value in counts.items():
+            stats[counter] += value
+        if known_paths:
+            stats.update({f"prefilter_{counter}": value for counter, value in known_paths.stats.items()})
+        if hasher:
+            stats.update(hasher.stats())
+        stats["batches"] += 1
+        if progress_callback:
+            progress_callback(dict(stats))
+
+    pending: List[tuple] = []
+    for filepath, stat_info in iter_directory_files(root, on_error=_on_walk_error, recursive=recursive):
+        stats["scanned"] += 1
+        if seen_paths is not None:
+            seen_paths.add(filepath)
+        pending.append((filepath, stat_info))
+        if len(pending) >= sizer.size:
+            _flush(pending)
+            pending = []
+
+    if pending:
+        _flush(pending)
+
+    if flag_missing:
+        try:
+            stats["missing"] = _flag_missing_files(db, root, seen_paths, unreadable_dirs, sizer.size, recursive)
+        except Exception as e:
+            db.rollback()
+            raise Exception(f"An unexpected error occurred while flagging missing files under '{root}': {e}")
+        if progress_callback:
+            progress_callback(dict(stats))
+
+    return stats
+
+
+def move_path_prefix(db: Session, old_prefix: str, new_prefix: str) -> int:
+    """
+    Rewrites the stored filepath of every file below the directory old_prefix
+    so it sits below new_prefix instead, e.g. after a directory was renamed,
+    and bumps their versions. Filenames and tags are unchanged. Returns the number of files moved.
+    """
+    old_dir = old_prefix.rstrip(os.sep) + os.sep
+    new_dir = new_prefix.rstrip(os.sep) + os.sep
+    file_table = File.__table__
+    try:
+        result = db.execute(
+            file_table.update()
+            .where(file_table.c.filepath.like(escape_like(old_dir) + '%'))
+            .values(
+                filepath=func.concat(new_dir, func.substr(file_table.c.filepath, len(old_dir) + 1)),
+                updated_at=datetime.now(),
+                version=file_table.c.version + 1
+            )
+        )
+        db.commit()
+        return result.rowcount
+    except Exception as e:
+        db.rollback()
+        raise Exception(f"An unexpected error occurred while moving '{old_prefix}' to '{new_prefix}': {e}")
@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, UniqueConstraint
-from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, Float, String, Text, DateTime, Boolean, ForeignKey, UniqueConstraint, Index
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from datetime import datetime
 import json # For handling JSONB default values (though SQLAlchemy's JSONB type handles this well)
 from .database import Base # Correct: Assumes database.py defines Base and is in the same package
@@ -18,7 +18,8 @@ class User(Base):
     updated_at = Column(DateTime(timezone=True), default=datetime.now, onupdate=datetime.now)
 
     # Define relationship from User to File (one-to-many: one user can own many files)
-    files = relationship("File", back_populates="owner_rel", cascade="all, delete-orphan") # cascade ensures files are deleted if user is deleted, or adjust as needed
+    # Files (and their tags) are deleted by the database's ON DELETE CASCADE, without loading them
+    files = relationship("File", back_populates="owner_rel", cascade="all, delete-orphan", passive_deletes=True)
 
     def __repr__(self):
         return f"<User(id={self.id}, username='{self.username}', role='{self.role}')>"
@@ -33,7 +34,7 @@ class File(Base):
 
     # OWNER FIELD: CRITICAL CHANGE
     # Changed from String(255) to Integer and added ForeignKey to User.id
-    owner = Column(Integer, ForeignKey('user.id'), nullable=True) # Nullable=True if a file can exist without an owner, or False if owner is always required
+    owner = Column(Integer, ForeignKey('user.id', ondelete='CASCADE'), nullable=True) # Nullable=True if a file can exist without an owner, or False if owner is always required
     owner_rel = relationship("User", back_populates="files") # Relationship to the User model
 
     created_by = Column(String(255), nullable=False) # Stores the username string of who created it (e.g., 'system' or 'admin_user')
@@ -42,8 +43,34 @@ class File(Base):
     
     inferred_tags = Column(JSONB, default=lambda: {}, nullable=False) # Correct: JSONB type handles dicts directly
 
+    # Frequently filtered inferred values, promoted to indexed columns (see utils.promoted_file_columns).
+    # They are mirrored in inferred_tags, which remains the complete record.
+    size_bytes = Column(BigInteger, nullable=True, index=True)
+    mtime = Column(DateTime(timezone=True), nullable=True, index=True)
+    mime_type = Column(String(255), nullable=True, index=True)
+    inode = Column(BigInteger, nullable=True, index=True)
+
+    # Row version, bumped by every change to the file or its custom tags (the API's ETag); the ORM
+    # checks it on flush, and set-based writes in metadata_manager increment it themselves
+    version = Column(Integer, default=1, server_default="1", nullable=False)
+
+    # Full-text search document, maintained by a database trigger (see schema.py); never loaded by default
+    search_vector = deferred(Column(TSVECTOR, nullable=True))
+
     # Define relationship from File to Tag (one-to-many: one file can have many tags)
-    tags = relationship("Tag", back_populates="file", cascade="all, delete-orphan")
+    tags = relationship("Tag", back_populates="file", cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (
+        # GIN index for full-text search over search_vector
+        Index('ix_file_search_vector', 'search_vector', postgresql_using='gin'),
+        # Keyset pagination orders (see pagination.py)
+        Index('ix_file_updated_at_id', 'updated_at', 'id'),
+        Index('ix_file_owner_id', 'owner', 'id'),
+        # Path prefix matches (LIKE 'prefix%') under any collation; size_bytes for index-only directory totals
+        Index('ix_file_filepath_pattern', 'filepath', postgresql_ops={'filepath': 'text_pattern_ops'},
+              postgresql_include=['size_bytes']),
+    )
+    __mapper_args__ = {"version_id_col": version}
 
     def __repr__(self):
         return f"<File(id={self.id}, filename='{self.filename}', filepath='{self.filepath}', owner_id={self.owner})>"
@@ -77,11 +104,24 @@ class Tag(Base):
     value = Column(Text, nullable=False) # Storing value as string
     value_type = Column(String(50), nullable=False) # Store original Python type, e.g., 'str', 'int', 'bool', 'float'
 
+    # Native typed copies of value (see utils.typed_tag_columns), so range filters
+    # and ordering use indexes instead of casting or comparing strings
+    value_int = Column(BigInteger, nullable=True)
+    value_float = Column(Float, nullable=True) # Set for 'int' tags too
+    value_bool = Column(Boolean, nullable=True)
+    value_ts = Column(DateTime(timezone=True), nullable=True) # ISO dates/timestamps among 'str' tags
+
     # Define relationship from Tag to File (many-to-one: many tags belong to one file)
     file = relationship("File", back_populates="tags")
 
     # Add a unique constraint to prevent duplicate tags (key) for the same file
-    __table_args__ = (UniqueConstraint('file_id', 'key', name='_file_key_uc'),)
+    __table_args__ = (
+        UniqueConstraint('file_id', 'key', name='_file_key_uc'),
+        Index('ix_tag_key_value_int', 'key', 'value_int'),
+        Index('ix_tag_key_value_float', 'key', 'value_float'),
+        Index('ix_tag_key_value_bool', 'key', 'value_bool'),
+        Index('ix_tag_key_value_ts', 'key', 'value_ts'),
+    )
 
     def __repr__(self):
         return f"<Tag(id={self.id}, file_id={self.file_id}, key='{self.key}', value='{self.value}', type='{self.value_type}')>"
@@ -89,6 +129,14 @@ class Tag(Base):
     # This get_typed_value method is helpful for internal logic but not strictly needed for Pydantic response
     def get_typed_value(self):
         """Converts the stored string value back to its original Python type."""
+        # Prefer the native typed columns; rows not yet backfilled are parsed from the text
+        if self.value_type == 'int' and self.value_int is not None:
+            return self.value_int
+        elif self.value_type == 'float' and self.value_float is not None:
+            return self.value_float
+        elif self.value_type == 'bool' and self.value_bool is not None:
+            return self.value_bool
+
         if self.value_type == 'int':
             try:
                 return int(self.value)
@@ -111,4 +159,42 @@ class Tag(Base):
             "key": self.key,
             "value": self.value, # Stored as string, Pydantic TagResponse expects str
             "value_type": self.value_type
-        }
\ No newline at end of file
+        }
+
+
+# --- Job Model ---
+# Long-running work (scans, rescans) queued for background workers.
+# A sharded job has one child job per subtree; workers claim jobs with
+# SELECT ... FOR UPDATE SKIP LOCKED, so any number of them can share the queue.
+class Job(Base):
+    __tablename__ = 'job'
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(50), nullable=False) # e.g., 'scan', 'rescan'
+    # 'queued', 'running', 'waiting' (for its shards), 'succeeded', 'failed', 'cancelled'
+    status = Column(String(20), default="queued", nullable=False)
+    params = Column(JSONB, default=lambda: {}, nullable=False)
+    parent_id = Column(Integer, ForeignKey('job.id', ondelete='CASCADE'), nullable=True, index=True)
+
+    owner = Column(Integer, ForeignKey('user.id', ondelete='CASCADE'), nullable=True)
+    created_by = Column(String(255), nullable=False)
+
+    items_done = Column(Integer, default=0, nullable=False)
+    result = Column(JSONB, nullable=True) # Final counters, summed over the shards for a sharded job
+    error = Column(Text, nullable=True)
+    cancel_requested = Column(Boolean, default=False, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    worker = Column(String(255), nullable=True) # host:pid of the worker that claimed it
+
+    created_at = Column(DateTime(timezone=True), default=datetime.now, nullable=False)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    children = relationship("Job", passive_deletes=True)
+
+    # Workers poll for the oldest queued job
+    __table_args__ = (Index('ix_job_status_id', 'status', 'id'),)
+
+    def __repr__(self):
+        return f"<Job(id={self.id}, kind='{self.kind}', status='{self.status}', parent_id={self.parent_id})>"
@@ -0,0 +1,104 @@
+# filemeta/pagination.py
+#
+# Keyset (cursor) pagination: a page is fetched with
+# WHERE (sort keys) > (sort keys of the last row seen) ... LIMIT n, so every
+# page costs the same index range scan no matter how deep the client is.
+# The cursor handed out is an opaque URL-safe token holding those sort keys.
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, or_, tuple_
+from sqlalchemy.orm import Query, Session
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# (expression, descending) pairs; the last one must be unique (normally File.id)
+SortKeys = Sequence[Tuple[Any, bool]]
+
+
+class Page(NamedTuple):
+    items: List[Any]
+    next_cursor: Optional[str] # None on the last page
+    estimated_total: Optional[int] = None # From planner statistics, when requested
+
+
+def encode_cursor(kind: str, values: Sequence[Any]) -> str:
+    """Packs the sort key values of a row into an opaque cursor; kind ties it to one ordering."""
+    encoded = [{"ts": value.isoformat()} if isinstance(value, datetime) else value for value in values]
+    payload = json.dumps({"k": kind, "v": encoded}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, kind: str, key_count: int) -> List[Any]:
+    """Unpacks a cursor made by encode_cursor(). Raises ValueError if it is malformed or for another ordering."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        values = payload["v"]
+        valid = payload["k"] == kind and isinstance(values, list) and len(values) == key_count
+    except (ValueError, TypeError, KeyError):
+        valid = False
+    if not valid:
+        raise ValueError("Invalid cursor. Cursors only apply to the listing or search that returned them.")
+    return [datetime.fromisoformat(value["ts"]) if isinstance(value, dict) else value for value in values]
+
+
+def keyset_condition(sort_keys: SortKeys, values: Sequence[Any]):
+    """Rows strictly after the given sort key values, in the order sort_keys defines."""
+    directions = {descending for _, descending in sort_keys}
+    if len(directions) == 1:
+        # Uniform direction: a row comparison, which a matching composite index serves directly
+        expressions = tuple_(*[expression for expression, _ in sort_keys])
+        return expressions < tuple_(*values) if directions.pop() else expressions > tuple_(*values)
+    alternatives = []
+    for position, (expression, descending) in enumerate(sort_keys):
+        equal_prefix = [sort_keys[i][0] == values[i] for i in range(position)]
+        alternatives.append(and_(*equal_prefix, expression < values[position] if descending
+                                 else expression > values[position]))
+    return or_(*alternatives)
+
+
+def estimate_row_count(db: Session, query: Query) -> Optional[int]:
+    """
+    Returns the planner's row estimate for a query (EXPLAIN, no execution),
+    which is cheap where COUNT(*) would scan every match. None if unavailable.
+    """
+    compiled = query.statement.compile(dialect=db.get_bind().dialect, compile_kwargs={"render_postcompile": True})
+    try:
+        with db.begin_nested(): # A failing EXPLAIN must not abort the caller's transaction
+            plan = db.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+    except Exception:
+        return None
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def paginate(
+    db: Session,
+    query: Query,
+    sort_keys: SortKeys,
+    kind: str,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    with_estimate: bool = False
+) -> Page:
+    """
+    Returns one page of an ORM query over a single entity, ordered by
+    sort_keys and starting after cursor. One row beyond the page is fetched
+    to tell whether a next page exists.
+    """
+    estimated_total = estimate_row_count(db, query) if with_estimate else None
+    if cursor:
+        query = query.filter(keyset_condition(sort_keys, decode_cursor(cursor, kind, len(sort_keys))))
+    labels = [expression.label(f"sort_key_{i}") for i, (expression, _) in enumerate(sort_keys)]
+    order = [expression.desc() if descending else expression.asc() for expression, descending in sort_keys]
+    rows = query.add_columns(*labels).order_by(*order).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(kind, list(rows[-1][1:]))
+    return Page([row[0] for row in rows], next_cursor, estimated_total)
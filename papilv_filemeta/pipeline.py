@@ -0,0 +1,291 @@
+# filemeta/pipeline.py
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable
+
+from sqlalchemy.orm import Session
+
+from .metadata_manager import AdaptiveBatchSizer, insert_file_batch, build_file_row, build_known_path_filter
+from .bloom import KnownPathFilter, LOOKUP_CHUNK_SIZE
+from .hashing import ContentHasher
+from .utils import infer_metadata, iter_directory_files
+
+# Stat latency (e.g. on NFS) is what limits ingestion, so the workers are threads:
+# os.stat, pwd.getpwuid and the content extractors' reads all release the GIL while they wait.
+DEFAULT_WORKERS = 8
+MAX_WORKERS = 64
+DEFAULT_QUEUE_SIZE = 10000 # Upper bound on paths/rows held in memory between stages
+
+_DONE = object() # Sentinel passed down the queues when a stage has finished
+
+
+class PipelineStats:
+    """
+    Thread-safe counters for an ingestion pipeline run, including throughput
+    and the depth of the bounded queues between the stages.
+    """
+    def __init__(self, path_queue: queue.Queue, row_queue: queue.Queue, hasher: Optional[ContentHasher] = None):
+        self._lock = threading.Lock()
+        self._path_queue = path_queue
+        self._row_queue = row_queue
+        self._hasher = hasher
+        self.started = time.monotonic()
+        self.counters = {"scanned": 0, "inferred": 0, "inserted": 0, "skipped": 0, "errors": 0, "batches": 0}
+        self.known_paths: Optional[KnownPathFilter] = None
+        self.max_path_queue_depth = 0
+        self.max_row_queue_depth = 0
+
+    def increment(self, counter: str, amount: int = 1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def sample_queues(self):
+        """Records the current queue depths so the high-water marks can be reported."""
+        path_depth = self._path_queue.qsize()
+        row_depth = self._row_queue.qsize()
+        with self._lock:
+            self.max_path_queue_depth = max(self.max_path_queue_depth, path_depth)
+            self.max_row_queue_depth = max(self.max_row_queue_depth, row_depth)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns a copy of all counters plus derived throughput figures."""
+        with self._lock:
+            data = dict(self.counters)
+            data["max_path_queue_depth"] = self.max_path_queue_depth
+            data["max_row_queue_depth"] = self.max_row_queue_depth
+        elapsed = time.monotonic() - self.started
+        data["path_queue_depth"] = self._path_queue.qsize()
+        data["row_queue_depth"] = self._row_queue.qsize()
+        data["elapsed_seconds"] = round(elapsed, 3)
+        data["files_per_second"] = round(data["inferred"] / elapsed, 1) if elapsed > 0 else 0.0
+        if self._hasher:
+            data.update(self._hasher.stats())
+        if self.known_paths:
+            data.update({f"prefilter_{counter}": value for counter, value in self.known_paths.stats.items()})
+        return data
+
+
+class IngestPipeline:
+    """
+    Three-stage ingestion of a directory tree:
+
+    1. a producer thread walks the tree (no stat calls) and queues paths; with
+       prefilter=True, paths already cataloged are dropped here, using a
+       KnownPathFilter and batched IN (...) lookups (on its own session) for
+       the filter's possible hits only,
+    2. a bounded pool of worker threads runs infer_metadata() on each path
+       (and, with a ContentHasher, waits for its content hash from the process pool),
+    3. the calling thread writes the resulting rows in adaptive batches.
+
+    The stages are connected by bounded queues, so memory stays flat no matter
+    how large the tree is. The given database session is only ever used from
+    the thread that calls run(). If the producer or a worker fails unexpectedly
+    (e.g. the lookup session loses its connection), the pipeline stops and
+    run() re-raises that error instead of returning partial stats.
+    """
+    def __init__(
+        self,
+        db: Session,
+        root: str,
+        custom_tags: Optional[Dict[str, Any]] = None,
+        owner_id: Optional[int] = None,
+        created_by: Optional[str] = None,
+        workers: int = DEFAULT_WORKERS,
+        batch_size: Optional[int] = None,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+        hasher: Optional[ContentHasher] = None,
+        extract_content: bool = True,
+        prefilter: bool = True
+    ):
+        if not os.path.isdir(root):
+            raise FileNotFoundError(f"Directory not found at: {root}")
+        if workers < 1:
+            raise ValueError("Worker count must be at least 1.")
+
+        self.db = db
+        self.root = os.path.abspath(root)
+        self.custom_tags = custom_tags or {}
+        self.owner_id = owner_id
+        self.created_by = created_by
+        self.workers = min(workers, MAX_WORKERS)
+        self.sizer = AdaptiveBatchSizer(batch_size)
+        self.progress_callback = progress_callback
+        self.hasher = hasher
+        self.extract_content = extract_content
+        self.prefilter = prefilter
+        self.known_paths: Optional[KnownPathFilter] = None
+
+        self._path_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._row_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._error_lock = threading.Lock()
+        self.stats = PipelineStats(self._path_queue, self._row_queue, hasher)
+
+    def _fail(self, error: BaseException):
+        """Records the first error raised in a pipeline thread and stops the pipeline."""
+        with self._error_lock:
+            if self._error is None:
+                self._error = error
+        self._stop.set()
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        """Blocking put that gives up once the pipeline is being stopped."""
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        def _on_walk_error(path: str, error: OSError):
+            self.stats.increment("errors")
+
+        # Possible hits are confirmed on a separate session, as the main one belongs to the writer
+        lookup_db = Session(bind=self.db.get_bind()) if self.known_paths else None
+        possible_hits: List[str] = []
+
+        def _queue_unknown() -> bool:
+            found = self.known_paths.existing(lookup_db, possible_hits)
+            lookup_db.commit()
+            self.stats.increment("skipped", len(found))
+            unknown = [filepath for filepath in possible_hits if filepath not in found]
+            possible_hits.clear()
+            return all(self._put(self._path_queue, filepath) for filepath in unknown)
+
+        try:
+            for filepath, _ in iter_directory_files(self.root, on_error=_on_walk_error, with_stat=False):
+                self.stats.increment("scanned")
+                if self.known_paths and self.known_paths.might_contain(filepath):
+                    possible_hits.append(filepath)
+                    if len(possible_hits) >= LOOKUP_CHUNK_SIZE and not _queue_unknown():
+                        return
+                elif not self._put(self._path_queue, filepath):
+                    return
+            if possible_hits and not _queue_unknown():
+                return
+        except Exception as e:
+            self._fail(e)
+        finally:
+            if lookup_db:
+                lookup_db.close()
+            # One sentinel per worker so every worker gets to shut down
+            for _ in range(self.workers):
+                if not self._put(self._path_queue, _DONE):
+                    break
+
+    def _infer(self):
+        try:
+            while not self._stop.is_set():
+                try:
+                    filepath = self._path_queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if filepath is _DONE:
+                    break
+                try:
+                    inferred_data = infer_metadata(filepath, extract_content=self.extract_content)
+                except FileNotFoundError:
+                    # Removed between the directory listing and the stat
+                    self.stats.increment("errors")
+                    continue
+                if self.hasher:
+                    inferred_data.update(self.hasher.hash_path(filepath))
+                self.stats.increment("inferred")
+                row = build_file_row(filepath, inferred_data, self.owner_id, self.created_by, datetime.now())
+                if not self._put(self._row_queue, row):
+                    return
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(self._row_queue, _DONE)
+
+    def _write(self, rows: List[Dict[str, Any]]):
+        started = time.monotonic()
+        inserted = insert_file_batch(self.db, rows, self.custom_tags)
+        self.sizer.record(len(rows), time.monotonic() - started)
+        self.stats.increment("inserted", inserted)
+        self.stats.increment("skipped", len(rows) - inserted)
+        self.stats.increment("batches")
+        self.stats.sample_queues()
+        if self.progress_callback:
+            self.progress_callback(self.stats.snapshot())
+
+    def run(self) -> Dict[str, Any]:
+        """Runs the pipeline to completion and returns the final stats snapshot."""
+        if self.prefilter:
+            self.known_paths = build_known_path_filter(self.db, self.root)
+            self.stats.known_paths = self.known_paths
+        threads = [threading.Thread(target=self._produce, name="filemeta-walk", daemon=True)]
+        threads += [
+            threading.Thread(target=self._infer, name=f"filemeta-infer-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            pending: List[Dict[str, Any]] = []
+            finished_workers = 0
+            while finished_workers < self.workers and self._error is None:
+                try:
+                    item = self._row_queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue # Stopped workers don't queue their sentinels: recheck for an error
+                if item is _DONE:
+                    finished_workers += 1
+                    continue
+                pending.append(item)
+                if len(pending) >= self.sizer.size:
+                    self._write(pending)
+                    pending = []
+            if pending and self._error is None:
+                self._write(pending)
+        finally:
+            # On success every thread has already finished; on error this unblocks them
+            self._stop.set()
+            for thread in threads:
+                thread.join(timeout=5)
+
+        if self._error is not None:
+            raise self._error
+        return self.stats.snapshot()
+
+
+def run_ingest_pipeline(
+    db: Session,
+    root: str,
+    custom_tags: Optional[Dict[str, Any]] = None,
+    owner_id: Optional[int] = None,
+    created_by: Optional[str] = None,
+    workers: int = DEFAULT_WORKERS,
+    batch_size: Optional[int] = None,
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+    hasher: Optional[ContentHasher] = None,
+    extract_content: bool = True,
+    prefilter: bool = True
+) -> Dict[str, Any]:
+    """
+    Registers every file under root using a parallel IngestPipeline.
+    Returns the final counters (scanned, inferred, inserted, skipped, errors,
+    batches), throughput and queue-depth figures, plus hashing totals and
+    bytes per second when a ContentHasher is given.
+    """
+    pipeline = IngestPipeline(
+        db, root, custom_tags,
+        owner_id=owner_id,
+        created_by=created_by,
+        workers=workers,
+        batch_size=batch_size,
+        progress_callback=progress_callback,
+        hasher=hasher,
+        extract_content=extract_content,
+        prefilter=prefilter
+    )
+    return pipeline.run()
@@ -0,0 +1,368 @@
+# filemeta/query_lang.py
+#
+# A small query language over file metadata, e.g.
+#
+#     project=alpha AND retention_days>=30 AND size>1GB
+#     (mime=image/* OR name~scan) AND NOT archived=true
+#
+# Grammar (AND binds tighter than OR; adjacent terms are ANDed):
+#
+#     expression := and_expr (OR and_expr)*
+#     and_expr   := unary ([AND] unary)*
+#     unary      := NOT unary | '(' expression ')' | HAS field | field op value
+#     op         := '=' | '!=' | '<' | '<=' | '>' | '>=' | '~'
+#
+# A field is one of the built-in FILE_FIELDS, 'inferred.<key>' for any key
+# of the inferred metadata, or else the key of a custom tag ('tag.<key>'
+# reaches a tag that shares its name with a built-in field). Values are bare
+# words or quoted strings; bare words are typed like tag values (int, float,
+# bool, none, str). Values of 'size' may carry a size unit (10MB, 1.5GiB:
+# powers of 1024); elsewhere '4k' or '7b' are plain strings.
+# '=' and '!=' treat '*' and '?' in a bare word as wildcards, '~' is a
+# case-insensitive substring match. Quoted strings are always literal text.
+#
+# Range comparisons against tags use their typed columns: numbers compare
+# numerically, ISO dates chronologically, other strings lexically.
+#
+# parse_query() builds the AST, compile_query() turns it into a SQLAlchemy
+# boolean expression over File whose comparisons hit indexed columns and
+# expressions (see models.py and schema.py).
+import re
+from datetime import datetime
+from typing import List, NamedTuple, Tuple, Union
+
+from sqlalchemy import Numeric, and_, case, cast, func, not_, or_, select
+from sqlalchemy.sql.elements import ColumnElement
+
+from .models import File, Tag
+from .utils import parse_tag_value, parse_timestamp, escape_like
+from .schema import TAG_VALUE_INDEX_PREFIX
+
+COMPARISON_OPERATORS = ("=", "!=", "<", "<=", ">", ">=", "~")
+
+FILE_FIELDS = {
+    "name": "filename", "filename": "filename",
+    "path": "filepath", "filepath": "filepath",
+    "owner": "owner",
+    "created_by": "created_by",
+    "created_at": "created_at",
+    "updated_at": "updated_at",
+    "size": "size",
+    "mime": "mime_type", "mime_type": "mime_type",
+    "mtime": "mtime",
+    "inode": "inode",
+}
+
+_SIZE_UNITS = {"b": 1, "k": 1024, "kb": 1024, "kib": 1024,
+               "m": 1024 ** 2, "mb": 1024 ** 2, "mib": 1024 ** 2,
+               "g": 1024 ** 3, "gb": 1024 ** 3, "gib": 1024 ** 3,
+               "t": 1024 ** 4, "tb": 1024 ** 4, "tib": 1024 ** 4}
+_SIZE_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)([a-z]+)$", re.IGNORECASE)
+
+_TOKEN_PATTERN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<lparen>\()
+  | (?P<rparen>\))
+  | (?P<op>!=|<=|>=|=|<|>|~)
+  | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<word>[^\s()=!<>~"']+)
+""", re.VERBOSE)
+
+_KEYWORDS = ("AND", "OR", "NOT", "HAS")
+
+
+class QuerySyntaxError(ValueError):
+    """Raised for a malformed query; position is the character offset of the problem."""
+    def __init__(self, message: str, position: int):
+        super().__init__(f"{message} (at position {position})")
+        self.position = position
+
+
+# --- AST ---
+
+class Literal(NamedTuple):
+    text: str # As written, without quotes
+    value: Union[str, int, float, bool, None]
+    value_type: str # 'str', 'int', 'float', 'bool' or 'NoneType', as parse_tag_value() reports
+    quoted: bool = False # Quoted strings are taken literally: no typing, size units or wildcards
+
+class Comparison(NamedTuple):
+    field: str
+    op: str
+    literal: Literal
+
+class Has(NamedTuple):
+    field: str
+
+class Not(NamedTuple):
+    operand: "Node"
+
+class And(NamedTuple):
+    operands: Tuple["Node", ...]
+
+class Or(NamedTuple):
+    operands: Tuple["Node", ...]
+
+Node = Union[Comparison, Has, Not, And, Or]
+
+
+# --- Parsing ---
+
+class _Token(NamedTuple):
+    kind: str # 'lparen', 'rparen', 'op', 'string', 'word', 'keyword' or 'end'
+    text: str
+    position: int
+
+
+def tokenize(expression: str) -> List[_Token]:
+    tokens = []
+    position = 0
+    while position < len(expression):
+        match = _TOKEN_PATTERN.match(expression, position)
+        if not match:
+            raise QuerySyntaxError(f"Unexpected character {expression[position]!r}", position)
+        kind, text = match.lastgroup, match.group()
+        if kind == "string":
+            text = re.sub(r"\\(.)", r"\1", text[1:-1])
+        elif kind == "word" and text.upper() in _KEYWORDS:
+            kind = "keyword"
+        if kind != "space":
+            tokens.append(_Token(kind, text, position))
+        position = match.end()
+    tokens.append(_Token("end", "", len(expression)))
+    return tokens
+
+
+def _make_literal(token: _Token) -> Literal:
+    if token.kind == "string":
+        return Literal(token.text, token.text, "str", quoted=True)
+    value, value_type = parse_tag_value(token.text)
+    return Literal(token.text, value, value_type)
+
+
+class _Parser:
+    def __init__(self, expression: str):
+        self.tokens = tokenize(expression)
+        self.index = 0
+
+    def peek(self) -> _Token:
+        return self.tokens[self.index]
+
+    def advance(self) -> _Token:
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def at_keyword(self, keyword: str) -> bool:
+        token = self.peek()
+        return token.kind == "keyword" and token.text.upper() == keyword
+
+    def expect(self, kind: str, description: str) -> _Token:
+        token = self.peek()
+        if token.kind != kind:
+            found = "end of query" if token.kind == "end" else repr(token.text)
+            raise QuerySyntaxError(f"Expected {description}, found {found}", token.position)
+        return self.advance()
+
+    def parse(self) -> Node:
+        node = self.parse_or()
+        token = self.peek()
+        if token.kind != "end":
+            raise QuerySyntaxError(f"Unexpected {token.text!r}", token.position)
+        return node
+
+    def parse_or(self) -> Node:
+        operands = [self.parse_and()]
+        while self.at_keyword("OR"):
+            self.advance()
+            operands.append(self.parse_and())
+        return operands[0] if len(operands) == 1 else Or(tuple(operands))
+
+    def parse_and(self) -> Node:
+        operands = [self.parse_unary()]
+        while True:
+            if self.at_keyword("AND"):
+                self.advance()
+            elif self.peek().kind not in ("word", "string", "lparen") and not (
+                    self.at_keyword("NOT") or self.at_keyword("HAS")):
+                break
+            operands.append(self.parse_unary())
+        return operands[0] if len(operands) == 1 else And(tuple(operands))
+
+    def parse_unary(self) -> Node:
+        token = self.peek()
+        if self.at_keyword("NOT"):
+            self.advance()
+            return Not(self.parse_unary())
+        if self.at_keyword("HAS"):
+            self.advance()
+            return Has(self.expect("word", "a field name").text)
+        if token.kind == "lparen":
+            self.advance()
+            node = self.parse_or()
+            self.expect("rparen", "')'")
+            return node
+        field = self.expect("word", "a field name").text
+        op = self.expect("op", "a comparison operator").text
+        value_token = self.peek()
+        if value_token.kind not in ("word", "string", "keyword"):
+            self.expect("word", "a value")
+        self.advance()
+        return Comparison(field, op, _make_literal(value_token))
+
+
+def parse_query(expression: str) -> Node:
+    """Parses a query expression into its AST. Raises QuerySyntaxError."""
+    if not expression.strip():
+        raise QuerySyntaxError("Empty query", 0)
+    return _Parser(expression).parse()
+
+
+# --- Compiling ---
+
+def glob_to_like(pattern: str) -> str:
+    """Translates a '*'/'?' wildcard pattern into a LIKE pattern (with '\\' escapes)."""
+    return escape_like(pattern).replace("*", "%").replace("?", "_")
+
+
+def _is_glob(literal: Literal) -> bool:
+    return not literal.quoted and literal.value_type == "str" and ("*" in literal.text or "?" in literal.text)
+
+
+def _apply(expression, op: str, value) -> ColumnElement:
+    if op == "=":
+        return expression == value
+    if op == "!=":
+        return expression != value
+    if op == "<":
+        return expression < value
+    if op == "<=":
+        return expression <= value
+    if op == ">":
+        return expression > value
+    return expression >= value
+
+
+def _compare_text(expression, op: str, literal: Literal) -> ColumnElement:
+    if op == "~":
+        return expression.ilike("%" + escape_like(literal.text) + "%")
+    if op in ("=", "!=") and _is_glob(literal):
+        condition = expression.like(glob_to_like(literal.text))
+        return condition if op == "=" else not_(condition)
+    return _apply(expression, op, literal.text)
+
+
+def _require_number(field: str, op: str, literal: Literal):
+    if literal.value_type not in ("int", "float"):
+        raise ValueError(f"'{field}' compares numerically; '{literal.text}' is not a number.")
+    if op == "~":
+        raise ValueError(f"'~' cannot be used with the numeric field '{field}'.")
+    return literal.value
+
+
+def _size_bytes(op: str, literal: Literal):
+    """A 'size' value in bytes: a number or, unquoted, a number with a size unit."""
+    size = None if literal.quoted or op == "~" else _SIZE_PATTERN.match(literal.text)
+    if size and size.group(2).lower() in _SIZE_UNITS:
+        return int(float(size.group(1)) * _SIZE_UNITS[size.group(2).lower()])
+    return _require_number("size", op, literal)
+
+
+def _parse_timestamp(field: str, literal: Literal) -> datetime:
+    timestamp = parse_timestamp(literal.text)
+    if timestamp is None:
+        raise ValueError(f"'{field}' expects an ISO date or timestamp such as 2024-06-30, got '{literal.text}'.")
+    return timestamp
+
+
+def _inferred_number(key: str):
+    return case((func.jsonb_typeof(File.inferred_tags.op("->")(key)) == "number",
+                 cast(File.inferred_tags[key].astext, Numeric)))
+
+
+def _compile_file_field(column: str, op: str, literal: Literal) -> ColumnElement:
+    if column in ("filename", "filepath", "created_by"):
+        return _compare_text(getattr(File, column), op, literal)
+    if column == "mime_type":
+        return _compare_text(File.mime_type, op, literal)
+    if column in ("owner", "inode"):
+        return _apply(getattr(File, column), op, int(_require_number(column, op, literal)))
+    if column == "size":
+        return _apply(File.size_bytes, op, _size_bytes(op, literal))
+    if op == "~":
+        raise ValueError(f"'~' cannot be used with the timestamp field '{column}'.")
+    timestamp = _parse_timestamp(column, literal)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.astimezone() # Local time, like the file system timestamps
+    return _apply(getattr(File, column), op, timestamp)
+
+
+def _compile_inferred(key: str, op: str, literal: Literal) -> ColumnElement:
+    value = File.inferred_tags[key]
+    if literal.value_type in ("int", "float") and op != "~":
+        return _apply(_inferred_number(key), op, literal.value)
+    if literal.value_type == "bool" and op in ("=", "!="):
+        condition = and_(func.jsonb_typeof(File.inferred_tags.op("->")(key)) == "boolean",
+                         value.astext == str(literal.value).lower())
+        return condition if op == "=" else not_(condition)
+    return _compare_text(value.astext, op, literal)
+
+
+def _tag_value_condition(op: str, literal: Literal) -> ColumnElement:
+    # Numbers, booleans and timestamps compare through the typed columns and their (key, value_*) indexes
+    if literal.value_type in ("int", "float") and op != "~":
+        return _apply(Tag.value_float, op, literal.value)
+    if literal.value_type == "bool" and op == "=":
+        return Tag.value_bool == literal.value
+    if literal.value_type == "str" and op in ("<", "<=", ">", ">="):
+        timestamp = parse_timestamp(literal.text)
+        if timestamp is not None:
+            return _apply(Tag.value_ts, op, timestamp)
+    if literal.value_type == "NoneType" and op == "=":
+        return Tag.value_type == "NoneType"
+    if literal.value_type in ("bool", "NoneType") and op != "~":
+        raise ValueError(f"'{literal.text}' can only be compared with '=' or '!='.")
+    if op == "=" and not _is_glob(literal):
+        # The prefix comparison lets the (key, left(value, n)) index find the row
+        prefix_match = func.left(Tag.value, TAG_VALUE_INDEX_PREFIX) == literal.text[:TAG_VALUE_INDEX_PREFIX]
+        return and_(prefix_match, Tag.value == literal.text)
+    return _compare_text(Tag.value, op, literal)
+
+
+def _compile_tag(key: str, op: str, literal: Literal) -> ColumnElement:
+    # 'key != value' matches files that have the tag with another value;
+    # 'NOT key = value' also matches files without the tag.
+    condition = _tag_value_condition("=" if op == "!=" else op, literal)
+    if op == "!=":
+        condition = condition.is_not(True) # Also true where the typed column is NULL
+    return select(Tag.id).where(Tag.file_id == File.id, Tag.key == key, condition).exists()
+
+
+def _compile_has(field: str) -> ColumnElement:
+    if field.startswith("inferred."):
+        return File.inferred_tags.has_key(field[len("inferred."):])
+    if field in FILE_FIELDS:
+        raise ValueError(f"'has' applies to tags and inferred metadata, not to the built-in field '{field}'.")
+    key = field[len("tag."):] if field.startswith("tag.") else field
+    return select(Tag.id).where(Tag.file_id == File.id, Tag.key == key).exists()
+
+
+def compile_query(node: Node) -> ColumnElement:
+    """Compiles a query AST into a boolean SQLAlchemy expression over File. Raises ValueError."""
+    if isinstance(node, And):
+        return and_(*[compile_query(operand) for operand in node.operands])
+    if isinstance(node, Or):
+        return or_(*[compile_query(operand) for operand in node.operands])
+    if isinstance(node, Not):
+        return not_(compile_query(node.operand))
+    if isinstance(node, Has):
+        return _compile_has(node.field)
+
+    field, op, literal = node
+    if field.startswith("inferred."):
+        return _compile_inferred(field[len("inferred."):], op, literal)
+    if field.startswith("tag."):
+        return _compile_tag(field[len("tag."):], op, literal)
+    if field in FILE_FIELDS:
+        return _compile_file_field(FILE_FIELDS[field], op, literal)
+    return _compile_tag(field, op, literal)
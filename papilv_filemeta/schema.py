@@ -0,0 +1,434 @@
+# filemeta/schema.py
+#
+# Schema changes that Base.metadata.create_all() cannot apply to an existing
+# database (new columns on existing tables, functions, triggers, indexes).
+# Every statement is idempotent, so upgrade_schema() runs on each init_db().
+# Indexes are declared as name -> definition and built CONCURRENTLY, outside
+# the transaction, so building one on a large table doesn't block writes.
+import weakref
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import text, bindparam
+from sqlalchemy.engine import Engine
+
+SEARCH_CONFIG = "simple" # No stemming or stop words: file names and tags aren't prose
+
+# The search document of a file: its name (weight A), path components (B),
+# the creator (C) and the string values of the inferred metadata such as MIME
+# types (D). Punctuation is turned into spaces first, so 'report_2024-v2.pdf'
+# becomes the tokens report, 2024, v2 and pdf.
+_SEARCH_DOCUMENT_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION file_search_document(
+    p_filename text, p_filepath text, p_created_by text, p_inferred jsonb
+) RETURNS tsvector
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT
+        setweight(to_tsvector('{SEARCH_CONFIG}', regexp_replace(coalesce(p_filename, ''), '[^[:alnum:]]+', ' ', 'g')), 'A')
+        || setweight(to_tsvector('{SEARCH_CONFIG}', regexp_replace(coalesce(p_filepath, ''), '[^[:alnum:]]+', ' ', 'g')), 'B')
+        || setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(p_created_by, '')), 'C')
+        || setweight(to_tsvector('{SEARCH_CONFIG}', coalesce((
+            SELECT regexp_replace(string_agg(e.value #>> '{{}}', ' '), '[^[:alnum:]]+', ' ', 'g')
+            FROM jsonb_each(p_inferred) e WHERE jsonb_typeof(e.value) = 'string'
+        ), '')), 'D')
+$$;
+"""
+
+# Custom tag keys and values (weight B) are searched through an expression
+# index on tag rather than copied into file.search_vector, so writing tags
+# never rewrites the file row. file_tags_document() gathers them per file to
+# check and rank the candidates that either document matched.
+_TAG_DOCUMENT_FUNCTIONS = [
+    f"""
+CREATE OR REPLACE FUNCTION tag_search_document(p_key text, p_value text) RETURNS tsvector
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT setweight(to_tsvector('{SEARCH_CONFIG}', regexp_replace(p_key || ' ' || coalesce(p_value, ''), '[^[:alnum:]]+', ' ', 'g')), 'B')
+$$;
+""",
+    f"""
+CREATE OR REPLACE FUNCTION file_tags_document(p_file_id integer) RETURNS tsvector
+LANGUAGE sql STABLE AS $$
+    SELECT setweight(to_tsvector('{SEARCH_CONFIG}', coalesce((
+        SELECT regexp_replace(string_agg(t.key || ' ' || t.value, ' '), '[^[:alnum:]]+', ' ', 'g')
+        FROM tag t WHERE t.file_id = p_file_id
+    ), '')), 'B')
+$$;
+""",
+]
+
+_FILE_TRIGGER_FUNCTION = """
+CREATE OR REPLACE FUNCTION file_search_vector_refresh() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.search_vector := file_search_document(NEW.filename, NEW.filepath, NEW.created_by, NEW.inferred_tags);
+    RETURN NEW;
+END
+$$;
+"""
+
+# Tag triggers of earlier versions, which rewrote file.search_vector on every tag write
+_RETIRED_TAG_TRIGGERS = ["tag_search_vector_ins_trg", "tag_search_vector_upd_trg", "tag_search_vector_del_trg"]
+
+_SEARCH_STATEMENTS = [
+    "ALTER TABLE file ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    _SEARCH_DOCUMENT_FUNCTION,
+    *_TAG_DOCUMENT_FUNCTIONS,
+    _FILE_TRIGGER_FUNCTION,
+    "DROP TRIGGER IF EXISTS file_search_vector_trg ON file",
+    """CREATE TRIGGER file_search_vector_trg
+        BEFORE INSERT OR UPDATE OF filename, filepath, created_by, inferred_tags ON file
+        FOR EACH ROW EXECUTE FUNCTION file_search_vector_refresh()""",
+    *[f"DROP TRIGGER IF EXISTS {trigger} ON tag" for trigger in _RETIRED_TAG_TRIGGERS],
+    "DROP FUNCTION IF EXISTS tag_search_vector_refresh()",
+    "DROP FUNCTION IF EXISTS file_search_document(integer, text, text, text, jsonb)",
+]
+
+_SEARCH_INDEXES = {
+    "ix_file_search_vector": "file USING gin (search_vector)",
+    "ix_tag_search_document": "tag USING gin (tag_search_document(key, value))",
+}
+
+# Native typed tag values, filled in for existing rows by 'filemeta backfill-tag-values'
+_TYPED_TAG_STATEMENTS = [
+    "ALTER TABLE tag ADD COLUMN IF NOT EXISTS value_int bigint",
+    "ALTER TABLE tag ADD COLUMN IF NOT EXISTS value_float double precision",
+    "ALTER TABLE tag ADD COLUMN IF NOT EXISTS value_bool boolean",
+    "ALTER TABLE tag ADD COLUMN IF NOT EXISTS value_ts timestamp with time zone",
+]
+
+_TYPED_TAG_INDEXES = {
+    "ix_tag_key_value_int": "tag (key, value_int)",
+    "ix_tag_key_value_float": "tag (key, value_float)",
+    "ix_tag_key_value_bool": "tag (key, value_bool)",
+    "ix_tag_key_value_ts": "tag (key, value_ts)",
+}
+
+# Inferred values promoted to indexed file columns, filled in for existing rows
+# by 'filemeta backfill-file-columns'. Index names follow create_all()'s ix_<table>_<column>.
+_FILE_COLUMN_STATEMENTS = [
+    "ALTER TABLE file ADD COLUMN IF NOT EXISTS size_bytes bigint",
+    "ALTER TABLE file ADD COLUMN IF NOT EXISTS mtime timestamp with time zone",
+    "ALTER TABLE file ADD COLUMN IF NOT EXISTS mime_type varchar(255)",
+    "ALTER TABLE file ADD COLUMN IF NOT EXISTS inode bigint",
+]
+
+_FILE_COLUMN_INDEXES = {
+    "ix_file_size_bytes": "file (size_bytes)",
+    "ix_file_mtime": "file (mtime)",
+    "ix_file_mime_type": "file (mime_type)",
+    "ix_file_inode": "file (inode)",
+}
+
+# Orders served by keyset pagination (see pagination.py)
+_PAGINATION_INDEXES = {
+    "ix_file_updated_at_id": "file (updated_at, id)",
+    "ix_file_owner_id": "file (owner, id)",
+}
+
+# Path prefix matches for directory browsing (metadata_manager.browse_files); the
+# unique index on filepath only serves LIKE 'prefix%' under the C collation
+_BROWSE_INDEXES = {
+    "ix_file_filepath_pattern": "file (filepath text_pattern_ops) INCLUDE (size_bytes)",
+}
+
+# Expression indexes matching the predicates compiled by query_lang.py; the
+# expressions must stay identical to the ones there for the planner to use them
+TAG_VALUE_INDEX_PREFIX = 256 # Characters of tag.value covered by ix_tag_key_value (btree entries are size-limited)
+
+_QUERY_INDEXES = {
+    "ix_tag_key_value": f"tag (key, left(value, {TAG_VALUE_INDEX_PREFIX}))",
+}
+
+# Superseded by the typed tag columns and file.size_bytes
+_DROPPED_INDEXES = ["ix_tag_key_numeric", "ix_file_inferred_size"]
+
+
+# Row versions for optimistic concurrency and ETags (models.File.version)
+_VERSION_STATEMENTS = [
+    "ALTER TABLE file ADD COLUMN IF NOT EXISTS version integer NOT NULL DEFAULT 1",
+]
+
+
+def _cascade_foreign_key(table: str, constraint: str, column: str, referenced: str) -> str:
+    """Recreates a foreign key as ON DELETE CASCADE, unless it already is."""
+    return f"""
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_constraint
+               WHERE conname = '{constraint}' AND conrelid = '{table}'::regclass AND confdeltype <> 'c') THEN
+        ALTER TABLE {table} DROP CONSTRAINT {constraint},
+            ADD CONSTRAINT {constraint} FOREIGN KEY ({column}) REFERENCES {referenced} ON DELETE CASCADE;
+    END IF;
+END
+$$;
+"""
+
+
+# Deleting a user deletes their files, and deleting a file its tags, in the
+# database (the ORM relationships use passive_deletes instead of loading them)
+_CASCADE_STATEMENTS = [
+    _cascade_foreign_key("file", "file_owner_fkey", "owner", '"user" (id)'),
+    _cascade_foreign_key("tag", "tag_file_id_fkey", "file_id", "file (id)"),
+]
+
+SEARCH_BACKFILL_BATCH_SIZE = 5000
+
+
+def _backfill_search_vectors(engine: Engine, all_files: bool = False) -> int:
+    """
+    Computes the search document of every file that doesn't have one yet, or
+    of every file if all_files is set, in batches of consecutive IDs.
+    """
+    total, last_id = 0, 0
+    while True:
+        with engine.begin() as connection:
+            batch = connection.execute(text(f"""
+                UPDATE file f
+                SET search_vector = file_search_document(f.filename, f.filepath, f.created_by, f.inferred_tags)
+                WHERE f.id IN (
+                    SELECT id FROM file WHERE id > :last_id {"" if all_files else "AND search_vector IS NULL"}
+                    ORDER BY id LIMIT :batch_size
+                )
+                RETURNING f.id
+            """), {"last_id": last_id, "batch_size": SEARCH_BACKFILL_BATCH_SIZE}).scalars().all()
+        total += len(batch)
+        if len(batch) < SEARCH_BACKFILL_BATCH_SIZE:
+            return total
+        last_id = max(batch)
+
+
+def _build_indexes(engine: Engine, indexes: Dict[str, str], dropped: Optional[List[str]] = None,
+                   progress_callback: Optional[Callable[[str], None]] = None):
+    """
+    Creates the missing indexes (name -> 'table [USING method] (...)') and drops
+    the dropped ones, all CONCURRENTLY, so writes continue meanwhile. Valid
+    indexes are left alone; an invalid one left behind by an interrupted
+    build is dropped and rebuilt.
+    """
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        existing = dict(connection.execute(text("""
+            SELECT c.relname, i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname IN :names
+        """).bindparams(bindparam("names", expanding=True)), {"names": list(indexes) + (dropped or [])}).all())
+        for index_name in dropped or []:
+            if index_name in existing:
+                connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+        for index_name, definition in indexes.items():
+            if existing.get(index_name):
+                continue
+            if index_name in existing:
+                connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+            if progress_callback:
+                progress_callback(f"Building index {index_name}...")
+            connection.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {definition}"))
+
+
+def upgrade_schema(engine: Engine, progress_callback: Optional[Callable[[str], None]] = print):
+    """
+    Brings an existing database up to the current schema. Safe to run repeatedly.
+
+    Adds the full-text search document (file.search_vector) with the trigger
+    that keeps it current and its GIN index, and fills it in for existing rows
+    the first time the column is created, plus the GIN index over tag text. Adds the typed tag value columns,
+    the promoted file columns (size_bytes, mtime, mime_type, inode) and the
+    indexes used by the query language, keyset pagination and directory browsing,
+    and the file row version, and makes the file owner and tag foreign keys ON DELETE CASCADE.
+
+    Columns, functions and triggers change in one transaction; the indexes are
+    then built CONCURRENTLY (see _build_indexes()), reporting each one that
+    actually has to be built through progress_callback.
+    """
+    with engine.begin() as connection:
+        column_existed = connection.execute(text("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'file' AND column_name = 'search_vector' AND table_schema = current_schema()
+        """)).first() is not None
+        triggers_existed = connection.execute(text(
+            "SELECT 1 FROM pg_trigger WHERE tgname = 'file_search_vector_trg'"
+        )).first() is not None
+        tags_in_documents = connection.execute(text(
+            "SELECT 1 FROM pg_trigger WHERE tgname IN :names"
+        ).bindparams(bindparam("names", expanding=True)), {"names": _RETIRED_TAG_TRIGGERS}).first() is not None
+        for statement in (_SEARCH_STATEMENTS + _TYPED_TAG_STATEMENTS + _FILE_COLUMN_STATEMENTS
+                          + _VERSION_STATEMENTS + _CASCADE_STATEMENTS):
+            connection.execute(text(statement))
+
+    # Also covers a column that create_all() just added without any trigger to fill it
+    # Documents from before tags moved to their own index still hold the tag words
+    if not column_existed or not triggers_existed or tags_in_documents:
+        filled = _backfill_search_vectors(engine, all_files=tags_in_documents)
+        if filled:
+            print(f"Computed search documents for {filled} existing files.")
+
+    # After the backfill, so the GIN index is built once over the filled column
+    _build_indexes(
+        engine,
+        {**_SEARCH_INDEXES, **_TYPED_TAG_INDEXES, **_FILE_COLUMN_INDEXES, **_PAGINATION_INDEXES,
+         **_BROWSE_INDEXES, **_QUERY_INDEXES},
+        dropped=_DROPPED_INDEXES,
+        progress_callback=progress_callback
+    )
+
+
+# --- Optional Trigram Indexes ---
+
+TRIGRAM_INDEXES = {
+    "ix_file_filename_trgm": "filename",
+    "ix_file_filepath_trgm": "filepath",
+}
+
+
+# Engines whose database was found to have the trigram indexes
+_trigram_engines: "weakref.WeakSet[Engine]" = weakref.WeakSet()
+
+
+def trigram_search_enabled(engine: Engine) -> bool:
+    """
+    Returns True if pg_trgm is installed and both trigram indexes are valid.
+    A positive answer is cached per engine, so only the first check (or one
+    after enable_trigram_search()) queries the catalog; a negative one isn't,
+    so a setup run from another process is noticed.
+    """
+    if engine in _trigram_engines:
+        return True
+    with engine.connect() as connection:
+        valid = connection.execute(text("""
+            SELECT count(*) FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname IN :names AND i.indisvalid
+        """).bindparams(bindparam("names", expanding=True)), {"names": list(TRIGRAM_INDEXES)}).scalar()
+    if valid == len(TRIGRAM_INDEXES):
+        _trigram_engines.add(engine)
+        return True
+    return False
+
+
+def enable_trigram_search(engine: Engine, progress_callback: Optional[Callable[[str], None]] = None):
+    """
+    Installs the pg_trgm extension and builds GIN trigram indexes on
+    file.filename and file.filepath, which let substring (ILIKE '%...%')
+    and fuzzy (similarity) searches use an index. Safe to run repeatedly.
+
+    The indexes are built CONCURRENTLY, so writes continue meanwhile. An
+    invalid index left behind by an interrupted build is dropped and rebuilt.
+    Needs a role that may create extensions.
+    """
+    _trigram_engines.discard(engine)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    _build_indexes(
+        engine,
+        {index_name: f"file USING gin ({column} gin_trgm_ops)" for index_name, column in TRIGRAM_INDEXES.items()},
+        progress_callback=progress_callback
+    )
+
+
+# --- Optional Materialized Facet Counts ---
+#
+# facet_count holds catalog-wide value counts for facets.compute_facets(): the
+# number of files ('files'), files per MIME type ('mime_type'), per size bucket
+# ('size') and per custom tag value ('tag:<key>'). Statement-level triggers
+# append one signed delta row per changed (facet, value) instead of updating a
+# shared counter row, so concurrent writers never wait on each other; readers
+# sum the rows, and refresh_facet_counts() folds the deltas together.
+
+# Lower bounds (bytes) of the size histogram buckets after the first, which starts at 0
+SIZE_BUCKET_BOUNDS = [1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2, 1024 ** 3, 10 * 1024 ** 3, 100 * 1024 ** 3]
+SIZE_BUCKET_SQL = f"width_bucket(size_bytes, ARRAY[{', '.join(map(str, SIZE_BUCKET_BOUNDS))}]::bigint[])"
+
+# Facet rows of a set of file or tag rows r carrying a sign n
+_FILE_FACET_ROWS = f"""
+    SELECT 'files' AS facet, '' AS value, n FROM r
+    UNION ALL SELECT 'mime_type', mime_type, n FROM r WHERE mime_type IS NOT NULL
+    UNION ALL SELECT 'size', ({SIZE_BUCKET_SQL})::text, n FROM r WHERE size_bytes IS NOT NULL"""
+_TAG_FACET_ROWS = f"""
+    SELECT 'tag:' || key AS facet, left(value, {TAG_VALUE_INDEX_PREFIX}) AS value, n FROM r"""
+
+
+def _facet_count_insert(rows_sql: str, facet_rows: str) -> str:
+    return f"""
+        WITH r AS ({rows_sql})
+        INSERT INTO facet_count (facet, value, count)
+        SELECT facet, value, sum(n) FROM ({facet_rows}) d GROUP BY facet, value HAVING sum(n) <> 0;"""
+
+
+# Trigger function appending the deltas of a statement; for an UPDATE, rows whose
+# facet values didn't change cancel out and add nothing
+def _facet_count_function(name: str, columns: str, facet_rows: str) -> str:
+    added = f"SELECT {columns}, 1 AS n FROM new_rows"
+    removed = f"SELECT {columns}, -1 AS n FROM old_rows"
+    return f"""
+CREATE OR REPLACE FUNCTION {name}() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN{_facet_count_insert(added, facet_rows)}
+    ELSIF TG_OP = 'DELETE' THEN{_facet_count_insert(removed, facet_rows)}
+    ELSE{_facet_count_insert(f"{added} UNION ALL {removed}", facet_rows)}
+    END IF;
+    RETURN NULL;
+END
+$$;
+"""
+
+
+def _facet_count_triggers(table: str, function: str) -> List[str]:
+    statements = []
+    for event, referencing in (("INSERT", "NEW TABLE AS new_rows"),
+                               ("UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+                               ("DELETE", "OLD TABLE AS old_rows")):
+        trigger = f"{table}_facet_count_{event[:3].lower()}_trg"
+        statements += [
+            f"DROP TRIGGER IF EXISTS {trigger} ON {table}",
+            f"""CREATE TRIGGER {trigger} AFTER {event} ON {table}
+        REFERENCING {referencing}
+        FOR EACH STATEMENT EXECUTE FUNCTION {function}()""",
+        ]
+    return statements
+
+
+FACET_COUNT_TRIGGERS = ["file_facet_count_ins_trg", "file_facet_count_upd_trg", "file_facet_count_del_trg",
+                        "tag_facet_count_ins_trg", "tag_facet_count_upd_trg", "tag_facet_count_del_trg"]
+
+_FACET_COUNT_STATEMENTS = [
+    "CREATE TABLE IF NOT EXISTS facet_count (facet text NOT NULL, value text NOT NULL, count bigint NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_facet_count_facet_value ON facet_count (facet, value) INCLUDE (count)",
+    _facet_count_function("file_facet_count_refresh", "mime_type, size_bytes", _FILE_FACET_ROWS),
+    _facet_count_function("tag_facet_count_refresh", "key, value", _TAG_FACET_ROWS),
+] + _facet_count_triggers("file", "file_facet_count_refresh") + _facet_count_triggers("tag", "tag_facet_count_refresh")
+
+
+def enable_facet_counts(engine: Engine, progress_callback: Optional[Callable[[str], None]] = None):
+    """
+    Creates the facet_count table and its triggers and counts the whole
+    catalog into it. Safe to run repeatedly; each run rebuilds the counts.
+
+    Writes to file and tag wait until the initial count has committed, so
+    the counts and the triggers start from the same state.
+    """
+    with engine.begin() as connection:
+        connection.execute(text("LOCK TABLE file, tag IN SHARE MODE"))
+        if progress_callback:
+            progress_callback("Creating the facet_count table and triggers...")
+        for statement in _FACET_COUNT_STATEMENTS:
+            connection.execute(text(statement))
+        if progress_callback:
+            progress_callback("Counting the catalog...")
+        connection.execute(text("TRUNCATE facet_count"))
+        connection.execute(text(_facet_count_insert("SELECT mime_type, size_bytes, 1 AS n FROM file", _FILE_FACET_ROWS)))
+        connection.execute(text(_facet_count_insert("SELECT key, value, 1 AS n FROM tag", _TAG_FACET_ROWS)))
+
+
+def refresh_facet_counts(engine: Engine) -> int:
+    """
+    Folds the delta rows appended by the facet_count triggers into one row
+    per (facet, value), dropping values that no longer occur, so that reads
+    stay cheap. Runs alongside writers; returns the number of rows folded.
+    """
+    with engine.begin() as connection:
+        return connection.execute(text("""
+            WITH folded AS (DELETE FROM facet_count RETURNING facet, value, count),
+            inserted AS (
+                INSERT INTO facet_count (facet, value, count)
+                SELECT facet, value, sum(count) FROM folded GROUP BY facet, value HAVING sum(count) <> 0
+            )
+            SELECT count(*) FROM folded
+        """)).scalar()
@@ -3,13 +3,22 @@ import os
 import pwd
 import mimetypes
 from datetime import datetime
+from typing import Iterator, Optional, Tuple, Callable
 
-def infer_metadata(filepath: str) -> dict:
+from .extractors import run_extractors
+
+def infer_metadata(filepath: str, stat_info: Optional[os.stat_result] = None, extract_content: bool = True) -> dict:
     """
     Infers basic metadata from a given file path.
 
     Args:
         filepath (str): The absolute or relative path to the file.
+        stat_info (os.stat_result, optional): A stat result that was already
+            obtained for this path (e.g. from os.DirEntry.stat()). When given,
+            the file is not stat'ed a second time.
+        extract_content (bool): Whether to run the registered content
+            extractors (magic bytes, image dimensions, page counts, ...).
+            With False only the stat result and file name are used.
 
     Returns:
         dict: A dictionary containing inferred metadata such as file size,
@@ -17,7 +26,8 @@ def infer_metadata(filepath: str) -> dict:
     """
     inferred_data = {}
     try:
-        stat_info = os.stat(filepath)
+        if stat_info is None:
+            stat_info = os.stat(filepath)
 
         inferred_data['file_size'] = stat_info.st_size
         inferred_data['last_accessed_at'] = datetime.fromtimestamp(stat_info.st_atime).isoformat()
@@ -25,6 +35,8 @@ def infer_metadata(filepath: str) -> dict:
         # On Unix-like systems, st_ctime is the time of last metadata change (e.g., permissions)
         # On Windows, it's typically the creation time.
         inferred_data['created_at_fs'] = datetime.fromtimestamp(stat_info.st_ctime).isoformat()
+        # Inode number lets incremental rescans detect files replaced in place
+        inferred_data['inode'] = stat_info.st_ino
 
         # Try to get owner name (Unix-specific)
         try:
@@ -37,6 +49,17 @@ def infer_metadata(filepath: str) -> dict:
 
         # Infer MIME type
         mime_type, _ = mimetypes.guess_type(filepath)
+
+        if extract_content:
+            try:
+                inferred_data.update(run_extractors(filepath, mime_type))
+            except OSError as e:
+                # Unreadable contents don't prevent cataloging the file itself
+                inferred_data['extractor_errors'] = {'read': str(e)}
+            # Fall back to the sniffed type for extensionless or unknown extensions
+            if not mime_type:
+                mime_type = inferred_data.get('content_mime_type')
+
         inferred_data['mime_type'] = mime_type if mime_type else "application/octet-stream"
 
     except FileNotFoundError:
@@ -49,6 +72,19 @@ def infer_metadata(filepath: str) -> dict:
 
     return inferred_data
 
+def stat_fingerprint(stat_info: os.stat_result) -> Tuple[str, str, str, str]:
+    """
+    Returns the (file_size, last_modified_at, created_at_fs, inode) values that
+    infer_metadata() would store for this stat result, as strings, so they can
+    be compared directly with the text of the stored inferred_tags.
+    """
+    return (
+        str(stat_info.st_size),
+        datetime.fromtimestamp(stat_info.st_mtime).isoformat(),
+        datetime.fromtimestamp(stat_info.st_ctime).isoformat(),
+        str(stat_info.st_ino),
+    )
+
 def parse_tag_value(value: str):
     """
     Parses a string value from CLI and attempts to convert it to its
@@ -74,4 +110,107 @@ def parse_tag_value(value: str):
     except ValueError:
         pass # Not a float
     # Default to string
-    return value, 'str'
\ No newline at end of file
+    return value, 'str'
+
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+def parse_timestamp(value: str) -> Optional[datetime]:
+    """
+    Parses an ISO 8601 date or timestamp ('2024-06-30', '2024-06-30T12:00:00Z',
+    ...) and returns None for anything else.
+    """
+    if len(value) < 10 or not value[:4].isdigit() or value[4] != '-':
+        return None
+    if value.endswith(('Z', 'z')):
+        value = value[:-1] + '+00:00' # fromisoformat() only accepts 'Z' from Python 3.11 on
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+def escape_like(value: str) -> str:
+    """Escapes LIKE wildcards so value can be used as a literal pattern (with the default '\\' escape)."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def typed_tag_columns(typed_value, value_type: str) -> dict:
+    """
+    Returns the native typed columns of a tag (value_int, value_float,
+    value_bool, value_ts) for a value as returned by parse_tag_value().
+    Numbers go to value_float as well as value_int, so range filters need only
+    one column; integers outside the 64-bit range only to value_float. ISO
+    dates and timestamps among string values go to value_ts.
+    """
+    columns = {'value_int': None, 'value_float': None, 'value_bool': None, 'value_ts': None}
+    if value_type == 'int':
+        if INT64_MIN <= typed_value <= INT64_MAX:
+            columns['value_int'] = typed_value
+        try:
+            columns['value_float'] = float(typed_value)
+        except OverflowError:
+            pass # Beyond double precision range; only the text value remains
+    elif value_type == 'float':
+        columns['value_float'] = typed_value
+    elif value_type == 'bool':
+        columns['value_bool'] = typed_value
+    elif value_type == 'str':
+        columns['value_ts'] = parse_timestamp(typed_value)
+    return columns
+
+def promoted_file_columns(inferred_data: dict) -> dict:
+    """
+    Returns the first-class 'file' columns (size_bytes, mtime, mime_type,
+    inode) for an infer_metadata() result. The values stay in inferred_tags
+    as well; missing or malformed ones become None.
+    """
+    size = inferred_data.get('file_size')
+    inode = inferred_data.get('inode')
+    mime_type = inferred_data.get('mime_type')
+    mtime = inferred_data.get('last_modified_at')
+    mtime = parse_timestamp(mtime) if isinstance(mtime, str) else None
+    if mtime is not None and mtime.tzinfo is None:
+        mtime = mtime.astimezone() # infer_metadata() writes local time without an offset
+    return {
+        'size_bytes': size if isinstance(size, int) and not isinstance(size, bool) and 0 <= size <= INT64_MAX else None,
+        'mtime': mtime,
+        'mime_type': mime_type[:255] if isinstance(mime_type, str) else None,
+        'inode': inode if isinstance(inode, int) and not isinstance(inode, bool) and 0 <= inode <= INT64_MAX else None,
+    }
+
+def iter_directory_files(
+    root: str,
+    on_error: Optional[Callable[[str, OSError], None]] = None,
+    with_stat: bool = True,
+    recursive: bool = True
+) -> Iterator[Tuple[str, Optional[os.stat_result]]]:
+    """
+    Walks a directory tree with os.scandir and yields (path, stat_result)
+    for every regular file found.
+
+    The stat result comes from the DirEntry itself, so callers can hand it
+    straight to infer_metadata() instead of stat'ing every file again.
+    With with_stat=False no stat is done at all (file types come from the
+    directory listing) and None is yielded instead, leaving the stat to the
+    caller, e.g. a pool of workers.
+    With recursive=False only the files directly inside root are yielded.
+    Symlinks are not followed. Directories that cannot be read are reported
+    through on_error (if given) and skipped.
+    """
+    stack = [root]
+    while stack:
+        current_dir = stack.pop()
+        try:
+            with os.scandir(current_dir) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive:
+                                stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            yield entry.path, entry.stat(follow_symlinks=False) if with_stat else None
+                    except OSError as e:
+                        # Entry vanished or is unreadable between listing and stat
+                        if on_error:
+                            on_error(entry.path, e)
+        except OSError as e:
+            if on_error:
+                on_error(current_dir, e)
@@ -0,0 +1,484 @@
+# filemeta/watcher.py
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import stat
+import struct
+import time
+from typing import Dict, Any, Iterator, List, Optional, Callable, Tuple
+
+from sqlalchemy.orm import Session
+
+from .models import File
+from .metadata_manager import (
+    update_file_tags,
+    delete_files,
+    sync_file_batch,
+    rescan_directory,
+    move_path_prefix
+)
+
+# --- inotify constants (from <sys/inotify.h>) ---
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+_EVENT_HEADER = struct.Struct('iIII') # wd, mask, cookie, len
+_READ_SIZE = 64 * 1024
+
+DEFAULT_DEBOUNCE_SECONDS = 2.0 # Quiet period after the last event before a batch is applied
+DEFAULT_MAX_DELAY_SECONDS = 30.0 # Apply a batch at the latest this long after its first event
+DEFAULT_MAX_BATCH = 5000 # Apply early once this many paths are pending
+
+
+class Inotify:
+    """
+    Minimal ctypes binding for the Linux inotify API, tracking which
+    directory each watch descriptor belongs to.
+    """
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify is not available on this platform. 'watch' requires Linux.")
+        self._libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            self._raise_errno("inotify_init1")
+        self._wd_to_path: Dict[int, str] = {}
+        self._path_to_wd: Dict[str, int] = {}
+
+    def _raise_errno(self, call: str, path: Optional[str] = None):
+        err = ctypes.get_errno()
+        if err == errno.ENOSPC:
+            raise OSError(err, "inotify watch limit reached. Raise fs.inotify.max_user_watches.", path)
+        raise OSError(err, f"{call} failed: {os.strerror(err)}", path)
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            self._raise_errno("inotify_add_watch", path)
+        self._wd_to_path[wd] = path
+        self._path_to_wd[path] = wd
+        return wd
+
+    def remove_tree(self, directory: str):
+        """Stops watching directory and every watched directory below it."""
+        prefix = directory.rstrip(os.sep) + os.sep
+        for path in [p for p in self._path_to_wd if p == directory or p.startswith(prefix)]:
+            wd = self._path_to_wd.pop(path)
+            self._wd_to_path.pop(wd, None)
+            self._libc.inotify_rm_watch(self.fd, wd) # The kernel may have dropped it already
+
+    def rename_tree(self, old_directory: str, new_directory: str):
+        """Updates the bookkeeping after a watched directory was renamed (the kernel keeps its watches)."""
+        old_prefix = old_directory.rstrip(os.sep) + os.sep
+        for path in [p for p in self._path_to_wd if p == old_directory or p.startswith(old_prefix)]:
+            wd = self._path_to_wd.pop(path)
+            new_path = new_directory + path[len(old_directory):]
+            self._wd_to_path[wd] = new_path
+            self._path_to_wd[new_path] = wd
+
+    def forget(self, wd: int):
+        path = self._wd_to_path.pop(wd, None)
+        if path is not None and self._path_to_wd.get(path) == wd:
+            del self._path_to_wd[path]
+
+    def read_events(self) -> Iterator[Tuple[int, str, int, int]]:
+        """
+        Reads all queued events and yields them as (wd, full_path, mask, cookie)
+        tuples. Paths are resolved as each event is consumed, so events after a
+        directory rename see its new name once the caller has handled it.
+        """
+        raw_events = []
+        while True:
+            try:
+                data = os.read(self.fd, _READ_SIZE)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, name_len = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + name_len].rstrip(b'\0'))
+                offset += name_len
+                raw_events.append((wd, name, mask, cookie))
+        for wd, name, mask, cookie in raw_events:
+            directory = self._wd_to_path.get(wd, '')
+            yield wd, os.path.join(directory, name) if name else directory, mask, cookie
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class CatalogWatcher:
+    """
+    Keeps the catalog in sync with one or more directory trees using inotify.
+
+    Events are debounced and coalesced per path: a burst of writes to one file
+    becomes a single refresh, create-then-delete cancels out, and MOVED_FROM/
+    MOVED_TO pairs become renames. Pending changes are applied in batches:
+    directory renames through move_path_prefix(), file renames (chains
+    collapsed, see _collapse_moves()) through update_file_tags(new_filepath=...),
+    deletions (of files, of files a rename overwrote and of directories that
+    left the watched trees) set-based through delete_files(), and new or
+    modified files through sync_file_batch(). If the kernel event queue
+    overflows, the subtree that saw activity is rescanned instead.
+    """
+    def __init__(
+        self,
+        db: Session,
+        roots: List[str],
+        custom_tags: Optional[Dict[str, Any]] = None,
+        owner_id: Optional[int] = None,
+        created_by: Optional[str] = None,
+        debounce: float = DEFAULT_DEBOUNCE_SECONDS,
+        max_delay: float = DEFAULT_MAX_DELAY_SECONDS,
+        max_batch: int = DEFAULT_MAX_BATCH,
+        progress_callback: Optional[Callable[[Dict[str, int]], None]] = None,
+        error_callback: Optional[Callable[[str, Exception], None]] = None
+    ):
+        for root in roots:
+            if not os.path.isdir(root):
+                raise FileNotFoundError(f"Directory not found at: {root}")
+
+        self.db = db
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.custom_tags = custom_tags or {}
+        self.owner_id = owner_id
+        self.created_by = created_by
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.progress_callback = progress_callback
+        self.error_callback = error_callback
+
+        self.inotify = Inotify()
+        self.stats = {"moved": 0, "deleted": 0, "inserted": 0, "updated": 0, "unchanged": 0,
+                      "rescans": 0, "errors": 0, "batches": 0}
+        self._stopped = False
+        self._reset_pending()
+
+    def _reset_pending(self):
+        self._changed: Dict[str, None] = {} # Ordered set of created/modified file paths
+        self._deleted: Dict[str, None] = {} # Ordered set of deleted file paths
+        self._deleted_dirs: Dict[str, None] = {} # Directories moved out of the watched trees
+        self._moves: List[Tuple[str, str, bool]] = [] # (old_path, new_path, is_dir) in event order
+        self._move_sources: Dict[int, Tuple[str, bool]] = {} # MOVED_FROM halves waiting for their cookie
+        self._active_dirs: Dict[str, None] = {}
+        self._overflowed = False
+        self._first_event_at: Optional[float] = None
+        self._last_event_at: Optional[float] = None
+
+    def _pending_count(self) -> int:
+        return (len(self._changed) + len(self._deleted) + len(self._deleted_dirs)
+                + len(self._moves) + len(self._move_sources))
+
+    # --- Event handling ---
+
+    def _watch_tree(self, directory: str, collect_files: bool = False):
+        """Adds watches for directory and all its subdirectories, optionally queueing the files found."""
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            try:
+                self.inotify.add_watch(current)
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif collect_files and entry.is_file(follow_symlinks=False):
+                            self._mark_changed(entry.path)
+            except FileNotFoundError:
+                continue # Removed again before we got to it
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    raise
+                self._report_error(current, e)
+
+    def _mark_changed(self, path: str):
+        self._deleted.pop(path, None)
+        self._changed[path] = None
+
+    def _mark_deleted(self, path: str):
+        self._changed.pop(path, None)
+        self._deleted[path] = None
+
+    def _handle_event(self, wd: int, path: str, mask: int, cookie: int):
+        now = time.monotonic()
+        if self._first_event_at is None:
+            self._first_event_at = now
+        self._last_event_at = now
+
+        if mask & IN_Q_OVERFLOW:
+            self._overflowed = True
+            return
+        if mask & IN_IGNORED:
+            self.inotify.forget(wd)
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            return # Reported to the parent directory as DELETE/MOVED_FROM as well
+
+        is_dir = bool(mask & IN_ISDIR)
+        self._active_dirs[os.path.dirname(path)] = None
+
+        if mask & IN_MOVED_FROM:
+            self._move_sources[cookie] = (path, is_dir)
+        elif mask & IN_MOVED_TO:
+            source = self._move_sources.pop(cookie, None)
+            if source is None:
+                # Moved in from outside the watched trees: same as a create
+                if is_dir:
+                    self._watch_tree(path, collect_files=True)
+                else:
+                    self._mark_changed(path)
+            elif is_dir:
+                self.inotify.rename_tree(source[0], path)
+                self._moves.append((source[0], path, True))
+                # Pending changes below the old name now live below the new one
+                old_prefix = source[0].rstrip(os.sep) + os.sep
+                for changed_path in [p for p in self._changed if p.startswith(old_prefix)]:
+                    del self._changed[changed_path]
+                    self._changed[path + changed_path[len(source[0]):]] = None
+            else:
+                self._changed.pop(source[0], None)
+                self._moves.append((source[0], path, False))
+                self._mark_changed(path) # ctime changed; also covers a pending create of the old name
+        elif mask & IN_CREATE and is_dir:
+            self._watch_tree(path, collect_files=True)
+        elif mask & IN_DELETE:
+            if not is_dir:
+                self._mark_deleted(path)
+        elif not is_dir:
+            # IN_CREATE, IN_MODIFY, IN_CLOSE_WRITE, IN_ATTRIB on a file
+            self._mark_changed(path)
+
+    # --- Applying batches ---
+
+    def _report_error(self, path: str, error: Exception):
+        self.stats["errors"] += 1
+        if self.error_callback:
+            self.error_callback(path, error)
+
+    def _lookup_ids(self, paths: List[str]) -> Dict[str, int]:
+        if not paths:
+            return {}
+        rows = self.db.query(File.id, File.filepath).filter(File.filepath.in_(paths)).all()
+        return {filepath: file_id for file_id, filepath in rows}
+
+    def _collapse_moves(self) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]], List[str]]:
+        """
+        Reduces the batch's moves to what the catalog needs: the directory
+        moves, in event order; one (cataloged_path, final_path) per moved file,
+        with chains like B -> C -> D collapsed to B -> D (also across directory
+        renames); and the cataloged paths of files a rename overwrote.
+        Cataloged paths are the stored ones, from before the directory moves.
+        """
+        dir_moves: List[Tuple[str, str]] = []
+        chains: Dict[str, str] = {} # Current path of a moved file -> its cataloged path
+        vacated: Dict[str, None] = {} # Current paths no longer holding the file cataloged there
+        replaced: List[str] = []
+
+        def cataloged_path(path: str) -> str:
+            for old_dir, new_dir in reversed(dir_moves):
+                if path.startswith(new_dir.rstrip(os.sep) + os.sep):
+                    path = old_dir + path[len(new_dir):]
+            return path
+
+        def rebase(paths: Dict[str, Any], old_dir: str, new_dir: str) -> Dict[str, Any]:
+            old_prefix = old_dir.rstrip(os.sep) + os.sep
+            return {(new_dir + path[len(old_dir):] if path.startswith(old_prefix) else path): value
+                    for path, value in paths.items()}
+
+        for old_path, new_path, is_dir in self._moves:
+            if is_dir:
+                dir_moves.append((old_path, new_path))
+                chains = rebase(chains, old_path, new_path)
+                vacated = rebase(vacated, old_path, new_path)
+                continue
+            if old_path in chains:
+                source = chains.pop(old_path)
+            elif old_path in vacated:
+                source = None # Created after the cataloged file left: handled as a new file
+            else:
+                source = cataloged_path(old_path)
+            vacated[old_path] = None
+            if new_path in chains:
+                replaced.append(chains.pop(new_path))
+            elif new_path not in vacated:
+                replaced.append(cataloged_path(new_path))
+            vacated[new_path] = None
+            if source is not None:
+                chains[new_path] = source
+        return dir_moves, [(source, final) for final, source in chains.items()], replaced
+
+    def _delete_known(self, known: Dict[str, int]):
+        """Deletes the files at these paths (path -> file ID) in one set-based pass."""
+        if not known:
+            return
+        try:
+            self.stats["deleted"] += delete_files(self.db, file_ids=list(known.values()))["files"]
+        except Exception as e:
+            self._report_error(next(iter(known)), e)
+
+    def _apply_moves(self, dir_moves: List[Tuple[str, str]], file_moves: List[Tuple[str, str]],
+                     replaced: List[str], known_ids: Dict[str, int]):
+        for old_dir, new_dir in dir_moves:
+            try:
+                self.stats["moved"] += move_path_prefix(self.db, old_dir, new_dir)
+            except Exception as e:
+                self._report_error(new_dir, e)
+
+        # Overwritten files, and moved files that are gone again, go before the renames take their paths
+        gone = {path: known_ids.pop(path) for path in replaced if path in known_ids}
+        renames = []
+        for cataloged_path, new_path in file_moves:
+            file_id = known_ids.pop(cataloged_path, None)
+            if file_id is None:
+                continue # Never cataloged: handled as a new file
+            if os.path.exists(new_path):
+                renames.append((file_id, new_path))
+            else:
+                gone[new_path] = file_id
+        self._delete_known(gone)
+
+        for file_id, new_path in renames:
+            try:
+                update_file_tags(self.db, file_id, new_filepath=new_path)
+                self.stats["moved"] += 1
+            except Exception as e:
+                self._report_error(new_path, e)
+
+    def _apply_deletes(self, known_ids: Dict[str, int]):
+        self._delete_known({path: known_ids[path] for path in self._deleted if path in known_ids})
+
+        for directory in self._deleted_dirs:
+            try:
+                # Set-based, in bounded batches, however many files were below it
+                self.stats["deleted"] += delete_files(self.db, path_prefix=directory)["files"]
+            except Exception as e:
+                self._report_error(directory, e)
+
+    def _apply_changes(self):
+        batch = []
+        for path in self._changed:
+            try:
+                stat_info = os.stat(path, follow_symlinks=False)
+            except FileNotFoundError:
+                continue # Created and removed again within the debounce window
+            except OSError as e:
+                self._report_error(path, e)
+                continue
+            if not stat.S_ISREG(stat_info.st_mode):
+                continue
+            batch.append((path, stat_info))
+
+        for start in range(0, len(batch), self.max_batch):
+            chunk = batch[start:start + self.max_batch]
+            try:
+                counts = sync_file_batch(self.db, chunk, self.custom_tags,
+                                         owner_id=self.owner_id, created_by=self.created_by)
+                for counter, value in counts.items():
+                    self.stats[counter] += value
+            except Exception as e:
+                self._report_error(chunk[0][0], e)
+
+    def _overflow_subtrees(self) -> List[str]:
+        """Picks the smallest subtree per root that covers all directories with recent activity."""
+        subtrees = []
+        for root in self.roots:
+            prefix = root.rstrip(os.sep) + os.sep
+            active = [d for d in self._active_dirs if d == root or d.startswith(prefix)]
+            subtrees.append(os.path.commonpath(active) if active else root)
+        return subtrees
+
+    def flush(self):
+        """Applies all pending changes now."""
+        if not self._pending_count() and not self._overflowed:
+            return
+
+        # MOVED_FROM events that never got their MOVED_TO left the watched trees
+        for path, is_dir in self._move_sources.values():
+            if is_dir:
+                self.inotify.remove_tree(path)
+                self._deleted_dirs[path] = None
+            else:
+                self._mark_deleted(path)
+        self._move_sources = {}
+
+        # One IN (...) lookup for every stored path the renames and deletes refer to
+        dir_moves, file_moves, replaced = self._collapse_moves()
+        known_ids = self._lookup_ids(list(self._deleted) + replaced + [source for source, _ in file_moves])
+
+        self._apply_moves(dir_moves, file_moves, replaced, known_ids)
+        self._apply_deletes(known_ids)
+        self._apply_changes()
+
+        if self._overflowed:
+            # Events were lost: re-watch and rescan where the activity was
+            for subtree in self._overflow_subtrees():
+                try:
+                    self._watch_tree(subtree)
+                    counts = rescan_directory(self.db, subtree, self.custom_tags, owner_id=self.owner_id,
+                                              created_by=self.created_by, flag_missing=True)
+                    for counter in ("inserted", "updated", "unchanged"):
+                        self.stats[counter] += counts[counter]
+                    self.stats["rescans"] += 1
+                except Exception as e:
+                    self._report_error(subtree, e)
+
+        self.stats["batches"] += 1
+        self._reset_pending()
+        if self.progress_callback:
+            self.progress_callback(dict(self.stats))
+
+    def _flush_due(self, now: float) -> bool:
+        if self._overflowed:
+            return True
+        if self._first_event_at is None or not self._pending_count():
+            return False
+        return (now - self._last_event_at >= self.debounce
+                or now - self._first_event_at >= self.max_delay
+                or self._pending_count() >= self.max_batch)
+
+    def stop(self):
+        """Asks run() to apply what is pending and return."""
+        self._stopped = True
+
+    def run(self):
+        """Watches the roots until stop() is called, applying changes in debounced batches."""
+        for root in self.roots:
+            self._watch_tree(root)
+        try:
+            while not self._stopped:
+                timeout = self.debounce
+                if self._last_event_at is not None:
+                    timeout = max(0.05, self._last_event_at + self.debounce - time.monotonic())
+                try:
+                    ready, _, _ = select.select([self.inotify.fd], [], [], timeout)
+                except InterruptedError:
+                    continue
+                if ready:
+                    for event in self.inotify.read_events():
+                        self._handle_event(*event)
+                if self._flush_due(time.monotonic()):
+                    self.flush()
+            self.flush()
+        finally:
+            self.inotify.close()
@@ -0,0 +1,82 @@
+import uuid
+
+import pytest
+from sqlalchemy import event
+
+# The tests run against the PostgreSQL database in DATABASE_URL, and the
+# package can't be imported without one: test modules skip themselves when
+# it is unset, and the fixtures import the package lazily.
+
+
+@pytest.fixture(scope="session")
+def engine():
+    from papilv_filemeta import database
+    database.init_db()
+    return database.get_engine()
+
+
+@pytest.fixture
+def db(engine):
+    from papilv_filemeta import database
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def owner_id(db):
+    """The ID of a throwaway user; their files are deleted with them afterwards."""
+    from papilv_filemeta import database
+    from papilv_filemeta.metadata_manager import delete_user
+    user_id = database.create_user(db, f"test-{uuid.uuid4().hex}", "not-a-password-hash").id
+    yield user_id
+    db.rollback()
+    delete_user(db, user_id)
+
+
+@pytest.fixture
+def make_files(db, owner_id, tmp_path):
+    """Creates count files on disk, catalogs them for the owner with tags and returns their IDs."""
+    from papilv_filemeta.metadata_manager import add_file_metadata_batch
+
+    def _make_files(count, name="sample", tags=None):
+        items = []
+        for i in range(count):
+            path = tmp_path / f"{name}_{i}.txt"
+            path.write_text(f"{name} {i}\n")
+            items.append({"filepath": str(path), "custom_tags": dict(tags or {"project": name, "index": i})})
+        results = add_file_metadata_batch(db, items, owner_id=owner_id)
+        assert not [result for result in results if "error" in result]
+        return [result["id"] for result in results]
+    return _make_files
+
+
+class StatementCounter:
+    """Counts the statements sent to the database, and the commits, while active."""
+
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+
+    def reset(self):
+        self.statements = []
+        self.commits = 0
+
+
+@pytest.fixture
+def statements(engine):
+    counter = StatementCounter()
+
+    def _on_execute(conn, cursor, statement, parameters, context, executemany):
+        counter.statements.append(statement)
+
+    def _on_commit(conn):
+        counter.commits += 1
+
+    event.listen(engine, "before_cursor_execute", _on_execute)
+    event.listen(engine, "commit", _on_commit)
+    yield counter
+    event.remove(engine, "before_cursor_execute", _on_execute)
+    event.remove(engine, "commit", _on_commit)
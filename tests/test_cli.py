@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+if not os.getenv("DATABASE_URL"):
+    pytest.skip("DATABASE_URL is not set", allow_module_level=True)
+
+from click.testing import CliRunner
+
+from papilv_filemeta import database  # noqa: F401 -- must come before the models are imported
+from papilv_filemeta.cli import cli
+from papilv_filemeta.metadata_manager import delete_files
+
+
+@pytest.fixture
+def tree(engine, tmp_path):
+    for i in range(3):
+        (tmp_path / f"cli_{i}.txt").write_text("x" * (i + 1))
+    yield tmp_path
+    with database.db_session() as db:
+        delete_files(db, path_prefix=str(tmp_path))
+
+
+def test_scan_then_query(tree):
+    runner = CliRunner()
+    scanned = runner.invoke(cli, ["scan", str(tree)])
+    assert scanned.exit_code == 0, scanned.output
+    assert "3 added" in scanned.output
+
+    queried = runner.invoke(cli, ["query", f"path={tree}/* and size>1"])
+    assert queried.exit_code == 0, queried.output
+    assert "cli_1.txt" in queried.output and "cli_2.txt" in queried.output
+    assert "cli_0.txt" not in queried.output
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+if not os.getenv("DATABASE_URL"):
+    pytest.skip("DATABASE_URL is not set", allow_module_level=True)
+
+from papilv_filemeta import database  # noqa: F401 -- must come before the models are imported
+from papilv_filemeta.metadata_manager import LOADING_PROFILES, list_files_page, search_files_page
+
+FILE_COUNT = 120
+PAGE_SIZES = (1, 25, 100)
+# The page itself, plus one batched IN query for the tags unless the profile skips them
+EXPECTED_STATEMENTS = {"summary": 1, "standard": 2, "full": 2}
+
+
+@pytest.fixture
+def cataloged(make_files):
+    return make_files(FILE_COUNT, name="profilecheck")
+
+
+@pytest.mark.parametrize("limit", PAGE_SIZES)
+@pytest.mark.parametrize("profile", LOADING_PROFILES)
+def test_list_files_page_statements(db, owner_id, cataloged, statements, profile, limit):
+    statements.reset()
+    page = list_files_page(db, owner_id=owner_id, limit=limit, profile=profile)
+
+    assert len(page.items) == limit
+    assert len(statements.statements) == EXPECTED_STATEMENTS[profile]
+    if profile != "summary":
+        # Tags are already loaded: touching them costs nothing more
+        assert all(file.tags for file in page.items)
+        assert len(statements.statements) == EXPECTED_STATEMENTS[profile]
+
+
+@pytest.mark.parametrize("limit", PAGE_SIZES)
+@pytest.mark.parametrize("profile", LOADING_PROFILES)
+@pytest.mark.parametrize("match", ("fulltext", "substring"))
+def test_search_files_page_statements(db, owner_id, cataloged, statements, profile, limit, match):
+    statements.reset()
+    page = search_files_page(db, ["profilecheck"], owner_id=owner_id, limit=limit, match=match, profile=profile)
+
+    assert len(page.items) == limit
+    assert len(statements.statements) == EXPECTED_STATEMENTS[profile]
+    if profile != "summary":
+        assert all(file.tags for file in page.items)
+        assert len(statements.statements) == EXPECTED_STATEMENTS[profile]
+
+
+def test_next_page_statements_do_not_grow(db, owner_id, cataloged, statements):
+    first = list_files_page(db, owner_id=owner_id, limit=25, profile="full")
+    statements.reset()
+    second = list_files_page(db, owner_id=owner_id, limit=25, cursor=first.next_cursor, profile="full")
+
+    assert len(second.items) == 25
+    assert not {file.id for file in first.items} & {file.id for file in second.items}
+    assert len(statements.statements) == EXPECTED_STATEMENTS["full"]
@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+if not os.getenv("DATABASE_URL"):
+    pytest.skip("DATABASE_URL is not set", allow_module_level=True)
+
+from sqlalchemy import text
+
+from papilv_filemeta import database  # noqa: F401 -- must come before the models are imported
+from papilv_filemeta.metadata_manager import search_files, update_file_tags
+
+
+@pytest.fixture
+def file_id(make_files):
+    return make_files(1, name="searchcheck", tags={"campaign": "zephyrine"})[0]
+
+
+def _found(db, owner_id, keyword):
+    return [file.id for file in search_files(db, [keyword], owner_id=owner_id)]
+
+
+def test_tag_value_matches(db, owner_id, file_id):
+    assert _found(db, owner_id, "zephyrine") == [file_id]
+
+
+def test_removed_tag_no_longer_matches(db, owner_id, file_id):
+    update_file_tags(db, file_id, tags_to_remove=["campaign"])
+    assert _found(db, owner_id, "zephyrine") == []
+
+
+def test_keyword_split_between_name_and_tag(db, owner_id, file_id):
+    assert _found(db, owner_id, "searchcheck zephyrine") == [file_id]
+    assert _found(db, owner_id, "searchcheck nosuchword") == []
+
+
+def test_tag_writes_leave_file_row_alone(db, file_id, statements):
+    xmin = db.execute(text("SELECT xmin::text FROM file WHERE id = :id"), {"id": file_id}).scalar()
+    db.commit()
+    statements.reset()
+    db.execute(text("UPDATE tag SET value = 'other' WHERE file_id = :id"), {"id": file_id})
+    db.commit()
+    assert db.execute(text("SELECT xmin::text FROM file WHERE id = :id"), {"id": file_id}).scalar() == xmin
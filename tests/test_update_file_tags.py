@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+if not os.getenv("DATABASE_URL"):
+    pytest.skip("DATABASE_URL is not set", allow_module_level=True)
+
+from papilv_filemeta import database  # noqa: F401 -- must come before the models are imported
+from papilv_filemeta.metadata_manager import get_file_metadata, update_file_tags
+
+# update_file_tags() sends the file UPDATE and one tag statement, then commits
+EXPECTED_STATEMENTS = 2
+EXPECTED_COMMITS = 1
+
+
+@pytest.fixture
+def file_id(make_files):
+    return make_files(1, name="retagcheck", tags={f"key{i}": f"value{i}" for i in range(10)})[0]
+
+
+def _assert_round_trips(statements):
+    assert len(statements.statements) == EXPECTED_STATEMENTS
+    assert statements.commits == EXPECTED_COMMITS
+
+
+@pytest.mark.parametrize("count", (1, 50))
+def test_add_tags(db, file_id, statements, count):
+    new_tags = {f"new{i}": i for i in range(count)}
+    statements.reset()
+    updated = update_file_tags(db, file_id, tags_to_add_modify=new_tags)
+
+    _assert_round_trips(statements)
+    assert {tag.key for tag in updated.tags} == {f"key{i}" for i in range(10)} | set(new_tags)
+    assert updated.version == 2
+
+
+@pytest.mark.parametrize("count", (1, 10))
+def test_remove_tags(db, file_id, statements, count):
+    removed = [f"key{i}" for i in range(count)]
+    statements.reset()
+    updated = update_file_tags(db, file_id, tags_to_remove=removed)
+
+    _assert_round_trips(statements)
+    assert {tag.key for tag in updated.tags} == {f"key{i}" for i in range(count, 10)}
+
+
+def test_remove_and_add_tags(db, file_id, statements):
+    statements.reset()
+    updated = update_file_tags(db, file_id, tags_to_add_modify={"key0": "replaced", "extra": 1},
+                               tags_to_remove=["key0", "key1"])
+
+    _assert_round_trips(statements)
+    tags = {tag.key: tag.value for tag in updated.tags}
+    assert tags["key0"] == "replaced" and "extra" in tags and "key1" not in tags
+
+
+@pytest.mark.parametrize("count", (1, 50))
+def test_overwrite_tags(db, file_id, statements, count):
+    new_tags = {f"new{i}": str(i) for i in range(count)}
+    statements.reset()
+    updated = update_file_tags(db, file_id, tags_to_add_modify=new_tags, overwrite_existing=True)
+
+    _assert_round_trips(statements)
+    assert {tag.key: tag.value for tag in updated.tags} == new_tags
+
+
+def test_rename(db, file_id, statements, tmp_path):
+    new_path = tmp_path / "renamed.txt"
+    new_path.write_text("renamed\n")
+    statements.reset()
+    updated = update_file_tags(db, file_id, tags_to_add_modify={"renamed": True}, new_filepath=str(new_path))
+
+    _assert_round_trips(statements)
+    assert updated.filepath == str(new_path)
+    assert updated.filename == "renamed.txt"
+    assert get_file_metadata(db, file_id).filepath == str(new_path)